@@ -1,5 +1,6 @@
 from database.azure_connector import AzureSQLConnector
 from services.llama_service import LlamaService
+from services.admission import Priority
 
 class TransactionAnalyzer:
     @staticmethod
@@ -36,4 +37,4 @@ Provide insights on:
 2. Regional facility trends
 3. Data anomalies"""
         
-        return LlamaService.query(prompt)
\ No newline at end of file
+        return LlamaService.query(prompt, priority=Priority.BATCH)
\ No newline at end of file
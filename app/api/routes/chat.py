@@ -1,10 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from app.utils.db import get_db
+from app.core.config import settings
 from app.services.llama_service import LlamaService
+from app.services.admission import AdmissionRejected
+from app.services.chat_service import semantic_cache
+from app.services.embedding_service import embed_text
+from app.services.metadata_filter import MetadataFilterIndex, discriminating_terms, extract_filters
 from app.models.transaction import Transaction
+from app.services.prompt_builder import PromptBuilder, compact_table, compact_whitespace, get_tokenizer
+from app.utils.cache import TTLLRUCache, fingerprint
+from app.utils.supply_data_parser import COLUMN_FIELDS
 import logging
 import json
 
@@ -12,6 +23,12 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Regions, facility types, vendors and dates of the transactions table, which
+# /chat questions are scoped by when their context comes from the database.
+# Re-read every SCOPE_TTL_SECONDS; /chat never loads the vector index.
+SCOPE_TTL_SECONDS = 600.0
+_db_scope = TTLLRUCache(max_entries=1, ttl_seconds=SCOPE_TTL_SECONDS)
+
 class CSVData(BaseModel):
     filename: str = Field(..., description="Name of the uploaded file")
     headers: List[str] = Field(..., description="CSV column headers")
@@ -22,6 +39,7 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="User's message")
     session_id: Optional[str] = Field(None, description="Session identifier")
     csv_data: Optional[CSVData] = Field(None, description="Uploaded CSV data")
+    no_cache: bool = Field(False, description="Bypass the response caches and always ask the model")
 
 class ChatResponse(BaseModel):
     response: str = Field(..., description="AI generated response")
@@ -62,26 +80,21 @@ def _generate_suggestions(message: str, has_csv: bool = False) -> List[str]:
             return suggestions
     return suggestions_map['default']
 
-def _format_csv_for_ai(csv_data: CSVData, sample_rows: int = 5) -> str:
-    """Format CSV data for AI context with sample rows"""
+def _format_csv_for_ai(csv_data: CSVData, sample_rows: int = 20) -> str:
+    """Format CSV data for AI context: sample rows as a compact table (the prompt budget may cut rows)"""
+    sample_data = csv_data.data[:sample_rows]
     context = f"CSV File: {csv_data.filename}\n"
     context += f"Total Rows: {csv_data.row_count}\n"
-    context += f"Columns: {', '.join(csv_data.headers)}\n\n"
-    
-    # Add sample data
-    context += "Sample Data:\n"
-    sample_data = csv_data.data[:sample_rows]
-    
-    for i, row in enumerate(sample_data, 1):
-        context += f"Row {i}:\n"
-        for header in csv_data.headers:
-            value = row.get(header, 'N/A')
-            context += f"  {header}: {value}\n"
-        context += "\n"
-    
-    if csv_data.row_count > sample_rows:
-        context += f"... and {csv_data.row_count - sample_rows} more rows\n"
-    
+    if not sample_data:
+        context += f"Columns: {', '.join(csv_data.headers)}\n"
+        return context
+
+    context += f"Sample Data (first {len(sample_data)} rows):\n"
+    context += compact_table(csv_data.headers, sample_data) + "\n"
+
+    if csv_data.row_count > len(sample_data):
+        context += f"... and {csv_data.row_count - len(sample_data)} more rows\n"
+
     return context
 
 def _create_error_response(error: str, session_id: Optional[str]) -> ChatResponse:
@@ -93,6 +106,106 @@ def _create_error_response(error: str, session_id: Optional[str]) -> ChatRespons
         session_id=session_id
     )
 
+async def _build_context(request: ChatRequest, db: Session) -> str:
+    """Uploaded CSV data if present, otherwise relevant database transactions (empty if none)."""
+    # Priority 1: Use uploaded CSV data if available
+    if request.csv_data:
+        logger.info(f"Processing CSV data: {request.csv_data.filename} with {request.csv_data.row_count} rows")
+        return _format_csv_for_ai(request.csv_data)
+
+    # Priority 2: Fall back to database transactions if no CSV
+    try:
+        # Blocking DB call: keep it off the event loop.
+        relevant_transactions = await run_in_threadpool(
+            Transaction.search_relevant, db, request.message, limit=5
+        )
+        if relevant_transactions:
+            return "Recent transaction data from database:\n" + "\n".join(
+                f"- {tx.Vendor} ({tx.FacilityType}, {tx.Region})"
+                for tx in relevant_transactions
+            )
+    except Exception as db_error:
+        logger.warning(f"Database search failed: {str(db_error)}")
+    return ""
+
+def _build_prompt(request: ChatRequest, context: str) -> str:
+    """System prompt, context and the user's question, within the model's prompt token budget"""
+    system_prompt = """You are Earl, an AI assistant specializing in supply chain management and procurement data analysis. 
+        You help users analyze transaction data, vendor information, and supply chain queries.
+        
+        When analyzing CSV data, provide specific insights about:
+        - Key metrics and totals
+        - Vendor/supplier analysis
+        - Department or category breakdowns
+        - Trends and patterns
+        - Cost analysis
+        
+        Always reference specific data points from the provided context when possible.
+        Be friendly but professional and provide actionable insights."""
+
+    budget = settings.LLM_MODEL_PROMPT_BUDGETS.get(settings.LLAMA_MODEL, settings.LLM_PROMPT_TOKEN_BUDGET)
+    builder = PromptBuilder(budget, get_tokenizer(settings.LLM_TOKENIZER))
+    builder.add("system", compact_whitespace(system_prompt), required=True)
+    # Context is the only section that gives way: truncated by whole lines (table rows) to fit.
+    header = "Uploaded CSV Data to Analyze:\n" if request.csv_data else "Database Context:\n"
+    builder.add("context", context, priority=1, header=header)
+    builder.add("question", f"User Question: {request.message}", required=True)
+    prompt = builder.build()
+    logger.debug(f"Prompt sections: {builder.report}")
+    return prompt
+
+def _scope_index(rows: List[Dict[str, Any]]) -> MetadataFilterIndex:
+    """Filter vocabulary over CSV-named rows (Region, Vendor, ...)."""
+    index = MetadataFilterIndex()
+    index.add(0, [{COLUMN_FIELDS[column]: value for column, value in row.items() if column in COLUMN_FIELDS}
+                  for row in rows])
+    return index
+
+def _db_scope_index(db: Session) -> Tuple[MetadataFilterIndex, str]:
+    scope = _db_scope.get("transactions")
+    if scope is None:
+        values = Transaction.distinct_values(db)
+        rows = [{column: value} for column, column_values in values.items() for value in column_values]
+        scope = (_scope_index(rows), fingerprint("db", values))
+        _db_scope.set("transactions", scope)
+    return scope
+
+def _question_scope(request: ChatRequest, db: Session) -> Tuple[Dict[str, Any], str]:
+    """
+    Filters the question names among the values of its data source (the
+    uploaded CSV, else the transactions table) and that data's version.
+    """
+    if request.csv_data:
+        index = _scope_index(request.csv_data.data)
+        return extract_filters(request.message, index), fingerprint(request.csv_data.model_dump())
+    index, version = _db_scope_index(db)
+    return extract_filters(request.message, index), version
+
+async def _semantic_key(request: ChatRequest, context: str, db: Session) -> Optional[tuple]:
+    """
+    (question vector, fingerprint, data version) for semantic_cache, or None
+    when the cache is off, bypassed or the question cannot be embedded. The
+    fingerprint covers the context, the question's extracted filters and its
+    discriminating terms (years, numbers, ordering words), so questions that
+    differ in those never share an answer. The data version is that of the
+    whole uploaded CSV (not just the sampled rows in the context), else of
+    the transactions table's regions, facility types, vendors and dates.
+    """
+    if semantic_cache is None or request.no_cache:
+        return None
+    try:
+        vector = await run_in_threadpool(embed_text, request.message)
+        filters, version = await run_in_threadpool(_question_scope, request, db)
+    except Exception as e:
+        logger.warning(f"Semantic cache skipped, question could not be keyed: {str(e)}")
+        return None
+    source = "csv" if request.csv_data else "db"
+    key = fingerprint("chat", source, context, filters, discriminating_terms(request.message))
+    return vector, key, version
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
     request: ChatRequest,
@@ -104,54 +217,22 @@ async def chat_endpoint(
     logger.info(f"Received chat message: {request.message}")
     logger.info(f"CSV data included: {request.csv_data is not None}")
     
-    context = ""
-    
     try:
-        # Priority 1: Use uploaded CSV data if available
-        if request.csv_data:
-            logger.info(f"Processing CSV data: {request.csv_data.filename} with {request.csv_data.row_count} rows")
-            context = _format_csv_for_ai(request.csv_data)
-            
-        # Priority 2: Fall back to database transactions if no CSV
+        context = await _build_context(request, db)
+        enhanced_prompt = _build_prompt(request, context)
+        semantic_key = await _semantic_key(request, context, db)
+
+        ai_response = semantic_cache.lookup(*semantic_key) if semantic_key is not None else None
+        if ai_response is not None:
+            logger.info("Answered from the semantic cache")
         else:
-            try:
-                relevant_transactions = Transaction.search_relevant(
-                    db, request.message, limit=5
-                )
-                if relevant_transactions:
-                    context = "Recent transaction data from database:\n" + "\n".join(
-                        f"- {tx.Vendor} ({tx.FacilityType}, {tx.Region})" 
-                        for tx in relevant_transactions
-                    )
-            except Exception as db_error:
-                logger.warning(f"Database search failed: {str(db_error)}")
-        
-        # Create enhanced prompt with context
-        system_prompt = """You are Earl, an AI assistant specializing in supply chain management and procurement data analysis. 
-        You help users analyze transaction data, vendor information, and supply chain queries.
-        
-        When analyzing CSV data, provide specific insights about:
-        - Key metrics and totals
-        - Vendor/supplier analysis
-        - Department or category breakdowns
-        - Trends and patterns
-        - Cost analysis
-        
-        Always reference specific data points from the provided context when possible.
-        Be friendly but professional and provide actionable insights."""
-        
-        enhanced_prompt = f"{system_prompt}\n\n"
-        if context:
-            if request.csv_data:
-                enhanced_prompt += f"Uploaded CSV Data to Analyze:\n{context}\n\n"
-            else:
-                enhanced_prompt += f"Database Context:\n{context}\n\n"
-        enhanced_prompt += f"User Question: {request.message}"
-        
-        # Get AI response from LlamaService
-        logger.info("Calling LlamaService...")
-        ai_response = LlamaService.query(enhanced_prompt, max_tokens=400)
-        logger.info(f"AI Response received: {ai_response[:100]}...")
+            # Get AI response from LlamaService
+            logger.info("Calling LlamaService...")
+            ai_response = await LlamaService.aquery(enhanced_prompt, max_tokens=400, use_cache=not request.no_cache)
+            logger.info(f"AI Response received: {ai_response[:100]}...")
+            if semantic_key is not None:
+                vector, context_key, version = semantic_key
+                semantic_cache.store(vector, context_key, ai_response, version)
         
         # Generate contextual suggestions
         suggestions = _generate_suggestions(request.message.lower(), has_csv=(request.csv_data is not None))
@@ -163,6 +244,67 @@ async def chat_endpoint(
             session_id=request.session_id
         )
         
+    except AdmissionRejected:
+        # Overloaded: let the client see 429/503 and Retry-After instead of a canned answer.
+        raise
     except Exception as e:
         logger.error(f"Chat endpoint error: {str(e)}", exc_info=True)
-        return _create_error_response(str(e), request.session_id)
\ No newline at end of file
+        return _create_error_response(str(e), request.session_id)
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming variant of /chat as server-sent events: one "token" event
+    ({"text": ...}) per completion delta as the provider produces it, then a
+    final "done" event with suggestions, context and session_id, or an
+    "error" event if generation fails. The admission slot is taken before the
+    response starts, so overload is answered with 429/503, not an event.
+    """
+    logger.info(f"Received streaming chat message: {request.message}")
+    context = await _build_context(request, db)
+    enhanced_prompt = _build_prompt(request, context)
+    semantic_key = await _semantic_key(request, context, db)
+    cached = semantic_cache.lookup(*semantic_key) if semantic_key is not None else None
+    # Raises AdmissionRejected while the endpoint can still answer 429/503.
+    stream = None if cached is not None else await LlamaService.aopen_stream(
+        enhanced_prompt, max_tokens=400, use_cache=not request.no_cache
+    )
+
+    async def events():
+        try:
+            if stream is None:
+                yield _sse("token", {"text": cached})
+            else:
+                parts = []
+                async for token in stream:
+                    parts.append(token)
+                    yield _sse("token", {"text": token})
+                if semantic_key is not None and parts:
+                    vector, context_key, version = semantic_key
+                    semantic_cache.store(vector, context_key, "".join(parts), version)
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+            fallback = _create_error_response(str(e), request.session_id)
+            yield _sse("error", {"detail": fallback.response, "suggestions": fallback.suggestions,
+                                 "session_id": request.session_id})
+            return
+        finally:
+            if stream is not None:
+                await stream.aclose()
+        suggestions = _generate_suggestions(request.message.lower(), has_csv=(request.csv_data is not None))
+        yield _sse("done", {
+            "suggestions": suggestions[:3],
+            "context": context if context else None,
+            "session_id": request.session_id,
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Releases the slot if the body never starts (events' finally would not run).
+        background=BackgroundTask(stream.aclose) if stream is not None else None,
+    )
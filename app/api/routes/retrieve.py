@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+from app.services.chat_service import ChatService
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+chat_service = ChatService()
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=512, description="Questions to retrieve context for")
+    top_k: int = Field(5, ge=1, le=100, description="Chunks returned per question")
+    filters: Optional[Dict[str, Any]] = Field(None, description="Metadata filter applied to every question")
+
+class RetrievedChunk(BaseModel):
+    text: str = Field(..., description="Chunk text")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Source row metadata")
+    similarity: float = Field(..., description="Cosine similarity to the question")
+    rows: List[Dict[str, Any]] = Field(default_factory=list, description="Purchase rows sharing this text (capped)")
+    row_count: int = Field(1, description="Number of purchase rows sharing this text that match the filters")
+
+class BatchRetrieveResponse(BaseModel):
+    results: List[List[RetrievedChunk]] = Field(..., description="One top-k list per question, in request order")
+
+@router.post("/retrieve/batch", response_model=BatchRetrieveResponse)
+def retrieve_batch_endpoint(request: BatchRetrieveRequest):
+    """
+    Retrieve top-k chunks for many questions in one batched embedding call and vector search
+    """
+    logger.info(f"Batch retrieval for {len(request.queries)} queries (top_k={request.top_k})")
+    try:
+        results = chat_service.retrieve_batch(request.queries, top_k=request.top_k, filters=request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return BatchRetrieveResponse(results=results)
+
+@router.get("/retrieve/cache/stats")
+def retrieval_cache_stats():
+    """
+    Hit/miss statistics of the query-level retrieval cache
+    """
+    return chat_service.cache_stats()
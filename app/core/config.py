@@ -1,7 +1,7 @@
 import os
 from typing import Optional
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 import json
 from pydantic import validator
 
@@ -9,6 +9,44 @@ class Settings(BaseSettings):
     # OpenRouter/AI Configuration (from environment only)
     OPENROUTER_API_KEY: str
     LLAMA_MODEL: str = "meta-llama/llama-4-scout:free"
+    LLM_API_URL: str = "https://openrouter.ai/api/v1/chat/completions"
+
+    # LLM HTTP client (pooled, keep-alive; HTTP/2 when h2 is installed)
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    LLM_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    LLM_HTTP2: bool = True
+
+    # Exact prompt/response cache in front of LlamaService (LLM_CACHE_PATH="" keeps it in memory only)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_TTL_SECONDS: float = 3600.0
+    LLM_CACHE_PATH: str = ""
+    LLM_CACHE_DISK_MAX_ENTRIES: int = 100000
+    # Concurrent identical completions share one provider call
+    LLM_SINGLE_FLIGHT_ENABLED: bool = True
+    # Admission control: concurrent provider calls, priority queue size and max queue wait
+    LLM_ADMISSION_ENABLED: bool = True
+    LLM_MAX_IN_FLIGHT: int = 8
+    LLM_MAX_QUEUE: int = 64
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    # Backend routing: comma-separated order of openrouter, completions, llama_cpp, fake
+    LLM_BACKENDS: str = "openrouter"
+    LLM_HEDGING_ENABLED: bool = True
+    LLM_HEDGE_DELAY_SECONDS: float = 5.0  # until a backend has enough samples for its own p95
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 0.25
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    # Prompt size: token budget per prompt (LLM_MODEL_PROMPT_BUDGETS overrides it per model, as JSON)
+    # and the tokenizer that counts it ("approx", or "tiktoken:<encoding>" when tiktoken is installed)
+    LLM_PROMPT_TOKEN_BUDGET: int = 3000
+    LLM_MODEL_PROMPT_BUDGETS: Dict[str, int] = {}
+    LLM_TOKENIZER: str = "approx"
+    # Local llama_cpp model (app.core.ai), used by the llama_cpp backend
+    LLAMA_MODEL_PATH: str = ""
+    USE_GPU: bool = False
 
     # Cosmos DB Configuration
     COSMOS_DB_ENDPOINT: str
@@ -1,10 +1,14 @@
 from fastapi import FastAPI, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from app.core.logging import setup_logging
 from app.core.config import settings
 from app.utils.db import get_db
-from app.services.llama_service import LlamaService
+from app.services.llama_service import LlamaService, llm_metrics
+from app.services.admission import AdmissionRejected, Priority
+from app.services.llm_client import close_llm_clients
+from app.services.chat_service import semantic_cache
 from app.services.cosmos_service import get_cosmos_service  # Add this import
 from sqlalchemy.orm import Session
 from sqlalchemy import func
@@ -14,6 +18,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.models.transaction import Transaction  
 from app.api.routes.chat import router as chat_router
 from app.api.routes.cosmos import router as cosmos_router  
+from app.api.routes.retrieve import router as retrieve_router
 
 # Logging Setup
 setup_logging()
@@ -36,7 +41,7 @@ async def lifespan(app: FastAPI):
     
     # Test Llama connection on startup
     try:
-        test_response = LlamaService.query("Hello", max_tokens=10)
+        test_response = await LlamaService.aquery("Hello", max_tokens=10, use_cache=False, priority=Priority.BACKGROUND)
         logger.info(f"✅ Llama API connection verified: {test_response[:50]}...")
     except Exception as e:
         logger.error(f"❌ Llama API connection failed: {str(e)}")
@@ -52,6 +57,7 @@ async def lifespan(app: FastAPI):
 
     yield
     logger.info("Shutting down AI Chatbot...")
+    await close_llm_clients()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -86,6 +92,12 @@ app.include_router(
     tags=["AI Chat"]
 )
 
+app.include_router(
+    retrieve_router,
+    prefix="/api/v1",
+    tags=["Retrieval"]
+)
+
 app.include_router(
     cosmos_router,
     prefix="/api/v1/cosmos",
@@ -136,7 +148,7 @@ def full_health_check(db: Session = Depends(get_db)):
     
     # Check Llama API
     try:
-        response = LlamaService.query("Test", max_tokens=5)
+        response = LlamaService.query("Test", max_tokens=5, use_cache=False, priority=Priority.BACKGROUND)
         health_status["services"]["llama_api"] = "healthy"
     except Exception as e:
         health_status["services"]["llama_api"] = f"unhealthy: {str(e)}"
@@ -148,14 +160,21 @@ def full_health_check(db: Session = Depends(get_db)):
     return health_status
 
 @app.get("/api/v1/health/llama")
-def llama_health_check():
+async def llama_health_check():
     """Test Llama API connectivity"""
     try:
-        response = LlamaService.query("Test", max_tokens=5)
+        response = await LlamaService.aquery("Test", max_tokens=5, use_cache=False, priority=Priority.BACKGROUND)
         return {"status": "healthy", "llama_response": response}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Llama API unavailable: {str(e)}")
 
+@app.get("/api/v1/metrics/llm")
+def llm_metrics_endpoint():
+    """LLM cache hit rates, provider call counts/latency and admission queue depth/wait times"""
+    metrics = llm_metrics()
+    metrics["semantic_cache"] = semantic_cache.stats() if semantic_cache is not None else {"enabled": False}
+    return metrics
+
 @app.get("/transactions")
 def list_transactions(db: Session = Depends(get_db)):
     """Legacy endpoint - consider deprecating"""
@@ -214,7 +233,7 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
     
     try:
         # Get relevant transaction data for context
-        relevant_transactions = Transaction.search_relevant(db, request.message, limit=3)
+        relevant_transactions = await run_in_threadpool(Transaction.search_relevant, db, request.message, limit=3)
         
         # Build context for AI
         context = ""
@@ -231,7 +250,7 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
         enhanced_prompt = f"{system_prompt}\n\nContext: {context}\n\nUser Question: {request.message}"
         
         # Get AI response
-        ai_response = LlamaService.query(enhanced_prompt, max_tokens=300)
+        ai_response = await LlamaService.aquery(enhanced_prompt, max_tokens=300)
         
         # Generate contextual suggestions
         suggestions = []
@@ -248,6 +267,8 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
             context=context if context else None
         )
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Chat endpoint error: {str(e)}")
         # Fallback response
@@ -261,7 +282,9 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
 async def chat_test(request: ChatRequest):
     """Simple chat test without database dependency"""
     try:
-        response = LlamaService.query(request.message, max_tokens=100)
+        response = await LlamaService.aquery(request.message, max_tokens=100)
         return {"response": response, "status": "success"}
+    except AdmissionRejected:
+        raise
     except Exception as e:
         return {"response": f"Error: {str(e)}", "status": "error"}
\ No newline at end of file
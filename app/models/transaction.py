@@ -30,4 +30,11 @@ class Transaction(Base):
         return db.query(cls).filter(
             cls.Vendor.ilike(f"%{query}%") |
             cls.FacilityType.ilike(f"%{query}%")
-        ).limit(limit).all()
\ No newline at end of file
+        ).limit(limit).all()
+    @classmethod
+    def distinct_values(cls, db: Session, columns=("Region", "FacilityType", "Vendor", "Year", "Month")):
+        """{column: distinct values} for the given columns, one small query per column"""
+        return {
+            column: [value for (value,) in db.query(getattr(cls, column)).distinct().all()]
+            for column in columns
+        }
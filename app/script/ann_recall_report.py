@@ -0,0 +1,43 @@
+import argparse
+import sys
+
+import numpy as np
+
+from app.services.ann_index import recall_report
+from app.services.vector_search_service import get_vector_index, ANN_PARAMS
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare ANN recall@k and latency against exact vector search.")
+    parser.add_argument("--engine", choices=sorted(ANN_PARAMS), default="ivf")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled query vectors")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--sweep", default="", help="Comma-separated nprobe (ivf) or ef_search (hnsw) values")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled stored vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    index = get_vector_index()
+    if len(index) == 0:
+        print("The vector index is empty; nothing to measure.")
+        return 1
+
+    if index.ann is None or index.ann.kind != args.engine:
+        index.build_ann(args.engine, **ANN_PARAMS[args.engine])
+
+    # Queries are perturbed copies of stored vectors, so every query has
+    # meaningful neighbours without needing the embedding backend.
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(index), min(args.queries, len(index)), replace=False)
+    queries = index.get_vectors(rows) + rng.normal(scale=args.noise, size=(rows.shape[0], index.dim)).astype(np.float32)
+
+    sweep = [int(value) for value in args.sweep.split(",") if value.strip()] or None
+    print(f"{len(index)} documents, {queries.shape[0]} queries, engine={args.engine}")
+    for line in recall_report(index, queries, top_k=args.top_k, settings=sweep):
+        print("  " + ", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                               for key, value in line.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
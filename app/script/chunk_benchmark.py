@@ -0,0 +1,52 @@
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from app.utils.supply_data_parser import (
+    COLUMN_FIELDS, csv_to_purchase_chunks, embedding_text, purchase_text
+)
+from app.utils.synthetic_purchases import generate_purchase_frame
+
+
+def iterrows_chunks(df: pd.DataFrame):
+    """The previous row-at-a-time builder, kept as the benchmark baseline."""
+    chunks = []
+    for _, row in df.iterrows():
+        metadata = {field: row.get(column) for column, field in COLUMN_FIELDS.items()}
+        chunks.append({"text": purchase_text(metadata), "embedding_text": embedding_text(metadata), "metadata": metadata})
+    return chunks
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Time purchase chunk building: iterrows baseline vs column-wise.")
+    parser.add_argument("--rows", default="100000,1000000", help="Comma-separated dataset sizes")
+    parser.add_argument("--baseline-max-rows", type=int, default=1000000,
+                        help="Skip the (slow) iterrows baseline above this many rows")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for rows in (int(value) for value in args.rows.split(",") if value.strip()):
+        df = generate_purchase_frame(rows, args.seed)
+        chunks, vectorized = _timed(csv_to_purchase_chunks, df)
+        _, lazy = _timed(lambda: sum(1 for _ in csv_to_purchase_chunks(df, lazy=True)))
+        line = f"{rows} rows: column-wise {vectorized:.2f}s ({rows / vectorized:,.0f} rows/s), lazy {lazy:.2f}s"
+        if rows <= args.baseline_max_rows:
+            baseline_chunks, baseline = _timed(iterrows_chunks, df)
+            if baseline_chunks != chunks:
+                print(f"{rows} rows: column-wise chunks differ from the iterrows baseline")
+                return 1
+            line += f", iterrows {baseline:.2f}s ({rows / baseline:,.0f} rows/s), speedup {baseline / vectorized:.1f}x"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import argparse
+import sys
+
+import numpy as np
+
+from app.services.vector_codecs import codec_report
+from app.services.vector_search_service import get_vector_index
+
+
+def _parse_config(value: str) -> dict:
+    # "int8", "pq:48" -> {"kind": "pq", "m": 48}
+    kind, _, m = value.partition(":")
+    return {"kind": kind, "m": int(m)} if m else {"kind": kind}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Memory and recall@k of compressed vector codecs against float32 search.")
+    parser.add_argument("--codecs", default="int8,pq:8,pq:16,pq:32",
+                        help="Comma-separated codecs: int8 or pq:<m> (m must divide the vector dimension)")
+    parser.add_argument("--sample", type=int, default=50000, help="Stored vectors to evaluate on")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled query vectors")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank-k", type=int, default=100)
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled stored vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    index = get_vector_index()
+    if len(index) == 0:
+        print("The vector index is empty; nothing to measure.")
+        return 1
+    if index.codec is not None:
+        print(f"Note: the loaded index is already compressed ({index.codec.kind}); "
+              "run with VECTOR_CODEC=none to measure against the original vectors.")
+
+    rng = np.random.default_rng(args.seed)
+    sample = np.sort(rng.choice(len(index), min(args.sample, len(index)), replace=False))
+    vectors = index.get_vectors(sample)
+    picked = rng.choice(sample.shape[0], min(args.queries, sample.shape[0]), replace=False)
+    queries = vectors[picked] + rng.normal(scale=args.noise, size=(picked.shape[0], index.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    configs = [_parse_config(value.strip()) for value in args.codecs.split(",") if value.strip()]
+    print(f"{len(index)} documents (evaluated on {sample.shape[0]}), {queries.shape[0]} queries, dim={index.dim}")
+    for line in codec_report(vectors, queries, configs, top_k=args.top_k, rerank_k=args.rerank_k,
+                             total_rows=len(index)):
+        print("  " + ", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                               for key, value in line.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import argparse
+import sys
+
+from app.services.vector_search_service import collection, VECTOR_SNAPSHOT_DIR, ANN_PARAMS
+from app.services.vector_snapshot import export_snapshot, load_snapshot, ann_path, SUPPORTED_DTYPES
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export the embeddings collection to a memory-mappable snapshot.")
+    parser.add_argument("--output", default=VECTOR_SNAPSHOT_DIR, help="Snapshot root directory (defaults to VECTOR_SNAPSHOT_DIR)")
+    parser.add_argument("--dtype", default="float32", choices=sorted(SUPPORTED_DTYPES), help="On-disk vector precision")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--ann", choices=sorted(ANN_PARAMS), help="Also build and persist this ANN engine")
+    args = parser.parse_args()
+
+    if not args.output:
+        print("No output directory given and VECTOR_SNAPSHOT_DIR is not set.")
+        return 1
+    if collection is None:
+        print("COSMOS_URI is not set; there is no collection to export.")
+        return 1
+
+    version_dir = export_snapshot(collection, args.output, dtype=args.dtype, batch_size=args.batch_size)
+    print(f"Snapshot written to {version_dir}")
+
+    if args.ann:
+        index = load_snapshot(version_dir)
+        ann = index.build_ann(args.ann, **ANN_PARAMS[args.ann])
+        if ann is not None:
+            ann.save(ann_path(version_dir, args.ann))
+            print(f"{args.ann} engine written to {ann_path(version_dir, args.ann)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
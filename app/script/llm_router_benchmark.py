@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from app.services.llm_router import FakeBackend, LLMRouter
+
+
+def _backends(args, primary_failure_rate: float = 0.0):
+    return [
+        FakeBackend("primary", latency=args.primary_latency, tail_latency=args.tail_latency,
+                    tail_rate=args.tail_rate, failure_rate=primary_failure_rate, seed=args.seed),
+        FakeBackend("secondary", latency=args.secondary_latency, seed=args.seed + 1),
+    ]
+
+
+async def _run(router: LLMRouter, requests: int, concurrency: int) -> np.ndarray:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await router.acomplete(f"question {i}")
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return np.array(latencies)
+
+
+def _report(label: str, router: LLMRouter, latencies: np.ndarray):
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    stats = router.stats()
+    print(f"{label}: p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms; hedged {stats['hedged']}, "
+          f"failovers {stats['failovers']}, unavailable {stats['unavailable']}")
+    for backend in stats["backends"]:
+        print(f"  {backend['name']}: {backend['calls']} calls, {backend['failures']} failures, "
+              f"{backend['wins']} wins, breaker {backend['breaker']} (opened {backend['breaker_opened']}x)")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="LLMRouter against fake backends: tail latency with and without hedging, and failover.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--primary-latency", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="Extra latency of the primary's slow calls")
+    parser.add_argument("--tail-rate", type=float, default=0.05, help="Share of the primary's calls that are slow")
+    parser.add_argument("--secondary-latency", type=float, default=0.08)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for hedging in (False, True):
+        router = LLMRouter(_backends(args), hedging=hedging, hedge_delay_seconds=1.0, hedge_min_delay_seconds=0.01)
+        latencies = asyncio.run(_run(router, args.requests, args.concurrency))
+        _report(f"hedging {'on' if hedging else 'off'}", router, latencies)
+
+    router = LLMRouter(_backends(args, primary_failure_rate=1.0), hedging=True, hedge_min_delay_seconds=0.01,
+                       reset_seconds=60.0)
+    latencies = asyncio.run(_run(router, args.requests, args.concurrency))
+    _report("primary down", router, latencies)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.services.chat_service import ChatService, retrieval_cache
+from app.services.embedding_service import EMBEDDING_BACKEND, process_and_embed_csv
+from app.services.vector_search_service import collection, get_vector_index
+from app.utils.synthetic_purchases import ITEM_COUNT, REGIONS, VENDORS, generate_purchase_frame
+
+QUESTIONS = [
+    "Who bought ITEM {item} in the {region} region?",
+    "Which facilities purchased ITEM {item} from {vendor} in {year}?",
+    "What was the total spend with {vendor} in the {region} region in {year}?",
+    "How much did hospitals spend on ITEM {item} in Q{quarter} {year}?",
+]
+
+
+def _questions(count: int, rng: np.random.Generator):
+    return [
+        QUESTIONS[i % len(QUESTIONS)].format(
+            item=rng.integers(0, ITEM_COUNT), region=REGIONS[rng.integers(len(REGIONS))],
+            vendor=VENDORS[rng.integers(len(VENDORS))], year=rng.integers(2021, 2025), quarter=rng.integers(1, 5),
+        )
+        for i in range(count)
+    ]
+
+
+def _ask(service: ChatService, question: str) -> float:
+    start = time.perf_counter()
+    _, _, chunks = service.retrieve(question)
+    service.build_context_string(chunks)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Offline load test: synthetic CSV -> process_and_embed_csv -> ChatService retrieval.")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic purchase rows to ingest")
+    parser.add_argument("--batch-rows", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=500, help="Questions to ask after ingestion")
+    parser.add_argument("--distinct", type=int, default=200, help="Distinct questions among them (the rest repeat)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions in flight at once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if collection is not None:
+        print("COSMOS_URI is set; unset it so the load test runs against the in-process store.")
+        return 1
+    print(f"Embedding backend: {EMBEDDING_BACKEND}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic_purchases.csv")
+        generate_purchase_frame(args.rows, args.seed).to_csv(path, index=False)
+        start = time.perf_counter()
+        process_and_embed_csv(path, batch_rows=args.batch_rows, resume=False)
+        ingest_seconds = time.perf_counter() - start
+
+    index = get_vector_index()
+    print(f"Ingested {args.rows} rows in {ingest_seconds:.1f}s ({args.rows / ingest_seconds:,.0f} rows/s): "
+          f"{len(index)} entries, {index.row_count} rows.")
+
+    rng = np.random.default_rng(args.seed)
+    distinct = _questions(args.distinct, rng)
+    questions = [distinct[i] for i in rng.integers(0, len(distinct), args.queries)]
+    service = ChatService()
+    # The first question builds lazily created structures (e.g. the BM25 index); time it apart.
+    print(f"Warm-up question: {_ask(service, 'Who bought ITEM 1?') * 1000:.1f} ms")
+    retrieval_cache.clear()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = np.array(list(pool.map(lambda question: _ask(service, question), questions)))
+    wall = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    print(f"{args.queries} questions ({args.distinct} distinct) at concurrency {args.concurrency}: "
+          f"{args.queries / wall:.1f} q/s, latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    print(f"Retrieval cache: {service.cache_stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+Admission control for LLM provider calls.
+
+At most max_in_flight calls run at once; the rest wait in a priority queue
+(lower Priority value first, FIFO within a priority) of at most max_queue
+entries. A caller that is not admitted within its queue timeout gets 503.
+When the queue is full, a new caller either sheds the newest waiter of a
+lower priority (which gets 503) or, if there is none, is rejected at once
+with 429. Both carry Retry-After, so a burst fails fast instead of every
+request timing out against a rate-limited provider.
+
+Works for threads (slot) and coroutines (aslot) alike: waiters are woken
+through a threading.Event or, for coroutines, a future on their own loop.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # chat endpoints
+    BATCH = 1  # TransactionAnalyzer and other scripts
+    BACKGROUND = 2  # health probes
+
+
+class AdmissionRejected(HTTPException):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "enqueued", "deadline", "state", "event", "loop", "future")
+
+    def __init__(self, priority: Priority, seq: int, deadline: float, loop: Optional[asyncio.AbstractEventLoop]):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.deadline = deadline
+        self.state = "waiting"  # -> admitted | shed | expired
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = 8, max_queue: int = 64, queue_timeout: float = 10.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._queue: List[_Waiter] = []
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)  # seconds queued, for recently admitted calls
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.shed = 0
+        self.expired = 0
+
+    @contextmanager
+    def slot(self, priority: Priority = Priority.INTERACTIVE, queue_timeout: Optional[float] = None):
+        """Hold one in-flight slot for the body; blocks the calling thread while queued."""
+        waiter = self._enter(priority, queue_timeout, loop=None)
+        if waiter is not None:
+            waiter.event.wait(max(0.0, waiter.deadline - time.monotonic()))
+            self._settle(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: Priority = Priority.INTERACTIVE, queue_timeout: Optional[float] = None):
+        """Hold one in-flight slot for the body; awaits (without blocking the loop) while queued."""
+        waiter = self._enter(priority, queue_timeout, loop=asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait([waiter.future], timeout=max(0.0, waiter.deadline - time.monotonic()))
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._settle(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enter(self, priority: Priority, queue_timeout: Optional[float],
+               loop: Optional[asyncio.AbstractEventLoop]) -> Optional[_Waiter]:
+        """None when admitted immediately, else the queued waiter."""
+        timeout = self.queue_timeout if queue_timeout is None else queue_timeout
+        shed = None
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._queue:
+                self._in_flight += 1
+                self.admitted += 1
+                self._waits.append(0.0)
+                return None
+            if len(self._queue) >= self.max_queue:
+                # Newest waiter of the lowest priority present.
+                victim = max(self._queue, key=lambda waiter: (waiter.priority, waiter.seq), default=None)
+                if victim is None or victim.priority <= priority:
+                    self.rejected += 1
+                    raise AdmissionRejected(429, "LLM request queue is full, try again shortly", self._retry_after())
+                self._queue.remove(victim)
+                heapq.heapify(self._queue)
+                victim.state = "shed"
+                self.shed += 1
+                shed = victim
+            waiter = _Waiter(priority, next(self._seq), time.monotonic() + timeout, loop)
+            heapq.heappush(self._queue, waiter)
+            self.queued += 1
+        if shed is not None:
+            shed.wake()
+        return waiter
+
+    def _settle(self, waiter: _Waiter):
+        """After waking or timing out: return if admitted, else raise 503."""
+        with self._lock:
+            if waiter.state == "admitted":
+                return
+            if waiter.state == "waiting":
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                waiter.state = "expired"
+                self.expired += 1
+            state = waiter.state
+            retry_after = self._retry_after()
+        if state == "shed":
+            raise AdmissionRejected(503, "LLM request shed for higher-priority work", retry_after)
+        raise AdmissionRejected(503, "Timed out waiting for an LLM slot", retry_after)
+
+    def _abandon(self, waiter: _Waiter):
+        """A cancelled waiter leaves the queue, handing its slot on if it had just been admitted."""
+        with self._lock:
+            if waiter.state == "waiting":
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                waiter.state = "expired"
+                return
+            admitted = waiter.state == "admitted"
+        if admitted:
+            self._release()
+
+    def _release(self):
+        woken = []
+        with self._lock:
+            now = time.monotonic()
+            handed_off = False
+            while self._queue:
+                waiter = heapq.heappop(self._queue)
+                woken.append(waiter)
+                if waiter.deadline <= now:
+                    waiter.state = "expired"
+                    self.expired += 1
+                    continue
+                # The slot passes straight to the next waiter; in_flight is unchanged.
+                waiter.state = "admitted"
+                self.admitted += 1
+                self._waits.append(now - waiter.enqueued)
+                handed_off = True
+                break
+            if not handed_off:
+                self._in_flight -= 1
+        for waiter in woken:
+            waiter.wake()
+
+    def _retry_after(self) -> float:
+        return max(1.0, sum(self._waits) / len(self._waits)) if self._waits else 1.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = {priority.name.lower(): 0 for priority in Priority}
+            for waiter in self._queue:
+                depth[Priority(waiter.priority).name.lower()] += 1
+            waits = sorted(self._waits)
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "max_queue": self.max_queue,
+                "queue_depth": len(self._queue),
+                "queue_depth_by_priority": depth,
+                "queue_timeout_seconds": self.queue_timeout,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_queue_full": self.rejected,
+                "shed": self.shed,
+                "expired": self.expired,
+                "wait_seconds": {
+                    "mean": sum(waits) / len(waits) if waits else 0.0,
+                    "p50": waits[len(waits) // 2] if waits else 0.0,
+                    "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "max": waits[-1] if waits else 0.0,
+                },
+            }
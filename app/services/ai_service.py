@@ -1,7 +1,8 @@
 import os
-import requests
+import httpx
 from typing import Dict, Any
 from dotenv import load_dotenv
+from app.services.llm_client import get_async_client, get_sync_client, llm_timeout
 
 load_dotenv()
 
@@ -11,18 +12,20 @@ LLAMA_API_KEY = os.getenv("LLAMA_API_KEY", "")
 DEFAULT_MAX_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "256"))
 DEFAULT_MODEL_NAME = os.getenv("LLAMA_MODEL_NAME", "llama2")
 
+# Returned instead of raising when the API call fails.
+GENERATION_ERROR = " Error generating response from LLaMA API."
+# Failures that yield GENERATION_ERROR: transport and HTTP status errors, a
+# malformed URL and a response body that is not JSON.
+API_ERRORS = (httpx.HTTPError, httpx.InvalidURL, ValueError)
+
 HEADERS = {
     "Content-Type": "application/json",
     "Authorization": f"Bearer {LLAMA_API_KEY}" if LLAMA_API_KEY else ""
 }
 
 
-def generate_response(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, **kwargs: Dict[str, Any]) -> str:
-    """
-    Generate a completion using the external LLaMA API.
-    Compatible with Ollama, Together AI, or other hosted endpoints.
-    """
-    payload = {
+def _payload(prompt: str, max_tokens: int, **kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "model": DEFAULT_MODEL_NAME,
         "prompt": prompt,
         "max_tokens": max_tokens,
@@ -30,20 +33,52 @@ def generate_response(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, **kwarg
         **kwargs
     }
 
+
+def _completion_text(response: httpx.Response) -> str:
+    response.raise_for_status()
+
+    data = response.json()
+
+    # If using TogetherAI or Replicate, the structure may vary
+    if "choices" in data:
+        return data["choices"][0]["text"].strip()
+    elif "response" in data:
+        return data["response"].strip()
+    else:
+        return str(data).strip()
+
+
+def generate_response(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, **kwargs: Dict[str, Any]) -> str:
+    """
+    Generate a completion using the external LLaMA API.
+    Compatible with Ollama, Together AI, or other hosted endpoints.
+    Blocking; async callers should use agenerate_response.
+    """
+    if not LLAMA_API_URL:
+        print(" LLaMA API error: LLAMA_API_URL is not set")
+        return GENERATION_ERROR
     try:
-        response = requests.post(LLAMA_API_URL, json=payload, headers=HEADERS)
-        response.raise_for_status()
+        response = get_sync_client().post(
+            LLAMA_API_URL, json=_payload(prompt, max_tokens, **kwargs), headers=HEADERS, timeout=llm_timeout()
+        )
+        return _completion_text(response)
+
+    except API_ERRORS as e:
+        print(f" LLaMA API error: {e}")
+        return GENERATION_ERROR
 
-        data = response.json()
 
-        # If using TogetherAI or Replicate, the structure may vary
-        if "choices" in data:
-            return data["choices"][0]["text"].strip()
-        elif "response" in data:
-            return data["response"].strip()
-        else:
-            return str(data).strip()
+async def agenerate_response(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, **kwargs: Dict[str, Any]) -> str:
+    """generate_response over the shared async client; does not block the event loop."""
+    if not LLAMA_API_URL:
+        print(" LLaMA API error: LLAMA_API_URL is not set")
+        return GENERATION_ERROR
+    try:
+        response = await get_async_client().post(
+            LLAMA_API_URL, json=_payload(prompt, max_tokens, **kwargs), headers=HEADERS, timeout=llm_timeout()
+        )
+        return _completion_text(response)
 
-    except requests.RequestException as e:
+    except API_ERRORS as e:
         print(f" LLaMA API error: {e}")
-        return " Error generating response from LLaMA API."
+        return GENERATION_ERROR
@@ -0,0 +1,396 @@
+"""
+Approximate nearest neighbour engines for VectorIndex.
+
+Both engines work on the normalized vectors held by a VectorIndex and only
+store row numbers, so snapshots, memory-mapped bases and incremental adds
+keep working. Rows tombstoned by VectorIndex.upsert_many stay in the engine
+and are masked out of results until the index rebuilds it (see
+VectorIndex.ann_rebuild_fraction). Candidate rows are scored through the index's score_rows
+callback, which means the final similarities are exact cosine scores.
+
+- IVFIndex: spherical k-means centroids with an inverted list per centroid.
+  nprobe controls how many lists are scanned per query (recall vs latency).
+- HNSWIndex: hierarchical navigable small world graph. ef_search controls the
+  size of the dynamic candidate list (recall vs latency). Construction runs in
+  Python, so IVF is the better fit for multi-million row corpora.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ScoreRows = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def spherical_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    iterations: int = 20,
+    seed: int = 0,
+    block_rows: int = 65536,
+) -> np.ndarray:
+    """Cluster normalized vectors by cosine similarity; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    n_clusters = max(1, min(n_clusters, n))
+    centroids = np.asarray(vectors[rng.choice(n, n_clusters, replace=False)], dtype=np.float32).copy()
+
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for start in range(0, n, block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            assignment = np.argmax(block @ centroids.T, axis=1)
+            np.add.at(sums, assignment, block)
+            counts += np.bincount(assignment, minlength=n_clusters)
+
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random points so every list stays useful.
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def _top_k(rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+    k = min(top_k, scores.shape[0])
+    if k == 0:
+        return []
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(rows[i]), float(scores[i])) for i in order]
+
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, train_size: int = 100000, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[array] = []
+        self._score_rows: Optional[ScoreRows] = None
+        self._lock = threading.Lock()
+
+    def attach(self, score_rows: ScoreRows, vectors_for: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+        self._score_rows = score_rows
+
+    def spawn(self) -> "IVFIndex":
+        """An empty engine with the same parameters, for rebuilding."""
+        return IVFIndex(nlist=self.nlist, nprobe=self.nprobe, train_size=self.train_size, seed=self.seed)
+
+    def build(self, vectors: np.ndarray, rows: Optional[np.ndarray] = None):
+        """Index vectors as rows (0, 1, ... by default)."""
+        n = vectors.shape[0]
+        if n == 0:
+            raise ValueError("Cannot build an IVF index over an empty matrix")
+        nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+        rng = np.random.default_rng(self.seed)
+        if n > self.train_size:
+            sample = np.sort(rng.choice(n, self.train_size, replace=False))
+            training = np.asarray(vectors[sample], dtype=np.float32)
+        else:
+            training = np.asarray(vectors, dtype=np.float32)
+        self.centroids = spherical_kmeans(training, nlist, seed=self.seed)
+        self.nlist = self.centroids.shape[0]
+        self._lists = [array("q") for _ in range(self.nlist)]
+        self.add(np.arange(n) if rows is None else rows, vectors)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray, block_rows: int = 65536):
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, rows.shape[0], block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            assignment = np.argmax(block @ self.centroids.T, axis=1)
+            with self._lock:
+                for row, list_id in zip(rows[start:start + block_rows].tolist(), assignment.tolist()):
+                    self._lists[list_id].append(row)
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        # Copy under the lock: add() cannot grow an array while a view of it is alive.
+        with self._lock:
+            lists = [np.array(self._lists[i], dtype=np.int64) for i in probe if len(self._lists[i])]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(lists)
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k rows from the nprobe nearest lists. With a boolean row mask only
+        masked rows are scored, and nprobe doubles until top_k of them are found.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        while True:
+            rows = self.candidates(query, nprobe)
+            if mask is not None:
+                rows = rows[rows < mask.shape[0]]
+                rows = rows[mask[rows]]
+            if mask is None or rows.shape[0] >= top_k or nprobe >= self.nlist:
+                break
+            nprobe = min(nprobe * 2, self.nlist)
+        if rows.shape[0] == 0:
+            return []
+        return _top_k(rows, self._score_rows(query, rows), top_k)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        lengths = np.array([len(lst) for lst in self._lists], dtype=np.int64)
+        rows = np.concatenate([np.frombuffer(lst, dtype=np.int64) for lst in self._lists]) if self._lists else np.empty(0, dtype=np.int64)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "list_rows.npy"), rows)
+        np.save(os.path.join(path, "list_offsets.npy"), np.concatenate([[0], np.cumsum(lengths)]))
+        with open(os.path.join(path, "params.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "nlist": self.nlist, "nprobe": self.nprobe,
+                       "train_size": self.train_size, "seed": self.seed}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with open(os.path.join(path, "params.json"), encoding="utf-8") as f:
+            params = json.load(f)
+        ivf = cls(nlist=params["nlist"], nprobe=params["nprobe"],
+                  train_size=params["train_size"], seed=params["seed"])
+        ivf.centroids = np.load(os.path.join(path, "centroids.npy"))
+        rows = np.load(os.path.join(path, "list_rows.npy"))
+        offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        ivf._lists = [array("q", rows[offsets[i]:offsets[i + 1]].tobytes()) for i in range(len(offsets) - 1)]
+        return ivf
+
+
+class HNSWIndex:
+    kind = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 0):
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._level_mult = 1 / math.log(max(m, 2))
+        self._rng = np.random.default_rng(seed)
+        self.entry_point: Optional[int] = None
+        self.max_level = -1
+        # graph[level][row] -> neighbour rows
+        self.graph: List[Dict[int, List[int]]] = []
+        self._score_rows: Optional[ScoreRows] = None
+        self._vectors_for: Optional[Callable[[np.ndarray], np.ndarray]] = None
+
+    def attach(self, score_rows: ScoreRows, vectors_for: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+        self._score_rows = score_rows
+        self._vectors_for = vectors_for
+
+    def spawn(self) -> "HNSWIndex":
+        """An empty engine with the same parameters, for rebuilding."""
+        return HNSWIndex(m=self.m, ef_construction=self.ef_construction, ef_search=self.ef_search, seed=self.seed)
+
+    def build(self, vectors: np.ndarray, rows: Optional[np.ndarray] = None):
+        """Index vectors as rows (0, 1, ... by default)."""
+        self.add(np.arange(vectors.shape[0]) if rows is None else rows, vectors)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        for row, vector in zip(np.asarray(rows).tolist(), vectors):
+            self._insert(int(row), np.asarray(vector, dtype=np.float32))
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entry_points: List[int],
+        ef: int,
+        level: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Best ef rows reachable from entry_points on one level. With a boolean
+        row mask the walk goes through every row but only masked rows are kept.
+        """
+        layer = self.graph[level]
+        visited = set(entry_points)
+
+        def kept(row: int) -> bool:
+            return mask is None or (row < mask.shape[0] and bool(mask[row]))
+
+        entry_scores = self._score_rows(query, np.array(entry_points, dtype=np.int64))
+        candidates = [(-float(s), row) for s, row in zip(entry_scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), row) for s, row in zip(entry_scores, entry_points) if kept(row)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_score, current = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+            neighbours = [n for n in layer.get(current, ()) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            scores = self._score_rows(query, np.array(neighbours, dtype=np.int64))
+            for row, score in zip(neighbours, scores.tolist()):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, row))
+                    if kept(row):
+                        heapq.heappush(results, (score, row))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _prune(self, row: int, level: int, limit: int):
+        neighbours = self.graph[level][row]
+        if len(neighbours) <= limit:
+            return
+        vector = self._vectors_for(np.array([row]))[0]
+        scores = self._score_rows(vector, np.array(neighbours, dtype=np.int64))
+        keep = np.argsort(-scores, kind="stable")[:limit]
+        self.graph[level][row] = [neighbours[i] for i in keep]
+
+    def _insert(self, row: int, vector: np.ndarray):
+        level = int(-math.log(max(self._rng.random(), 1e-12)) * self._level_mult)
+        while len(self.graph) <= level:
+            self.graph.append({})
+
+        if self.entry_point is None:
+            for lvl in range(level + 1):
+                self.graph[lvl][row] = []
+            self.entry_point, self.max_level = row, level
+            return
+
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, level, -1):
+            entry = [self._search_layer(vector, entry, 1, lvl)[0][1]]
+
+        for lvl in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entry, self.ef_construction, lvl)
+            limit = self.m0 if lvl == 0 else self.m
+            neighbours = [r for _, r in found[:self.m]]
+            self.graph[lvl][row] = neighbours
+            for neighbour in neighbours:
+                self.graph[lvl][neighbour].append(row)
+                self._prune(neighbour, lvl, limit)
+            entry = [r for _, r in found]
+
+        for lvl in range(self.max_level + 1, level + 1):
+            self.graph[lvl][row] = []
+        if level > self.max_level:
+            self.entry_point, self.max_level = row, level
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        ef_search: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """Top-k rows; with a boolean row mask, only masked rows are returned."""
+        if self.entry_point is None:
+            return []
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, 0, -1):
+            entry = [self._search_layer(query, entry, 1, lvl)[0][1]]
+        ef = max(ef_search or self.ef_search, top_k)
+        found = self._search_layer(query, entry, ef, 0, mask)
+        return [(row, score) for score, row in found[:top_k]]
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for lvl, layer in enumerate(self.graph):
+            nodes = np.array(list(layer.keys()), dtype=np.int64)
+            lengths = np.array([len(layer[n]) for n in nodes.tolist()], dtype=np.int64)
+            flat = np.array([r for n in nodes.tolist() for r in layer[n]], dtype=np.int64)
+            np.savez(os.path.join(path, f"level_{lvl}.npz"), nodes=nodes,
+                     offsets=np.concatenate([[0], np.cumsum(lengths)]), neighbours=flat)
+        with open(os.path.join(path, "params.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "m": self.m, "ef_construction": self.ef_construction,
+                       "ef_search": self.ef_search, "seed": self.seed, "entry_point": self.entry_point,
+                       "max_level": self.max_level, "levels": len(self.graph)}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "HNSWIndex":
+        with open(os.path.join(path, "params.json"), encoding="utf-8") as f:
+            params = json.load(f)
+        hnsw = cls(m=params["m"], ef_construction=params["ef_construction"],
+                   ef_search=params["ef_search"], seed=params["seed"])
+        hnsw.entry_point = params["entry_point"]
+        hnsw.max_level = params["max_level"]
+        for lvl in range(params["levels"]):
+            data = np.load(os.path.join(path, f"level_{lvl}.npz"))
+            nodes, offsets, flat = data["nodes"].tolist(), data["offsets"], data["neighbours"]
+            hnsw.graph.append({
+                node: flat[offsets[i]:offsets[i + 1]].tolist() for i, node in enumerate(nodes)
+            })
+        return hnsw
+
+
+ANN_ENGINES = {"ivf": IVFIndex, "hnsw": HNSWIndex}
+
+
+def create_ann_index(kind: str, **params):
+    if kind not in ANN_ENGINES:
+        raise ValueError(f"Unknown ANN engine '{kind}', expected one of {sorted(ANN_ENGINES)}")
+    return ANN_ENGINES[kind](**params)
+
+
+def load_ann_index(path: str):
+    with open(os.path.join(path, "params.json"), encoding="utf-8") as f:
+        kind = json.load(f)["kind"]
+    return ANN_ENGINES[kind].load(path)
+
+
+def recall_report(index, queries: np.ndarray, top_k: int = 10, settings: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Measure recall@k and latency of the index's ANN engine against the exact
+    search path. settings are nprobe (IVF) or ef_search (HNSW) values to sweep.
+    """
+    ann = index.ann
+    if ann is None:
+        raise ValueError("Index has no ANN engine attached")
+
+    exact_results, exact_times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact_results.append({row for row, _ in index.search(query, top_k, exact=True)})
+        exact_times.append(time.perf_counter() - start)
+
+    knob = "nprobe" if ann.kind == "ivf" else "ef_search"
+    settings = settings or [getattr(ann, knob)]
+    report = []
+    for value in settings:
+        hits, times = 0, []
+        for query, expected in zip(queries, exact_results):
+            start = time.perf_counter()
+            found = index.search(query, top_k, **{knob: value})
+            times.append(time.perf_counter() - start)
+            hits += len(expected.intersection(row for row, _ in found))
+        report.append({
+            "engine": ann.kind,
+            knob: value,
+            f"recall@{top_k}": hits / max(1, sum(len(e) for e in exact_results)),
+            "ann_p50_ms": float(np.percentile(times, 50) * 1000),
+            "ann_p95_ms": float(np.percentile(times, 95) * 1000),
+            "exact_p50_ms": float(np.percentile(exact_times, 50) * 1000),
+        })
+    return report
@@ -0,0 +1,149 @@
+"""
+In-process BM25 inverted index for exact-token matches that embeddings miss
+(item descriptions like "FAMOTIDINE 20MG TABS UD 10X10", catalog numbers).
+
+Posting lists are compact typed arrays (row numbers as int64, term
+frequencies as float32) that grow in place, so adding documents is
+incremental. Removed rows are masked out of the postings and of the corpus
+statistics (document count, average length, document frequencies) instead of
+rewriting the postings. Scores are accumulated with NumPy over the postings
+of the query terms only. Searches copy the postings they need under the lock, so a
+concurrent add never resizes an array that is being read.
+"""
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[-./][0-9a-z]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; compound tokens ("abc-123", "10x10") also yield their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.casefold()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocab: Dict[str, int] = {}
+        self._rows: List[array] = []
+        self._freqs: List[array] = []
+        self._doc_lengths = np.zeros(1024, dtype=np.float32)
+        self._removed = np.zeros(1024, dtype=bool)
+        self._size = 0
+        self._removed_count = 0
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, start_row: int, texts: Iterable[str]):
+        """Index texts as rows start_row, start_row + 1, ... (rows must be appended in order)."""
+        with self._lock:
+            for row, text in enumerate(texts, start=start_row):
+                if row != self._size:
+                    raise ValueError(f"Expected row {self._size}, got {row}")
+                counts = Counter(tokenize(text or ""))
+                for term, freq in counts.items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = self._vocab[term] = len(self._rows)
+                        self._rows.append(array("q"))
+                        self._freqs.append(array("f"))
+                    self._rows[term_id].append(row)
+                    self._freqs[term_id].append(freq)
+                length = sum(counts.values())
+                if self._size == self._doc_lengths.shape[0]:
+                    # Grow into new arrays; searches holding the old ones keep a valid view.
+                    self._doc_lengths = np.concatenate([self._doc_lengths, np.zeros_like(self._doc_lengths)])
+                    self._removed = np.concatenate([self._removed, np.zeros_like(self._removed)])
+                self._doc_lengths[self._size] = length
+                self._size += 1
+                self._total_length += length
+
+    def remove(self, rows: Iterable[int]):
+        """Drop rows from search results and from the corpus statistics; removing a row twice is a no-op."""
+        with self._lock:
+            rows = np.unique(np.asarray(list(rows), dtype=np.int64))
+            rows = rows[(rows >= 0) & (rows < self._size)]
+            rows = rows[~self._removed[rows]]
+            if rows.shape[0] == 0:
+                return
+            # Copy on write: searches holding the old array keep a consistent view.
+            removed = self._removed.copy()
+            removed[rows] = True
+            self._removed = removed
+            self._removed_count += int(rows.shape[0])
+            self._total_length -= float(self._doc_lengths[rows].sum())
+
+    def search(
+        self,
+        query_text: str,
+        top_k: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """Top-k (row, bm25 score) pairs; mask optionally restricts the eligible rows."""
+        with self._lock:
+            n_docs = self._size
+            live_docs = self._size - self._removed_count
+            doc_lengths = self._doc_lengths
+            removed = self._removed if self._removed_count else None
+            total_length = self._total_length
+            postings = []
+            for term in set(tokenize(query_text)):
+                term_id = self._vocab.get(term)
+                if term_id is not None:
+                    postings.append((np.array(self._rows[term_id], dtype=np.int64),
+                                     np.array(self._freqs[term_id], dtype=np.float32)))
+        if live_docs == 0 or top_k <= 0:
+            return []
+        avg_length = max(total_length / live_docs, 1e-9)
+        scores = np.zeros(n_docs, dtype=np.float32)
+
+        for rows, freqs in postings:
+            if removed is not None:
+                live = ~removed[rows]
+                rows, freqs = rows[live], freqs[live]
+            df = rows.shape[0]
+            if df == 0:
+                continue
+            idf = math.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[rows] / avg_length)
+            scores[rows] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        if mask is not None:
+            mask = mask[:n_docs]
+            scores[:mask.shape[0]][~mask] = 0
+            scores[mask.shape[0]:] = 0
+        matched = np.flatnonzero(scores > 0)
+        if matched.shape[0] == 0:
+            return []
+        k = min(top_k, matched.shape[0])
+        matched_scores = scores[matched]
+        if k < matched.shape[0]:
+            top = np.argpartition(-matched_scores, k - 1)[:k]
+        else:
+            top = np.arange(matched.shape[0])
+        top = top[np.argsort(-matched_scores[top], kind="stable")]
+        return [(int(matched[i]), float(matched_scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked (row, score) lists: each row scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
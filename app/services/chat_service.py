@@ -1,37 +1,291 @@
-from app.services.embedding_service import embed_text
-from app.services.vector_search_service import query_similar_chunks
-from app.services.ai_service import generate_response
-from typing import Dict, Any, List
+import os
+import json
+import asyncio
+from app.services.embedding_service import EMBEDDING_BACKEND, embed_text, embed_bulk_text
+from app.services.vector_search_service import (
+    VECTOR_RRF_K, query_similar_chunks, query_similar_chunks_batch, get_vector_index, get_chunks, index_version
+)
+from app.services.metadata_filter import discriminating_terms, extract_filters, is_aggregate_question
+from app.services.result_diversification import collapse_near_duplicates, expand_rows, mmr_select, rank_relevance
+from app.services.prompt_builder import PromptBuilder, get_tokenizer
+from app.utils.supply_data_parser import summary_filters
+from app.services.admission import AdmissionRejected
+from app.services.ai_service import DEFAULT_MAX_TOKENS, GENERATION_ERROR
+from fastapi import HTTPException
+from app.utils.cache import SemanticCache, TTLLRUCache, fingerprint, normalize_query
+from typing import Dict, Any, List, Optional, Tuple
 import datetime
 
+# Retrieval cache shared by every ChatService: normalized question (+ filters,
+# index version) -> query vector and the ids of the retrieved chunks. Keys
+# include the index version, so any change to the index invalidates it.
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "600"))
+retrieval_cache = TTLLRUCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS)
+_retrieval_cache_version: Optional[str] = None
+
+# Semantic answer cache shared by ChatService and the /chat endpoints: a
+# question whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine of an
+# earlier one, asked against the same context and data version, gets the
+# earlier answer without an LLM call. Questions must also share their filters
+# and discriminating_terms (years, numbers, months, ordering words). Off with
+# the hashing embedding backend: its cosine measures shared tokens, not meaning.
+SEMANTIC_CACHE_ENABLED = (
+    os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true" and EMBEDDING_BACKEND != "hashing"
+)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+semantic_cache = SemanticCache(
+    max_entries=SEMANTIC_CACHE_SIZE,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+) if SEMANTIC_CACHE_ENABLED else None
+
 class ChatService:
+    """
+    Retrieval-augmented answers. The LLM call goes through LlamaService, so it
+    gets the response cache, admission and LLMRouter's breakers, failover and
+    hedging; backend failures answer GENERATION_ERROR, overload raises
+    AdmissionRejected.
+    """
 
-    def __init__(self, top_k: int = 5):
+    def __init__(
+        self,
+        top_k: int = 5,
+        candidate_k: Optional[int] = None,
+        mmr_lambda: float = 0.7,
+        context_token_budget: int = 1500,
+        summary_k: int = 8,
+        prompt_token_budget: Optional[int] = None,
+        tokenizer=None,
+    ):
         self.top_k = top_k
-
-    def process_query(self, user_query: str) -> Dict[str, Any]:
-        query_vector = embed_text(user_query)
-        top_chunks = query_similar_chunks(query_vector, top_k=self.top_k)
-        context = self.build_context_string(top_chunks)
-        prompt = (
-            f"Answer the following hospital supply chain question using the provided data context.\n\n"
-            f"Context:\n{context}\n\n"
-            f"Question: {user_query}\n"
-            f"Answer:"
+        # Retrieve a wider candidate pool so duplicate collapse and MMR have room to work.
+        self.candidate_k = candidate_k or top_k * 4
+        self.mmr_lambda = mmr_lambda
+        self.context_token_budget = context_token_budget
+        # Aggregate questions are answered from up to summary_k summary-tier chunks when any match.
+        self.summary_k = summary_k
+        # The whole prompt (instruction, context and question) fits the model's budget from settings.
+        from app.core.config import settings
+        self.prompt_token_budget = prompt_token_budget or settings.LLM_MODEL_PROMPT_BUDGETS.get(
+            settings.LLAMA_MODEL, settings.LLM_PROMPT_TOKEN_BUDGET
         )
+        self.tokenizer = tokenizer or get_tokenizer(settings.LLM_TOKENIZER)
+
+    def process_query(
+        self, user_query: str, filters: Optional[Dict[str, Any]] = None, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        prepared = self._prepare(user_query, filters)
+        cached = self._cached_answer(prepared, use_cache)
+        if cached is not None:
+            return cached
+        # Imported here: importing LlamaService builds the LLM router and its backends.
+        from app.services.llama_service import LlamaService
+        try:
+            answer = LlamaService.query(prepared["prompt"], max_tokens=DEFAULT_MAX_TOKENS, use_cache=use_cache)
+        except AdmissionRejected:
+            raise
+        except HTTPException as e:
+            print(f" LLM error: {e.detail}")
+            answer = GENERATION_ERROR
+        return self._answer(answer, prepared, use_cache)
 
-        answer = generate_response(prompt)
+    async def aprocess_query(
+        self, user_query: str, filters: Optional[Dict[str, Any]] = None, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """process_query for async callers: retrieval runs in a worker thread and the LLM call is awaited."""
+        from app.services.llama_service import LlamaService
+        prepared = await asyncio.to_thread(self._prepare, user_query, filters)
+        cached = self._cached_answer(prepared, use_cache)
+        if cached is not None:
+            return cached
+        try:
+            answer = await LlamaService.aquery(prepared["prompt"], max_tokens=DEFAULT_MAX_TOKENS, use_cache=use_cache)
+        except AdmissionRejected:
+            raise
+        except HTTPException as e:
+            print(f" LLM error: {e.detail}")
+            answer = GENERATION_ERROR
+        return self._answer(answer, prepared, use_cache)
 
+    def _prepare(self, user_query: str, filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        version = index_version()
+        query_vector, filters, top_chunks = self.retrieve(user_query, filters)
+        context = self.build_context_string(top_chunks)
+        builder = PromptBuilder(self.prompt_token_budget, self.tokenizer)
+        builder.add("instruction", "Answer the following hospital supply chain question using the provided data context.",
+                    required=True)
+        builder.add("context", context, header="Context:\n")
+        builder.add("question", f"Question: {user_query}\nAnswer:", required=True)
+        prompt = builder.build()
         return {
+            "vector": query_vector,
+            "filters": filters,
+            "chunks": top_chunks,
+            "prompt": prompt,
+            "fingerprint": fingerprint("rag", context, filters, discriminating_terms(user_query)),
+            "version": version,
+        }
+
+    def _cached_answer(self, prepared: Dict[str, Any], use_cache: bool) -> Optional[Dict[str, Any]]:
+        if semantic_cache is None or not use_cache:
+            return None
+        cached = semantic_cache.lookup(prepared["vector"], prepared["fingerprint"], prepared["version"])
+        if cached is None:
+            return None
+        return {**cached, "timestamp": datetime.datetime.utcnow().isoformat(), "cached": True}
+
+    def _answer(self, answer: str, prepared: Dict[str, Any], use_cache: bool = False) -> Dict[str, Any]:
+        top_chunks = prepared["chunks"]
+        result = {
             "answer": answer.strip(),
-            "sources": [chunk['metadata'] for chunk in top_chunks],
+            "sources": [member['metadata'] for chunk in top_chunks for member in chunk.get('members', [chunk])],
+            "filters": prepared["filters"],
             "timestamp": datetime.datetime.utcnow().isoformat()
         }
+        if semantic_cache is not None and use_cache and answer != GENERATION_ERROR:
+            semantic_cache.store(prepared["vector"], prepared["fingerprint"], result, prepared["version"])
+        return result
+
+    def retrieve(
+        self,
+        user_query: str,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[float], Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Query vector, applied filters and the context chunks for a question.
+        Repeated questions skip embedding and search via retrieval_cache.
+        """
+        global _retrieval_cache_version
+        version = index_version()
+        if version != _retrieval_cache_version:
+            # The index changed: drop entries keyed on older versions right away.
+            retrieval_cache.clear()
+            _retrieval_cache_version = version
+        key = (
+            normalize_query(user_query),
+            json.dumps(filters, sort_keys=True, default=str) if filters is not None else None,
+            self.candidate_k,
+            self.summary_k,
+            version,
+        )
+
+        cached = retrieval_cache.get(key)
+        if cached is not None:
+            query_vector, tier, filters = cached["vector"], cached["tier"], cached["filters"]
+            candidates = get_chunks(cached["hits"], filters=cached["search_filters"], include_vectors=tier == "row")
+        else:
+            query_vector = embed_text(user_query)
+            if filters is None:
+                filters = extract_filters(user_query, get_vector_index().filters)
+            tier, search_filters, filters, candidates = self._search(query_vector, user_query, filters)
+            retrieval_cache.set(key, {
+                "vector": query_vector,
+                "tier": tier,
+                "filters": filters,
+                "search_filters": search_filters,
+                "hits": [(chunk["id"], chunk["similarity"]) for chunk in candidates],
+            })
+
+        if tier == "summary":
+            return query_vector, filters, self.fit_to_budget(candidates)
+        return query_vector, filters, self.fit_to_budget(self.diversify(query_vector, candidates))
+
+    def _search(
+        self,
+        query_vector: List[float],
+        user_query: str,
+        filters: Dict[str, Any],
+    ) -> Tuple[str, Dict[str, Any], Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Candidates from the summary tier for aggregate questions (from the
+        coarsest summary group that covers their filters), else from the row tier.
+        """
+        search_filters = summary_filters(filters) if is_aggregate_question(user_query) else None
+        if search_filters is not None:
+            summaries = self.retrieve_summaries(query_vector, user_query, search_filters)
+            if summaries:
+                return "summary", search_filters, filters, summaries
+
+        # Drill into the row tier: no summary answers this question.
+        search_filters = {**filters, "tier": "row"}
+        candidates = query_similar_chunks(
+            query_vector, top_k=self.candidate_k, filters=search_filters, query_text=user_query, include_vectors=True
+        )
+        if not candidates and filters:
+            # Constraints matched nothing; answer from the whole corpus instead of an empty context.
+            filters = {}
+            search_filters = {"tier": "row"}
+            candidates = query_similar_chunks(
+                query_vector, top_k=self.candidate_k, filters=search_filters, query_text=user_query,
+                include_vectors=True,
+            )
+        return "row", search_filters, filters, candidates
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return retrieval_cache.stats()
+
+    def retrieve_summaries(
+        self,
+        query_vector: List[float],
+        user_query: str,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top summary-tier chunks (pre-aggregated totals) matching the question
+        and its filters; see summary_filters for routing to one summary group.
+        """
+        return query_similar_chunks(
+            query_vector, top_k=self.summary_k, filters={**(filters or {}), "tier": "summary"}, query_text=user_query
+        )
+
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        top_k: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Embed all queries in one call and retrieve their top-k row-tier chunks
+        in one batched search (filters may name another tier explicitly).
+        """
+        if not queries:
+            return []
+        query_vectors = embed_bulk_text(queries)
+        return query_similar_chunks_batch(
+            query_vectors, top_k=top_k or self.top_k, filters={"tier": "row", **(filters or {})}, query_texts=queries
+        )
+
+    def diversify(self, query_vector: List[float], chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Expand entries into rows, collapse near-duplicate rows into aggregated
+        chunks, then pick top_k with MMR. Relevance is a chunk's best rank in
+        the retrieved (hybrid fused) order; vectors only measure redundancy.
+        """
+        ranked = [dict(chunk, rank=rank) for rank, chunk in enumerate(chunks)]
+        collapsed = collapse_near_duplicates(expand_rows(ranked))
+        relevance = rank_relevance([min(member["rank"] for member in chunk["members"]) for chunk in collapsed],
+                                   VECTOR_RRF_K)
+        return mmr_select(query_vector, collapsed, self.top_k, self.mmr_lambda, relevance=relevance)
+
+    def fit_to_budget(self, chunks: List[Dict[str, Any]], token_budget: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Keep chunks in rank order while their context lines fit the token budget (always at least one)."""
+        token_budget = token_budget or self.context_token_budget
+        kept = []
+        used = 0
+        for chunk in chunks:
+            cost = max(1, self.tokenizer.count(f"- {chunk['text']}"))
+            if kept and used + cost > token_budget:
+                break
+            kept.append(chunk)
+            used += cost
+        return kept
 
-    def build_context_string(self, chunks: List[Dict[str, Any]]) -> str:
+    def build_context_string(self, chunks: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
         context_list = []
-        for idx, chunk in enumerate(chunks):
-            text = chunk.get('metadata', {}).get('item_desc', 'N/A')
+        for chunk in self.fit_to_budget(chunks, token_budget):
             context_list.append(f"- {chunk['text']}")
 
         return "\n".join(context_list)
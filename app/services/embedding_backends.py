@@ -0,0 +1,136 @@
+"""
+Embedding backends used by embedding_service.
+
+A backend turns one request-sized batch of texts into vectors; batching,
+caching and the worker pool stay in embedding_service. Its model name keys
+the embedding cache, so vectors from different backends never mix.
+
+- HttpEmbeddingBackend: any OpenAI-compatible /embeddings endpoint, with
+  retries on rate limiting and server errors.
+- HashingEmbeddingBackend: offline and deterministic. Word unigrams,
+  bigrams and character trigrams are hashed into dim signed buckets (the
+  hashing trick, i.e. a sparse random projection of the bag of features)
+  with NumPy, one batch at a time. Texts sharing words land close
+  together, which is enough to run and load-test ingestion and retrieval
+  without a network; it is not a semantic model.
+"""
+import hashlib
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class HttpEmbeddingBackend:
+    def __init__(
+        self,
+        url: str,
+        model: str,
+        api_key: str = "",
+        max_retries: int = 5,
+        retry_base_seconds: float = 1.0,
+        retry_max_seconds: float = 30.0,
+        timeout: float = 60.0,
+    ):
+        self.url = url
+        self.model = model
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.timeout = timeout
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}" if api_key else ""
+        }
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.retry_max_seconds)
+            except ValueError:
+                pass
+        # Full jitter: concurrent workers that failed together do not retry together.
+        return random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """One embeddings request, retried on rate limiting, server errors and connection failures."""
+        if not self.url:
+            raise ValueError("The http embedding backend needs EMBEDDING_API_URL")
+        payload = {"model": self.model, "input": texts}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = requests.post(self.url, json=payload, headers=self.headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                print(f" Embedding request failed ({e.__class__.__name__}), retrying in {delay:.1f}s.")
+            else:
+                if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    response.raise_for_status()
+                    data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+                    return [item["embedding"] for item in data]
+                delay = self._retry_delay(attempt, response)
+                print(f" Embedding request returned {response.status_code}, retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+
+class HashingEmbeddingBackend:
+    _WORD = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 384, seed: int = 0):
+        self.dim = dim
+        self.seed = seed
+        self.model = f"hashing-{dim}-{seed}"
+        self._buckets: Dict[str, tuple] = {}
+
+    def _bucket(self, feature: str) -> tuple:
+        # (bucket, sign) from one stable 64-bit hash; memoised because
+        # purchase texts repeat the same vendors and words constantly.
+        cached = self._buckets.get(feature)
+        if cached is None:
+            digest = hashlib.blake2b(f"{self.seed}\0{feature}".encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            cached = (value % self.dim, 1.0 if value >> 63 else -1.0)
+            if len(self._buckets) < 1_000_000:
+                self._buckets[feature] = cached
+        return cached
+
+    def _features(self, text: str) -> List[str]:
+        words = self._WORD.findall(text.casefold())
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                bucket, sign = self._bucket(feature)
+                rows.append(row)
+                columns.append(bucket)
+                signs.append(sign)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)),
+                  np.asarray(signs, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.tolist()
+
+
+BACKENDS = {"http": HttpEmbeddingBackend, "hashing": HashingEmbeddingBackend}
+
+
+def create_backend(kind: str, **params):
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{kind}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[kind](**params)
@@ -0,0 +1,174 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Vectors are stored in SQLite as raw float32 bytes under
+sha256(model name + text), so the same text embedded by the same model is
+only ever sent to the backend once, across runs and overlapping extracts.
+The file is bounded by max_bytes of vector data; least recently used
+entries are evicted first. Hits only read: their access times are kept in
+memory and written in one batch every touch_flush_seconds (or
+touch_flush_entries keys), before evicting and on close.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 1024 * 1024 * 1024,
+        touch_flush_seconds: float = 30.0,
+        touch_flush_entries: int = 10000,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_flush_seconds = touch_flush_seconds
+        self.touch_flush_entries = touch_flush_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Access times of hits not yet written to last_used.
+        self._touched: Dict[bytes, float] = {}
+        self._flushed_at = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys: Sequence[bytes], batch_size: int = 500) -> Dict[bytes, np.ndarray]:
+        """Cached vectors for the given keys (missing keys are absent); refreshes their LRU position."""
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), batch_size):
+                batch = unique[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[bytes(key)] = np.frombuffer(vector, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if (len(self._touched) >= self.touch_flush_entries
+                        or time.monotonic() - self._flushed_at >= self.touch_flush_seconds):
+                    self._flush_touched_locked()
+                    self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]):
+        if not keys:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in zip(keys, vectors)]
+        with self._lock:
+            replaced = 0
+            for start in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[start:start + 500]]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._total_bytes += sum(len(row[1]) for row in rows) - replaced
+            if self._total_bytes > self.max_bytes:
+                # Evict by up-to-date access times.
+                self._flush_touched_locked()
+            self._evict_locked()
+            self._conn.commit()
+
+    def _flush_touched_locked(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+        self._flushed_at = time.monotonic()
+
+    def _evict_locked(self, batch_size: int = 1000):
+        while self._total_bytes > self.max_bytes:
+            victims = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?", (batch_size,)
+            ).fetchall()
+            if not victims:
+                self._total_bytes = 0
+                return
+            freed = []
+            for key, size in victims:
+                freed.append((key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", freed)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._flush_touched_locked()
+            self._conn.commit()
+            self._conn.close()
+
+
+def cached_embed(
+    texts: List[str],
+    model: str,
+    cache: Optional[EmbeddingCache],
+    embed,
+) -> List[List[float]]:
+    """
+    Embed texts through cache: only texts it has never seen for this model
+    (each once, however often repeated) are passed to embed(texts).
+    """
+    if cache is None:
+        return embed(texts)
+    keys = [cache_key(model, text) for text in texts]
+    found = cache.get_many(keys)
+    missing: Dict[bytes, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        vectors = embed(list(missing.values()))
+        cache.put_many(list(missing), vectors)
+        found.update(zip(missing, (np.asarray(vector, dtype=np.float32) for vector in vectors)))
+    return [found[key].tolist() for key in keys]
@@ -1,24 +1,292 @@
 
+import itertools
+import os
+import queue
+import threading
+import time
 import pandas as pd
-import uuid
-from app.utils.supply_data_parser import csv_to_purchase_chunks
-from app.services.vector_search_service import store_embedding
-from app.services.embedding_service import embed_bulk_text   
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Set, Union
+from dotenv import load_dotenv
+from app.services.embedding_backends import create_backend
+from app.services.embedding_cache import EmbeddingCache, cached_embed
+from app.services.ingest_checkpoint import IngestCheckpoint
+from app.utils.supply_data_parser import SummaryRollup, csv_to_purchase_chunks, csv_to_summary_chunks, entry_metadata
+from app.services.vector_search_service import (
+    STORE_NAME, content_hash, existing_text_ids, persistent_store, row_document_id, store_text_embeddings, store_rows,
+    stored_texts, store_summaries
+)
 
-def process_and_embed_csv(file_path: str):
+load_dotenv()
 
+# "http": any OpenAI-compatible /embeddings endpoint (Azure OpenAI, OpenRouter,
+# Together AI, Ollama, ...). "hashing": local deterministic vectors for offline
+# runs and load tests (EMBEDDING_DIM). Defaults to http when EMBEDDING_API_URL is set.
+EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
+EMBEDDING_API_KEY = os.getenv("EMBEDDING_API_KEY", "")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-3-small")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "http" if EMBEDDING_API_URL else "hashing").lower()
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "96"))
+# CSV rows read, embedded and written per ingestion step; bounds peak memory.
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "5000"))
+
+# On-disk cache of embeddings keyed by hash(model + text); set EMBEDDING_CACHE_PATH="" to disable.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
+# Embedding requests in flight at once; raise until the provider starts answering 429.
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# Retries per request on 429, 5xx and connection errors, with jittered exponential backoff.
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_BASE_SECONDS = float(os.getenv("EMBEDDING_RETRY_BASE_SECONDS", "1.0"))
+EMBEDDING_RETRY_MAX_SECONDS = float(os.getenv("EMBEDDING_RETRY_MAX_SECONDS", "30.0"))
+# Ingestion batches embedded ahead of the writer; the reader blocks once this many are waiting.
+EMBEDDING_QUEUE_SIZE = int(os.getenv("EMBEDDING_QUEUE_SIZE", "4"))
+# Per-file checkpoint manifests; an interrupted ingestion resumes after the last committed batch.
+INGEST_CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", ".cache/ingest")
+
+BACKEND_PARAMS = {
+    "http": {
+        "url": EMBEDDING_API_URL,
+        "model": EMBEDDING_MODEL_NAME,
+        "api_key": EMBEDDING_API_KEY,
+        "max_retries": EMBEDDING_MAX_RETRIES,
+        "retry_base_seconds": EMBEDDING_RETRY_BASE_SECONDS,
+        "retry_max_seconds": EMBEDDING_RETRY_MAX_SECONDS,
+    },
+    "hashing": {"dim": EMBEDDING_DIM},
+}
+embedding_backend = create_backend(EMBEDDING_BACKEND, **BACKEND_PARAMS.get(EMBEDDING_BACKEND, {}))
+
+embedding_cache = (
+    EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+    if EMBEDDING_CACHE_PATH else None
+)
+
+_embedding_pool = ThreadPoolExecutor(max_workers=max(1, EMBEDDING_CONCURRENCY), thread_name_prefix="embed")
+
+
+def embed_bulk_text(texts: List[str]) -> List[List[float]]:
+    """
+    Embed texts in request-sized batches. Vectors are returned in input order.
+    Texts already in the embedding cache are not sent to the backend.
+    """
+    return cached_embed(texts, embedding_backend.model, embedding_cache, _request_embeddings)
+
+
+def _request_embeddings(texts: List[str]) -> List[List[float]]:
+    """Fan request-sized micro-batches out over the embedding pool; results keep input order."""
+    batches = [texts[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return embedding_backend.embed(batches[0]) if batches else []
+    return [vector for vectors in _embedding_pool.map(embedding_backend.embed, batches) for vector in vectors]
+
+
+def _embed_micro_batch(texts: List[str]) -> List[List[float]]:
+    # Runs on a pool worker, so it must not fan out onto the same pool again.
+    return cached_embed(texts, embedding_backend.model, embedding_cache, embedding_backend.embed)
+
+
+class ThroughputMeter:
+    """Counts embedded texts and written rows, printing texts/sec at most every interval seconds."""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self.texts = 0
+        self.rows = 0
+
+    def update(self, texts: int, rows: int):
+        self.texts += texts
+        self.rows += rows
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.texts / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        print(f" {self.rows} rows written, {self.texts} unique texts embedded ({self.rate:.1f} texts/s).")
+
+
+def embed_text(text: str) -> List[float]:
+    return embed_bulk_text([text])[0]
+
+
+def prepare_purchase_batch(chunks: List[Dict], seen: Set[str], source: str = "", first_line: int = 0) -> Dict:
+    """
+    Work out what one batch of purchase chunks needs. Rows sharing an
+    embedding text (same item, vendor, manufacturer) share one vector keyed
+    by its content hash; only texts neither in seen nor already stored are
+    returned for embedding. Marks the batch's texts as seen. Rows without a
+    TransactionID are identified by source (the file's full path) and their
+    line, counted from first_line, the file position of chunks[0].
+    """
+    text_ids = [content_hash(chunk["embedding_text"]) for chunk in chunks]
+    unique = {}
+    for text_id, chunk in zip(text_ids, chunks):
+        if text_id not in seen:
+            unique.setdefault(text_id, chunk)
+    stored = existing_text_ids(list(unique))
+    new_ids = [text_id for text_id in unique if text_id not in stored]
+    seen.update(unique)
+    return {
+        "row_ids": [row_document_id(chunk["metadata"], source, first_line + i) for i, chunk in enumerate(chunks)],
+        "text_ids": text_ids,
+        "rows": [chunk["metadata"] for chunk in chunks],
+        "new_ids": new_ids,
+        "texts": [unique[text_id]["embedding_text"] for text_id in new_ids],
+        "entries": [entry_metadata(unique[text_id]["metadata"]) for text_id in new_ids],
+    }
+
+
+def write_purchase_batch(batch: Dict, embeddings: List[List[float]]):
+    store_text_embeddings(batch["new_ids"], embeddings, batch["texts"], batch["entries"])
+    store_rows(batch["row_ids"], batch["text_ids"], batch["rows"])
+
+
+def embed_purchase_batch(chunks: List[Dict], seen: Set[str], source: str = "", first_line: int = 0) -> int:
+    """Embed and store one batch of purchase chunks; returns the number of texts embedded."""
+    batch = prepare_purchase_batch(chunks, seen, source, first_line)
+    write_purchase_batch(batch, embed_bulk_text(batch["texts"]))
+    return len(batch["new_ids"])
+
+
+def _submit_embeddings(texts: List[str]) -> List[Future]:
+    return [
+        _embedding_pool.submit(_embed_micro_batch, texts[start:start + EMBEDDING_BATCH_SIZE])
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+    ]
+
+
+def _write_batches(
+    pending: "queue.Queue",
+    meter: ThroughputMeter,
+    checkpoint: IngestCheckpoint,
+    errors: List[BaseException],
+):
+    """
+    Writer stage: store each batch once its embeddings arrive, in read order,
+    so rows are always written after the texts they point at, then
+    checkpoint it. After a failure it keeps draining so the reader never
+    blocks on a full queue.
+    """
+    while True:
+        item = pending.get()
+        if item is None:
+            return
+        batch_id, batch, futures = item
+        if errors:
+            for future in futures:
+                future.cancel()
+            continue
+        try:
+            embeddings = [vector for future in futures for vector in future.result()]
+            write_purchase_batch(batch, embeddings)
+            checkpoint.commit(batch_id, len(batch["rows"]), len(batch["texts"]))
+            meter.update(len(batch["texts"]), len(batch["rows"]))
+        except BaseException as e:
+            errors.append(e)
+
+
+def process_and_embed_csv(file_path: str, batch_rows: int = INGEST_BATCH_ROWS, resume: bool = True):
+    """
+    Stream a purchase CSV into the embedding store batch_rows rows at a time.
+    The reader chunks each batch and submits its new texts to the embedding
+    pool (EMBEDDING_CONCURRENCY requests in flight); a writer thread stores
+    batches as they complete. At most EMBEDDING_QUEUE_SIZE batches wait for
+    the writer, so a slow provider or database stalls the reader instead of
+    growing memory. The summary tier is built at the end from a
+    SummaryRollup of the whole file, kept in a temporary SQLite file.
+
+    Each committed batch is recorded in a checkpoint manifest under
+    INGEST_CHECKPOINT_DIR. Rerunning after a crash skips the committed
+    batches (keeping the original batch size) and resumes with the next one;
+    writes are idempotent upserts, so a batch replayed after a crash between
+    its write and its checkpoint is not duplicated. resume=False starts over,
+    as does every run against the in-process store, whose earlier batches
+    did not survive the process that wrote them.
+    """
     print(f" Loading file: {file_path}")
-    df = pd.read_csv(file_path)
+    # Row and summary ids both key on the absolute path: two files with the same name are two sources.
+    source = os.path.abspath(file_path)
+    if resume and not persistent_store():
+        resume = False
+    checkpoint = IngestCheckpoint.open(INGEST_CHECKPOINT_DIR, file_path, batch_rows, resume=resume)
+    batch_rows = checkpoint.batch_rows
+    if checkpoint.resumed:
+        print(f" Resuming after batch {checkpoint.batch_id} ({checkpoint.state['row_offset']} rows already committed).")
+    seen: Set[str] = set()
+    rollup = SummaryRollup()
+    total_rows = embedded = 0
+    meter = ThroughputMeter()
+    errors: List[BaseException] = []
+    pending: "queue.Queue" = queue.Queue(maxsize=max(1, EMBEDDING_QUEUE_SIZE))
+    writer = threading.Thread(
+        target=_write_batches, args=(pending, meter, checkpoint, errors), name="embed-writer", daemon=True
+    )
+    writer.start()
+
+    try:
+        try:
+            for batch_id, frame in enumerate(pd.read_csv(file_path, chunksize=batch_rows)):
+                if errors:
+                    break
+                # Skipped batches still feed the rollup: summaries cover the whole file.
+                rollup.add(frame)
+                if batch_id <= checkpoint.batch_id:
+                    continue
+                chunks = csv_to_purchase_chunks(frame)
+                batch = prepare_purchase_batch(chunks, seen, source, first_line=batch_id * batch_rows)
+                pending.put((batch_id, batch, _submit_embeddings(batch["texts"])))
+                embedded += len(batch["new_ids"])
+                total_rows += len(batch["rows"])
+        finally:
+            pending.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
 
-    chunks = csv_to_purchase_chunks(df)  
+        meter.report()
+        print(f"Embedded {embedded} new unique texts ({len(seen) - embedded} already stored) "
+              f"for {total_rows} rows uploaded to {STORE_NAME} in {time.monotonic() - meter.started:.1f}s.")
 
-    texts = [chunk["text"] for chunk in chunks]
-    embeddings = embed_bulk_text(texts)
+        if rollup.rows:
+            checkpoint.mark("summaries")
+            embed_summaries(rollup, source=source, batch_rows=batch_rows)
+    finally:
+        rollup.close()
+    checkpoint.mark("completed")
 
-    for i, embedding in enumerate(embeddings):
-        metadata = chunks[i]["metadata"]
-        doc_id = str(uuid.uuid4())
-        store_embedding(doc_id=doc_id, embedding=embedding, metadata=metadata)
 
-    print(f"Embedded and uploaded {len(chunks)} rows to Cosmos DB.")
+def embed_summaries(df: Union[pd.DataFrame, SummaryRollup], source: str, batch_rows: int = INGEST_BATCH_ROWS):
+    """
+    Build the summary tier for one source file (its rows, or their
+    SummaryRollup); only new or changed summaries are embedded. Summaries are
+    generated, embedded and stored batch_rows at a time, like purchase rows,
+    so memory does not grow with their number.
+    """
+    summaries = csv_to_summary_chunks(df, source, lazy=True)
+    total = embedded = 0
+    while True:
+        batch = list(itertools.islice(summaries, batch_rows))
+        if not batch:
+            break
+        current = stored_texts([summary["id"] for summary in batch])
+        changed = [summary for summary in batch if current.get(summary["id"]) != summary["text"]]
+        store_summaries(
+            [summary["id"] for summary in changed],
+            embed_bulk_text([summary["text"] for summary in changed]),
+            [summary["text"] for summary in changed],
+            [summary["metadata"] for summary in changed],
+        )
+        total += len(batch)
+        embedded += len(changed)
+    print(f"Embedded {embedded} of {total} summary chunks for {source}.")
 
@@ -0,0 +1,96 @@
+"""
+Checkpoint manifests for resumable CSV ingestion.
+
+One small JSON file per source file records the last batch whose texts and
+rows were committed to the store:
+
+    {"file": ..., "size": ..., "mtime": ..., "batch_rows": 5000,
+     "batch_id": 41, "row_offset": 210000, "texts_embedded": 1234,
+     "status": "running" | "summaries" | "completed", "updated_at": ...}
+
+It is rewritten atomically (temp file + os.replace) after every committed
+batch, so a crash leaves either the previous or the new checkpoint. A
+restart skips batches up to batch_id; because row and text ids are
+deterministic, replaying a batch that was written but not yet checkpointed
+only upserts the same documents again.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+def manifest_path(root: str, file_path: str) -> str:
+    absolute = os.path.abspath(file_path)
+    digest = hashlib.sha1(absolute.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(root, f"{os.path.basename(absolute)}.{digest}.json")
+
+
+class IngestCheckpoint:
+    def __init__(self, path: str, state: Dict[str, Any]):
+        self.path = path
+        self.state = state
+
+    @classmethod
+    def open(cls, root: str, file_path: str, batch_rows: int, resume: bool = True) -> "IngestCheckpoint":
+        """
+        The checkpoint of an interrupted run over the same, unchanged file,
+        or a fresh one. A finished run, a modified file or resume=False
+        starts over.
+        """
+        os.makedirs(root, exist_ok=True)
+        path = manifest_path(root, file_path)
+        stat = os.stat(file_path)
+        fingerprint = {"file": os.path.abspath(file_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+        previous: Optional[Dict[str, Any]] = None
+        if resume and os.path.isfile(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f" Ignoring unreadable checkpoint {path}: {e}")
+        if previous and previous.get("status") != "completed" and all(
+            previous.get(key) == value for key, value in fingerprint.items()
+        ):
+            return cls(path, previous)
+
+        return cls(path, {
+            **fingerprint,
+            "batch_rows": batch_rows,
+            "batch_id": -1,
+            "row_offset": 0,
+            "texts_embedded": 0,
+            "status": "running",
+        })
+
+    @property
+    def resumed(self) -> bool:
+        return self.state["batch_id"] >= 0
+
+    @property
+    def batch_rows(self) -> int:
+        return self.state["batch_rows"]
+
+    @property
+    def batch_id(self) -> int:
+        """Last committed batch (-1 before the first)."""
+        return self.state["batch_id"]
+
+    def commit(self, batch_id: int, rows: int, texts_embedded: int):
+        self.state["batch_id"] = batch_id
+        self.state["row_offset"] += rows
+        self.state["texts_embedded"] += texts_embedded
+        self._save()
+
+    def mark(self, status: str):
+        self.state["status"] = status
+        self._save()
+
+    def _save(self):
+        self.state["updated_at"] = datetime.now(timezone.utc).isoformat()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
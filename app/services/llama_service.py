@@ -1,64 +1,408 @@
-import requests
+import httpx
+import json
+import threading
+import time
+from contextlib import AsyncExitStack, nullcontext
+from typing import Any, AsyncIterator, Dict, Optional
 from fastapi import HTTPException
 from app.core.config import settings
+from app.services.admission import AdmissionController, Priority
+from app.services.llm_cache import ResponseCache, prompt_key
+from app.services.llm_client import get_async_client, get_sync_client, llm_timeout
+from app.services.llm_router import LLMRouter, backend_model, create_backend
+from app.services.single_flight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+response_cache = ResponseCache(
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+    path=settings.LLM_CACHE_PATH or None,
+    disk_max_entries=settings.LLM_CACHE_DISK_MAX_ENTRIES,
+) if settings.LLM_CACHE_ENABLED else None
+
+# Identical concurrent completions share one provider call.
+single_flight = SingleFlight() if settings.LLM_SINGLE_FLIGHT_ENABLED else None
+
+# Bounds concurrent provider calls; the rest queue by priority or are shed.
+admission = AdmissionController(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+) if settings.LLM_ADMISSION_ENABLED else None
+
+def _slot(priority: Priority, queue_timeout: Optional[float], asynchronous: bool = False):
+    if admission is None:
+        return nullcontext()
+    if asynchronous:
+        return admission.aslot(priority, queue_timeout)
+    return admission.slot(priority, queue_timeout)
+
+# Provider calls actually made (cache misses and bypasses), for /api/v1/metrics/llm.
+_provider_stats = {"calls": 0, "errors": 0, "seconds": 0.0}
+_provider_lock = threading.Lock()
+
+def _record_call(started: float, failed: bool = False):
+    with _provider_lock:
+        _provider_stats["calls"] += 1
+        _provider_stats["errors"] += int(failed)
+        _provider_stats["seconds"] += time.perf_counter() - started
+
+def llm_metrics() -> Dict[str, Any]:
+    """Response cache and provider call statistics."""
+    with _provider_lock:
+        provider = dict(_provider_stats)
+    provider["mean_seconds"] = provider["seconds"] / provider["calls"] if provider["calls"] else 0.0
+    return {
+        "model": settings.LLAMA_MODEL,
+        "cache": response_cache.stats() if response_cache is not None else {"enabled": False},
+        "provider": provider,
+        "single_flight": single_flight.stats() if single_flight is not None else {"enabled": False},
+        "admission": admission.stats() if admission is not None else {"enabled": False},
+        "router": llm_router.stats(),
+    }
+
 class LlamaService:
+    """
+    Chat completions through llm_router (OpenRouter first by default, see
+    LLM_BACKENDS) over the shared pooled clients. Use aquery from async code
+    (endpoints); query is the blocking wrapper for scripts such as
+    TransactionAnalyzer. astream goes through llm_router too; its backend is
+    chosen before the first token.
+
+    Completions are served from response_cache when the exact same
+    (model, prompt, max_tokens, temperature) was answered within
+    LLM_CACHE_TTL_SECONDS; pass use_cache=False to force a fresh call. The
+    model is the primary backend's: answers of a failover backend are not
+    cached. Concurrent aquery/query calls with the same prompt, cached or
+    not, share a single provider call through single_flight and all get its
+    answer or its error.
+
+    Provider calls go through admission: priority orders the wait for a
+    slot and queue_timeout (seconds, default LLM_QUEUE_TIMEOUT_SECONDS)
+    bounds it; overload raises AdmissionRejected (an HTTPException, 429 or
+    503 with Retry-After).
+    """
+
+    @staticmethod
+    def _cache_key(prompt: str, max_tokens: int, temperature: float, use_cache: bool) -> Optional[str]:
+        if response_cache is None:
+            return None
+        if not use_cache:
+            response_cache.record_bypass()
+            return None
+        return prompt_key(llm_router.primary_model, prompt, max_tokens, temperature)
+
+    @staticmethod
+    def _store(key: Optional[str], backend: Any, answer: str):
+        # Keyed by the primary backend's model: a failover answer does not belong under it.
+        if key is not None and backend_model(backend) == llm_router.primary_model:
+            response_cache.set(key, answer)
+
     @staticmethod
-    def query(prompt: str, max_tokens: int = 500, temperature: float = 0.7):
-        headers = {
+    def _headers() -> dict:
+        return {
             "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
             "HTTP-Referer": "https://your-app-domain.com",  # Required by OpenRouter
             "X-Title": "MedMine Supply Chatbot",  # Required by OpenRouter
             "Content-Type": "application/json"
         }
-        
+
+    @staticmethod
+    def _payload(prompt: str, max_tokens: int, temperature: float, stream: bool = False) -> dict:
         payload = {
             "model": settings.LLAMA_MODEL,
             "messages": [{"role": "user", "content": prompt}],
             "max_tokens": max_tokens,
             "temperature": temperature,
         }
+        if stream:
+            payload["stream"] = True
+        return payload
 
-        try:
-            logger.info(f"Sending request to OpenRouter API with model: {settings.LLAMA_MODEL}")
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
+    @staticmethod
+    def _parse(response: httpx.Response) -> str:
+        # Log the response status and headers for debugging
+        logger.debug(f"OpenRouter response status: {response.status_code} ({response.http_version})")
+        logger.debug(f"OpenRouter response headers: {response.headers}")
+
+        response.raise_for_status()
+        response_data = response.json()
+
+        # Handle different response formats
+        if "choices" in response_data and len(response_data["choices"]) > 0:
+            return response_data["choices"][0]["message"]["content"]
+        elif "message" in response_data:
+            return response_data["message"]["content"]
+        else:
+            logger.error(f"Unexpected OpenRouter response format: {response_data}")
+            raise HTTPException(
+                status_code=502,
+                detail="Unexpected response format from AI service"
             )
-            
-            # Log the response status and headers for debugging
-            logger.debug(f"OpenRouter response status: {response.status_code}")
-            logger.debug(f"OpenRouter response headers: {response.headers}")
-            
-            response.raise_for_status()
-            response_data = response.json()
-            
-            # Handle different response formats
-            if "choices" in response_data and len(response_data["choices"]) > 0:
-                return response_data["choices"][0]["message"]["content"]
-            elif "message" in response_data:
-                return response_data["message"]["content"]
-            else:
-                logger.error(f"Unexpected OpenRouter response format: {response_data}")
-                raise HTTPException(
-                    status_code=502,
-                    detail="Unexpected response format from AI service"
-                )
-                
-        except requests.exceptions.RequestException as e:
+
+    @staticmethod
+    def _error(e: Exception) -> HTTPException:
+        if isinstance(e, HTTPException):
+            return e
+        if isinstance(e, httpx.HTTPError):
             logger.error(f"OpenRouter API request failed: {str(e)}")
-            raise HTTPException(
+            return HTTPException(
                 status_code=502,
                 detail=f"AI service connection error: {str(e)}"
             )
+        logger.error(f"Unexpected error in LlamaService: {str(e)}")
+        return HTTPException(
+            status_code=500,
+            detail=f"AI service processing error: {str(e)}"
+        )
+
+    @staticmethod
+    async def aquery(
+        prompt: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        priority: Priority = Priority.INTERACTIVE,
+        queue_timeout: Optional[float] = None,
+    ) -> str:
+        """Non-blocking completion; timeout (seconds) overrides LLM_TIMEOUT_SECONDS for this call."""
+        key = LlamaService._cache_key(prompt, max_tokens, temperature, use_cache)
+        if key is not None:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def fetch() -> str:
+            async with _slot(priority, queue_timeout, asynchronous=True):
+                return await LlamaService._afetch(prompt, max_tokens, temperature, timeout, key)
+
+        if single_flight is None:
+            return await fetch()
+        return await single_flight.arun(prompt_key(llm_router.route_model, prompt, max_tokens, temperature), fetch)
+
+    @staticmethod
+    async def _afetch(prompt: str, max_tokens: int, temperature: float, timeout: Optional[float],
+                      key: Optional[str]) -> str:
+        started = time.perf_counter()
+        try:
+            answer, backend = await llm_router.aroute(prompt, max_tokens, temperature, timeout)
         except Exception as e:
-            logger.error(f"Unexpected error in LlamaService: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"AI service processing error: {str(e)}"
-            )
\ No newline at end of file
+            _record_call(started, failed=True)
+            raise LlamaService._error(e)
+        _record_call(started)
+        LlamaService._store(key, backend, answer)
+        return answer
+
+    @staticmethod
+    def query(
+        prompt: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        priority: Priority = Priority.INTERACTIVE,
+        queue_timeout: Optional[float] = None,
+    ) -> str:
+        """Blocking completion for scripts; do not call from async endpoints (use aquery)."""
+        key = LlamaService._cache_key(prompt, max_tokens, temperature, use_cache)
+        if key is not None:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        def fetch() -> str:
+            with _slot(priority, queue_timeout):
+                return LlamaService._fetch(prompt, max_tokens, temperature, timeout, key)
+
+        if single_flight is None:
+            return fetch()
+        return single_flight.run(prompt_key(llm_router.route_model, prompt, max_tokens, temperature), fetch)
+
+    @staticmethod
+    def _fetch(prompt: str, max_tokens: int, temperature: float, timeout: Optional[float],
+               key: Optional[str]) -> str:
+        started = time.perf_counter()
+        try:
+            answer, backend = llm_router.route(prompt, max_tokens, temperature, timeout)
+        except Exception as e:
+            _record_call(started, failed=True)
+            raise LlamaService._error(e)
+        _record_call(started)
+        LlamaService._store(key, backend, answer)
+        return answer
+
+    @staticmethod
+    async def astream(
+        prompt: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        priority: Priority = Priority.INTERACTIVE,
+        queue_timeout: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Completion in the provider's streaming mode: yields content deltas as
+        they arrive. The timeout bounds the wait for each chunk, not the whole
+        generation. Failures raise HTTPException like aquery. A cached answer
+        is yielded whole; a completed stream is cached like aquery's result.
+        The admission slot is held until the stream ends. Endpoints that must
+        answer 429/503 before streaming starts use aopen_stream instead.
+        """
+        stream = await LlamaService.aopen_stream(
+            prompt, max_tokens, temperature, timeout, use_cache, priority, queue_timeout
+        )
+        try:
+            async for token in stream:
+                yield token
+        finally:
+            await stream.aclose()
+
+    @staticmethod
+    async def aopen_stream(
+        prompt: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        priority: Priority = Priority.INTERACTIVE,
+        queue_timeout: Optional[float] = None,
+    ) -> "AdmittedStream":
+        """
+        astream in two steps: the cache lookup and the wait for an admission
+        slot happen before this returns, so overload raises AdmissionRejected
+        here rather than mid-stream. The returned stream holds the slot until
+        it is exhausted or closed; callers must aclose() it even if they never
+        iterate it.
+        """
+        key = LlamaService._cache_key(prompt, max_tokens, temperature, use_cache)
+        slot = AsyncExitStack()
+        if key is not None:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return AdmittedStream(_yield_once(cached), slot)
+        await slot.enter_async_context(_slot(priority, queue_timeout, asynchronous=True))
+        return AdmittedStream(LlamaService._aprovider_stream(prompt, max_tokens, temperature, timeout, key), slot)
+
+    @staticmethod
+    async def _aprovider_stream(prompt: str, max_tokens: int, temperature: float, timeout: Optional[float],
+                                key: Optional[str]) -> AsyncIterator[str]:
+        parts = []
+        started = time.perf_counter()
+        try:
+            backend, tokens = await llm_router.aopen_stream(prompt, max_tokens, temperature, timeout)
+            try:
+                async for token in tokens:
+                    parts.append(token)
+                    yield token
+            finally:
+                await tokens.aclose()
+        except Exception as e:
+            _record_call(started, failed=True)
+            raise LlamaService._error(e)
+        _record_call(started)
+        if parts:
+            LlamaService._store(key, backend, "".join(parts))
+
+async def _yield_once(text: str) -> AsyncIterator[str]:
+    yield text
+
+class AdmittedStream:
+    """
+    Token stream returned by LlamaService.aopen_stream. Its admission slot is
+    released when the tokens run out, when iterating raises, or on aclose(),
+    whichever comes first; aclose() may be called any number of times.
+    """
+
+    def __init__(self, tokens: AsyncIterator[str], slot: AsyncExitStack):
+        self._tokens = tokens
+        self._slot = slot
+
+    def __aiter__(self) -> "AdmittedStream":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._tokens.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._tokens.aclose()
+        finally:
+            await self._slot.aclose()
+
+class OpenRouterBackend:
+    """LLMRouter backend for OpenRouter chat completions."""
+
+    name = "openrouter"
+
+    @property
+    def model(self) -> str:
+        return settings.LLAMA_MODEL
+
+    def complete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        logger.info(f"Sending request to OpenRouter API with model: {settings.LLAMA_MODEL}")
+        response = get_sync_client().post(
+            settings.LLM_API_URL,
+            headers=LlamaService._headers(),
+            json=LlamaService._payload(prompt, max_tokens, temperature),
+            timeout=llm_timeout(timeout),
+        )
+        return LlamaService._parse(response)
+
+    async def acomplete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        logger.info(f"Sending request to OpenRouter API with model: {settings.LLAMA_MODEL}")
+        response = await get_async_client().post(
+            settings.LLM_API_URL,
+            headers=LlamaService._headers(),
+            json=LlamaService._payload(prompt, max_tokens, temperature),
+            timeout=llm_timeout(timeout),
+        )
+        return LlamaService._parse(response)
+
+    async def astream(self, prompt: str, max_tokens: int, temperature: float,
+                      timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Content deltas in OpenRouter's streaming mode; the timeout bounds the wait for each chunk."""
+        logger.info(f"Streaming from OpenRouter API with model: {settings.LLAMA_MODEL}")
+        async with get_async_client().stream(
+            "POST",
+            settings.LLM_API_URL,
+            headers=LlamaService._headers(),
+            json=LlamaService._payload(prompt, max_tokens, temperature, stream=True),
+            timeout=llm_timeout(timeout),
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                # SSE: "data: {json}" per chunk, ": comment" keep-alives, "data: [DONE]" at the end.
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise HTTPException(status_code=502, detail=f"AI service error: {chunk['error']}")
+                for choice in chunk.get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+def _create_backend(name: str):
+    return OpenRouterBackend() if name == "openrouter" else create_backend(name)
+
+llm_router = LLMRouter(
+    [_create_backend(name.strip()) for name in settings.LLM_BACKENDS.split(",") if name.strip()],
+    hedging=settings.LLM_HEDGING_ENABLED,
+    hedge_delay_seconds=settings.LLM_HEDGE_DELAY_SECONDS,
+    hedge_min_delay_seconds=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+    failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+    reset_seconds=settings.LLM_BREAKER_RESET_SECONDS,
+)
@@ -0,0 +1,126 @@
+"""
+Exact prompt/response cache for LLM completions.
+
+Keyed by sha256(model, prompt, max_tokens, temperature): only byte-identical
+requests share an answer. An in-memory TTL+LRU tier answers repeats in
+microseconds; an optional SQLite tier (path) keeps answers across restarts
+and workers, with the same TTL and at most disk_max_entries rows.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.cache import TTLLRUCache
+
+
+def prompt_key(model: str, prompt: str, max_tokens: int, temperature: float) -> str:
+    payload = json.dumps([model, prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        path: Optional[str] = None,
+        disk_max_entries: int = 100000,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.memory = TTLLRUCache(max_entries, ttl_seconds)
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is not None:
+            return response
+        if self._conn is not None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and row[1] > time.time():
+                self.disk_hits += 1
+                self.memory.set(key, row[0], ttl_seconds=row[1] - time.time())
+                return row[0]
+        self.misses += 1
+        return None
+
+    def set(self, key: str, response: str):
+        self.stores += 1
+        self.memory.set(key, response)
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response, time.time() + self.ttl_seconds),
+            )
+            if self.stores % 100 == 0:
+                self._trim_locked()
+            self._conn.commit()
+
+    def _trim_locked(self):
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+
+    def record_bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        self.memory.clear()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + self.disk_hits + self.misses
+        stats = {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (memory["hits"] + self.disk_hits) / lookups if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "memory_size": memory["size"],
+            "memory_max_entries": memory["max_entries"],
+            "evictions": memory["evictions"],
+            "expirations": memory["expirations"],
+            "ttl_seconds": self.ttl_seconds,
+        }
+        if self._conn is not None:
+            with self._lock:
+                stats["disk_size"] = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stats["disk_path"] = self.path
+        return stats
@@ -0,0 +1,81 @@
+"""
+Pooled HTTP clients for LLM calls.
+
+One httpx.AsyncClient per process serves every async caller, so concurrent
+chats share keep-alive connections (HTTP/2 when the h2 package is
+installed) instead of each paying a TCP+TLS handshake and blocking the event
+loop. Scripts and other sync callers get an equally pooled httpx.Client.
+Close both on shutdown with close_llm_clients().
+"""
+import importlib.util
+import logging
+import threading
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+_lock = threading.Lock()
+
+
+def _settings():
+    # Imported on first use: Settings() requires the full service environment,
+    # which offline callers of ai_service (e.g. the load test) may not have.
+    from app.core.config import settings
+    return settings
+
+
+def llm_timeout(seconds: Optional[float] = None) -> httpx.Timeout:
+    """Per-call timeout: seconds (or LLM_TIMEOUT_SECONDS) overall, with a shorter connect limit."""
+    settings = _settings()
+    total = seconds if seconds is not None else settings.LLM_TIMEOUT_SECONDS
+    return httpx.Timeout(total, connect=min(total, settings.LLM_CONNECT_TIMEOUT_SECONDS))
+
+
+def _client_options() -> dict:
+    settings = _settings()
+    http2 = settings.LLM_HTTP2 and HTTP2_AVAILABLE
+    if settings.LLM_HTTP2 and not HTTP2_AVAILABLE:
+        logger.info("h2 is not installed; LLM client uses HTTP/1.1 keep-alive")
+    return {
+        "http2": http2,
+        "timeout": llm_timeout(),
+        "limits": httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    }
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        with _lock:
+            if _async_client is None or _async_client.is_closed:
+                _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        with _lock:
+            if _sync_client is None or _sync_client.is_closed:
+                _sync_client = httpx.Client(**_client_options())
+    return _sync_client
+
+
+async def close_llm_clients():
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
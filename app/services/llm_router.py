@@ -0,0 +1,530 @@
+"""
+Routing of LLM completions over an ordered list of backends.
+
+Each backend has a circuit breaker: failure_threshold consecutive failures
+open it and it is skipped for reset_seconds, then a single trial call
+(half-open) decides whether it closes again. Transport errors, timeouts,
+5xx and 429 responses and errors of local backends count as failures; any
+other 4xx response rejects the request itself, so it neither trips the
+breaker nor fails over. The router calls the first
+healthy backend; if that fails it fails over to the next one, and if it has
+not answered within its own recent p95 latency (hedge_delay_seconds until
+enough samples exist) a hedged request goes to the next backend as well.
+The first successful answer wins and the losers are cancelled, so tail
+latency follows the fastest healthy backend instead of the slowest.
+
+Streams (aopen_stream) are not hedged: the backend is chosen once, failing
+over until one produces its first token; a failure after that ends the
+stream. aroute/route also return the backend that answered, so callers can
+tell a failover answer from one of the primary backend (see backend_model).
+
+Backends implement complete() (blocking) and acomplete() (coroutine), and
+optionally astream() (async generator of content deltas; without it the
+whole acomplete() answer is streamed as one delta):
+
+- CompletionsBackend: the generic completions endpoint of ai_service
+  (LLAMA_API_URL), e.g. Ollama or Together AI.
+- LlamaCppBackend: a local GGUF model through llama_cpp (app.core.ai).
+- FakeBackend: canned answers with configurable latency and failures, for
+  tests and offline benchmarks.
+
+LlamaService adds its OpenRouter backend to these.
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from app.services import ai_service
+from app.services.llm_client import get_async_client, get_sync_client, llm_timeout
+
+
+class NoHealthyBackend(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="No healthy LLM backend is available")
+
+
+class Routed(NamedTuple):
+    text: str
+    backend: Any
+
+
+def backend_model(backend: Any) -> str:
+    """What answers for a backend, for cache keys: its model attribute if set, else its name."""
+    return getattr(backend, "model", None) or backend.name
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Whether error counts against the backend; False for 4xx responses other than 408 and 429."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    elif isinstance(error, HTTPException):
+        status = error.status_code
+    else:
+        return True
+    return not (400 <= status < 500) or status in (408, 429)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"  # -> open -> half_open -> closed | open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now; claims the single trial call when half-open."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        with self._lock:
+            if self.state == "half_open":
+                # The trial never finished: allow another one right away.
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+
+class _BackendState:
+    def __init__(self, backend: Any, breaker: CircuitBreaker, window: int = 200):
+        self.backend = backend
+        self.breaker = breaker
+        self.latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.calls = 0
+        self.failures = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: Optional[float], failed: bool):
+        """Outcome of a call; seconds is None when the backend answered but rejected the request."""
+        with self._lock:
+            self.calls += 1
+            if failed:
+                self.failures += 1
+            elif seconds is not None:
+                self.latencies.append(seconds)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, failures, wins = self.calls, self.failures, self.wins
+        return {
+            "name": self.backend.name,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            "calls": calls,
+            "failures": failures,
+            "wins": wins,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+        }
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        backends: Sequence[Any],
+        hedging: bool = True,
+        hedge_delay_seconds: float = 5.0,
+        hedge_min_delay_seconds: float = 0.25,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+    ):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = [_BackendState(backend, CircuitBreaker(failure_threshold, reset_seconds)) for backend in backends]
+        self.hedging = hedging
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.hedge_min_delay_seconds = hedge_min_delay_seconds
+        self.hedge_min_samples = hedge_min_samples
+        self.hedged = 0
+        self.secondary_wins = 0
+        self.failovers = 0
+        self.unavailable = 0
+        self._lock = threading.Lock()
+        # Sync callers: attempts run here so a hedge can start while the primary is still blocked.
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 4 * len(backends)), thread_name_prefix="llm-router")
+
+    @property
+    def primary_model(self) -> str:
+        """backend_model of the first backend, the one that answers while it is healthy."""
+        return backend_model(self.backends[0].backend)
+
+    @property
+    def route_model(self) -> str:
+        """All backends' models in order: any answer of this router comes from one of them."""
+        return ",".join(backend_model(state.backend) for state in self.backends)
+
+    def _next(self, candidates: List[_BackendState], position: itertools.count) -> Optional[_BackendState]:
+        for index in position:
+            if index >= len(candidates):
+                return None
+            state = candidates[index]
+            # Asked one backend at a time, so a half-open trial is only
+            # claimed by a call that will actually make it.
+            if state.breaker.allow():
+                return state
+        return None
+
+    def _hedge_delay(self, state: _BackendState) -> Optional[float]:
+        if not self.hedging:
+            return None
+        p95 = state.percentile(0.95, self.hedge_min_samples)
+        return max(self.hedge_min_delay_seconds, p95 if p95 is not None else self.hedge_delay_seconds)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _won(self, state: _BackendState, primary: _BackendState):
+        with state._lock:
+            state.wins += 1
+        if state is not primary:
+            self._count("secondary_wins")
+
+    async def _aattempt(self, state: _BackendState, prompt: str, max_tokens: int, temperature: float,
+                        timeout: Optional[float]) -> str:
+        started = time.perf_counter()
+        try:
+            answer = await state.backend.acomplete(prompt, max_tokens, temperature, timeout)
+        except asyncio.CancelledError:
+            state.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            state.record(None, failed=is_backend_failure(e))
+            raise
+        state.record(time.perf_counter() - started, failed=False)
+        return answer
+
+    def _attempt(self, state: _BackendState, prompt: str, max_tokens: int, temperature: float,
+                 timeout: Optional[float]) -> str:
+        started = time.perf_counter()
+        try:
+            answer = state.backend.complete(prompt, max_tokens, temperature, timeout)
+        except Exception as e:
+            state.record(None, failed=is_backend_failure(e))
+            raise
+        state.record(time.perf_counter() - started, failed=False)
+        return answer
+
+    async def acomplete(self, prompt: str, max_tokens: int = 500, temperature: float = 0.7,
+                        timeout: Optional[float] = None) -> str:
+        return (await self.aroute(prompt, max_tokens, temperature, timeout)).text
+
+    async def aroute(self, prompt: str, max_tokens: int = 500, temperature: float = 0.7,
+                     timeout: Optional[float] = None) -> Routed:
+        """acomplete, also returning the backend whose answer won."""
+        position = itertools.count()
+        candidates = list(self.backends)
+        primary = self._next(candidates, position)
+        if primary is None:
+            self._count("unavailable")
+            raise NoHealthyBackend()
+        pending: Dict[asyncio.Task, _BackendState] = {}
+        last = primary
+
+        def launch(state: _BackendState):
+            task = asyncio.ensure_future(self._aattempt(state, prompt, max_tokens, temperature, timeout))
+            pending[task] = state
+
+        launch(primary)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self._hedge_delay(last) if last is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # The newest attempt is slower than its p95: hedge on the next backend.
+                    hedge = self._next(candidates, position)
+                    if hedge is None:
+                        last = None
+                        continue
+                    self._count("hedged")
+                    launch(hedge)
+                    last = hedge
+                    continue
+                for task in done:
+                    state = pending.pop(task)
+                    if task.exception() is None:
+                        self._won(state, primary)
+                        return Routed(task.result(), state.backend)
+                    error = task.exception()
+                    if not is_backend_failure(error):
+                        # Another backend would reject the same request.
+                        raise error
+                if not pending:
+                    failover = self._next(candidates, position)
+                    if failover is not None:
+                        self._count("failovers")
+                        launch(failover)
+                        last = failover
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    def complete(self, prompt: str, max_tokens: int = 500, temperature: float = 0.7,
+                 timeout: Optional[float] = None) -> str:
+        """Blocking acomplete: attempts run on the router's pool; losing attempts finish in the background."""
+        return self.route(prompt, max_tokens, temperature, timeout).text
+
+    def route(self, prompt: str, max_tokens: int = 500, temperature: float = 0.7,
+              timeout: Optional[float] = None) -> Routed:
+        """complete, also returning the backend whose answer won."""
+        position = itertools.count()
+        candidates = list(self.backends)
+        primary = self._next(candidates, position)
+        if primary is None:
+            self._count("unavailable")
+            raise NoHealthyBackend()
+        pending = {self._pool.submit(self._attempt, primary, prompt, max_tokens, temperature, timeout): primary}
+        last = primary
+        error: Optional[BaseException] = None
+        while pending:
+            done, _ = wait(pending, timeout=self._hedge_delay(last) if last is not None else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                hedge = self._next(candidates, position)
+                if hedge is None:
+                    last = None
+                    continue
+                self._count("hedged")
+                pending[self._pool.submit(self._attempt, hedge, prompt, max_tokens, temperature, timeout)] = hedge
+                last = hedge
+                continue
+            for future in done:
+                state = pending.pop(future)
+                if future.exception() is None:
+                    self._won(state, primary)
+                    return Routed(future.result(), state.backend)
+                error = future.exception()
+                if not is_backend_failure(error):
+                    raise error
+            if not pending:
+                failover = self._next(candidates, position)
+                if failover is not None:
+                    self._count("failovers")
+                    pending[self._pool.submit(self._attempt, failover, prompt, max_tokens, temperature, timeout)] = failover
+                    last = failover
+        raise error
+
+    async def aopen_stream(self, prompt: str, max_tokens: int = 500, temperature: float = 0.7,
+                           timeout: Optional[float] = None) -> Tuple[Any, AsyncIterator[str]]:
+        """
+        Streaming completion: returns the chosen backend and its content
+        deltas once the first delta has arrived. Failures before it fail over
+        like acomplete; later ones are raised by the iterator. Callers must
+        exhaust or aclose() the iterator.
+        """
+        position = itertools.count()
+        candidates = list(self.backends)
+        state = primary = self._next(candidates, position)
+        if primary is None:
+            self._count("unavailable")
+            raise NoHealthyBackend()
+        while True:
+            started = time.perf_counter()
+            tokens = _backend_stream(state.backend, prompt, max_tokens, temperature, timeout)
+            try:
+                first = await tokens.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except asyncio.CancelledError:
+                state.breaker.record_cancelled()
+                await tokens.aclose()
+                raise
+            except Exception as e:
+                await tokens.aclose()
+                failed = is_backend_failure(e)
+                state.record(None, failed=failed)
+                if not failed:
+                    raise
+                state = self._next(candidates, position)
+                if state is None:
+                    raise
+                self._count("failovers")
+                continue
+            self._won(state, primary)
+            return state.backend, self._relay(state, tokens, first, started)
+
+    @staticmethod
+    async def _relay(state: _BackendState, tokens: AsyncIterator[str], first: Optional[str],
+                     started: float) -> AsyncIterator[str]:
+        """The rest of a chosen stream; its outcome is recorded when it ends."""
+        try:
+            if first is not None:
+                yield first
+            async for token in tokens:
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            state.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            state.record(None, failed=is_backend_failure(e))
+            raise
+        finally:
+            await tokens.aclose()
+        state.record(time.perf_counter() - started, failed=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            router = {
+                "hedging": self.hedging,
+                "hedged": self.hedged,
+                "secondary_wins": self.secondary_wins,
+                "failovers": self.failovers,
+                "unavailable": self.unavailable,
+            }
+        router["backends"] = [state.stats() for state in self.backends]
+        return router
+
+
+async def _backend_stream(backend: Any, prompt: str, max_tokens: int, temperature: float,
+                          timeout: Optional[float]) -> AsyncIterator[str]:
+    if hasattr(backend, "astream"):
+        async for token in backend.astream(prompt, max_tokens, temperature, timeout):
+            yield token
+    else:
+        yield await backend.acomplete(prompt, max_tokens, temperature, timeout)
+
+
+class CompletionsBackend:
+    """ai_service's completions endpoint (Ollama, Together AI, ...)."""
+
+    def __init__(self, url: Optional[str] = None, name: str = "completions"):
+        self.name = name
+        self.url = url or ai_service.LLAMA_API_URL
+        self.model = ai_service.DEFAULT_MODEL_NAME
+
+    def _request(self, prompt: str, max_tokens: int, temperature: float) -> Dict[str, Any]:
+        if not self.url:
+            raise ValueError("The completions backend needs LLAMA_API_URL")
+        return ai_service._payload(prompt, max_tokens, temperature=temperature)
+
+    def complete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        response = get_sync_client().post(
+            self.url, json=self._request(prompt, max_tokens, temperature), headers=ai_service.HEADERS,
+            timeout=llm_timeout(timeout),
+        )
+        return ai_service._completion_text(response)
+
+    async def acomplete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        response = await get_async_client().post(
+            self.url, json=self._request(prompt, max_tokens, temperature), headers=ai_service.HEADERS,
+            timeout=llm_timeout(timeout),
+        )
+        return ai_service._completion_text(response)
+
+
+class LlamaCppBackend:
+    """Local GGUF model via llama_cpp, loaded on first use. Calls are serialised: the model is not thread-safe."""
+
+    def __init__(self, name: str = "llama_cpp"):
+        self.name = name
+        self._lock = threading.Lock()
+
+    def complete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        # Imported here: llama_cpp is optional and loading the model is slow.
+        from app.core.ai import get_ai_model
+        with self._lock:
+            output = get_ai_model()(prompt, max_tokens=max_tokens, temperature=temperature)
+        return output["choices"][0]["text"].strip()
+
+    async def acomplete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        return await asyncio.to_thread(self.complete, prompt, max_tokens, temperature, timeout)
+
+
+class FakeBackend:
+    """
+    Canned backend for tests and benchmarks: answers after latency seconds
+    (plus, with probability tail_rate, tail_latency more) and raises
+    RuntimeError with probability failure_rate.
+    """
+
+    def __init__(
+        self,
+        name: str = "fake",
+        latency: float = 0.0,
+        tail_latency: float = 0.0,
+        tail_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        answer: str = "{name}: {prompt}",
+        seed: Optional[int] = None,
+    ):
+        self.name = name
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self._random = random.Random(seed)
+
+    def _draw(self, prompt: str):
+        delay = self.latency + (self.tail_latency if self._random.random() < self.tail_rate else 0.0)
+        failed = self._random.random() < self.failure_rate
+        return delay, failed, self.answer.format(name=self.name, prompt=prompt)
+
+    def complete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        delay, failed, answer = self._draw(prompt)
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError(f"{self.name} failed")
+        return answer
+
+    async def acomplete(self, prompt: str, max_tokens: int, temperature: float, timeout: Optional[float] = None) -> str:
+        delay, failed, answer = self._draw(prompt)
+        await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError(f"{self.name} failed")
+        return answer
+
+
+BACKENDS = {"completions": CompletionsBackend, "llama_cpp": LlamaCppBackend, "fake": FakeBackend}
+
+
+def create_backend(kind: str, **params):
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{kind}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[kind](**params)
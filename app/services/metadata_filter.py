@@ -0,0 +1,224 @@
+"""
+Inverted metadata indexes for filtered vector search.
+
+Every filterable metadata field keeps one compact posting array of row
+numbers per distinct value. A filter expression is resolved into a boolean
+row mask (OR within a field, AND across fields), so the vector index only has
+to score the matching subset.
+
+Filter expressions are plain dicts:
+
+    {"region": "Pacific"}                       equality
+    {"vendor": ["Cencora", "McKesson"]}         any of several values
+    {"year": {"gte": 2022, "lte": 2023}}        numeric range (gt/gte/lt/lte)
+"""
+import re
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.utils.supply_data_parser import MONTHS
+
+FILTER_FIELDS = (
+    "region", "facility_type", "year", "month", "vendor", "vendor_id", "manufacturer", "tier", "summary_group", "period",
+)
+# Value indexed when a field is missing: purchase rows carry no tier, summaries have tier "summary".
+FILTER_DEFAULTS = {"tier": "row"}
+QUARTERS = {"first": 1, "1st": 1, "second": 2, "2nd": 2, "third": 3, "3rd": 3, "fourth": 4, "4th": 4}
+AGGREGATE_PATTERN = re.compile(
+    r"\b(total|totals|sum|how much|how many|top|most|least|highest|lowest|average|overall|compare|"
+    r"trend|breakdown|spend|spent|(?:by|per|each) (?:region|vendor|facility|month|year|item))\b"
+)
+RANGE_OPERATORS = {
+    "gt": lambda value, bound: value > bound,
+    "gte": lambda value, bound: value >= bound,
+    "lt": lambda value, bound: value < bound,
+    "lte": lambda value, bound: value <= bound,
+}
+
+
+def normalize_filter_value(value: Any) -> Any:
+    """Fold metadata and filter values onto one comparable form (ints, casefolded strings)."""
+    if value is None:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return None
+        return int(value) if float(value).is_integer() else float(value)
+    text = str(value).strip()
+    if re.fullmatch(r"-?\d+", text):
+        return int(text)
+    return text.casefold()
+
+
+def metadata_matches(metadata: Optional[Dict[str, Any]], filters: Dict[str, Any]) -> bool:
+    """Evaluate a filter expression against one metadata dict (same semantics as MetadataFilterIndex)."""
+    metadata = metadata or {}
+    for field, condition in filters.items():
+        value = normalize_filter_value(metadata.get(field, FILTER_DEFAULTS.get(field)))
+        if value is None:
+            return False
+        if isinstance(condition, dict):
+            if not isinstance(value, (int, float)) or not all(
+                RANGE_OPERATORS[op](value, normalize_filter_value(bound)) for op, bound in condition.items()
+            ):
+                return False
+        elif isinstance(condition, (list, tuple, set)):
+            if value not in {normalize_filter_value(option) for option in condition}:
+                return False
+        elif value != normalize_filter_value(condition):
+            return False
+    return True
+
+
+class MetadataFilterIndex:
+    def __init__(self, fields: Iterable[str] = FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self._postings: Dict[str, Dict[Any, array]] = {field: {} for field in self.fields}
+        self._lock = threading.Lock()
+
+    def add(self, start_row: int, metadata: List[Dict[str, Any]]):
+        with self._lock:
+            for row, meta in enumerate(metadata, start=start_row):
+                if not meta:
+                    continue
+                for field in self.fields:
+                    value = normalize_filter_value(meta.get(field, FILTER_DEFAULTS.get(field)))
+                    if value is None:
+                        continue
+                    postings = self._postings[field].get(value)
+                    if postings is None:
+                        postings = self._postings[field][value] = array("q")
+                    postings.append(row)
+
+    def vocabulary(self, field: str) -> List[Any]:
+        with self._lock:
+            return list(self._postings.get(field, {}).keys())
+
+    def _values_for(self, field: str, condition: Any) -> List[Any]:
+        if isinstance(condition, dict):
+            unknown = set(condition) - set(RANGE_OPERATORS)
+            if unknown:
+                raise ValueError(f"Unsupported filter operators for '{field}': {sorted(unknown)}")
+            bounds = {op: normalize_filter_value(bound) for op, bound in condition.items()}
+            return [
+                value for value in self.vocabulary(field)
+                if isinstance(value, (int, float))
+                and all(RANGE_OPERATORS[op](value, bound) for op, bound in bounds.items())
+            ]
+        if isinstance(condition, (list, tuple, set)):
+            return [normalize_filter_value(value) for value in condition]
+        return [normalize_filter_value(condition)]
+
+    def mask(self, filters: Dict[str, Any], size: int) -> np.ndarray:
+        """Boolean mask over the first size rows of the rows matching every filter."""
+        result = np.ones(size, dtype=bool)
+        for field, condition in filters.items():
+            if field not in self._postings:
+                raise ValueError(f"'{field}' is not a filterable field; expected one of {list(self.fields)}")
+            field_mask = np.zeros(size, dtype=bool)
+            for value in self._values_for(field, condition):
+                # Copy under the lock: add() cannot grow an array while a view of it is alive.
+                with self._lock:
+                    postings = self._postings[field].get(value)
+                    rows = np.array(postings, dtype=np.int64) if postings else None
+                if rows is not None:
+                    field_mask[rows[rows < size]] = True
+            result &= field_mask
+            if not result.any():
+                break
+        return result
+
+    def rows(self, filters: Dict[str, Any], size: int) -> np.ndarray:
+        return np.flatnonzero(self.mask(filters, size))
+
+
+def _phrase_pattern(value: str) -> re.Pattern:
+    words = [re.escape(word) for word in value.split()]
+    return re.compile(r"\b" + r"[\s\-]+".join(words) + r"(?:e?s)?\b")
+
+
+def extract_filters(query: str, filter_index: MetadataFilterIndex) -> Dict[str, Any]:
+    """
+    Infer a filter expression from a natural language question by matching
+    values that actually occur in the index, e.g.
+    "Pacific region hospitals in 2023 buying from Cencora" ->
+    {"region": "pacific", "facility_type": "hospital", "year": 2023, "vendor": "cencora"}.
+    """
+    remaining = query.casefold()
+    filters: Dict[str, List[Any]] = {}
+
+    def take(field: str, value: Any, pattern: re.Pattern) -> bool:
+        nonlocal remaining
+        if not pattern.search(remaining):
+            return False
+        filters.setdefault(field, []).append(value)
+        # Blank out the match so "non hospital" is not also read as "hospital".
+        remaining = pattern.sub(" ", remaining)
+        return True
+
+    text_fields = ("region", "facility_type", "vendor", "manufacturer")
+    candidates = [
+        (field, value) for field in text_fields
+        for value in filter_index.vocabulary(field) if isinstance(value, str) and value
+    ]
+    # Longest phrases first so multi-word values win over their substrings.
+    for field, value in sorted(candidates, key=lambda item: -len(item[1])):
+        if field == "manufacturer" and value in filters.get("vendor", []):
+            continue
+        if not take(field, value, _phrase_pattern(value)):
+            leading = value.split()[0]
+            if field in ("vendor", "manufacturer") and len(leading) >= 4 and leading != value:
+                take(field, value, _phrase_pattern(leading))
+
+    years = set(filter_index.vocabulary("year"))
+    for match in re.findall(r"\b(?:19|20)\d{2}\b", remaining):
+        if int(match) in years and int(match) not in filters.get("year", []):
+            filters.setdefault("year", []).append(int(match))
+
+    months = set(filter_index.vocabulary("month"))
+    quarters = [int(q) for q in re.findall(r"\bq([1-4])\b", remaining)]
+    quarters += [QUARTERS[word] for word in re.findall(r"\b(\w+)\s+quarter\b", remaining) if word in QUARTERS]
+    for quarter in quarters:
+        for number in range(3 * quarter - 2, 3 * quarter + 1):
+            if number in months and number not in filters.get("month", []):
+                filters.setdefault("month", []).append(number)
+    for number, name in MONTHS.items():
+        # "may" is too common a word to trust unless it is followed by a year.
+        pattern = r"\bmay\s+(?:19|20)\d{2}\b" if number == 5 else rf"\b{name.casefold()}\b"
+        if number in months and number not in filters.get("month", []) and re.search(pattern, remaining):
+            filters.setdefault("month", []).append(number)
+
+    vendor_ids = set(filter_index.vocabulary("vendor_id"))
+    for match in re.findall(r"\b\d{4,}\b", remaining):
+        if int(match) in vendor_ids and int(match) not in years:
+            filters.setdefault("vendor_id", []).append(int(match))
+
+    return {field: values[0] if len(values) == 1 else values for field, values in filters.items()}
+
+
+DISCRIMINATING_PATTERN = re.compile(
+    r"\b(\d+(?:\.\d+)?|q[1-4]|highest|lowest|most|least|top|bottom|max(?:imum)?|min(?:imum)?|"
+    r"increase[sd]?|decrease[sd]?|above|below|more|less|first|last|"
+    + "|".join(name.casefold() for name in MONTHS.values()) + r")\b"
+)
+
+
+def discriminating_terms(query: str) -> List[str]:
+    """
+    Tokens that two near-identical questions must share to have the same
+    answer: numbers (years, amounts), quarters, months and ordering words,
+    so "total spend in 2022" and "... in 2023" are never treated as one.
+    """
+    return sorted(set(DISCRIMINATING_PATTERN.findall(query.casefold())))
+
+
+def is_aggregate_question(query: str) -> bool:
+    """Whether a question asks for totals/rankings that the summary tier can answer directly."""
+    return bool(AGGREGATE_PATTERN.search(query.casefold()))
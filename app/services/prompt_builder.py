@@ -0,0 +1,217 @@
+"""
+Token-budgeted prompt assembly.
+
+PromptBuilder fills a token budget with prompt sections in priority order:
+required sections (instructions, the question) always go in, the others are
+added while they fit, the first one that does not is truncated at a line
+boundary and the rest are dropped. Sections keep the order they were added
+in, and truncation only depends on the text and the budget, so the same
+inputs always give the same prompt.
+
+Tokens are counted by a pluggable tokenizer: "tiktoken:<encoding>" when the
+tiktoken package is installed, otherwise an approximation of four characters
+per token that needs no model files.
+
+compact_table and compact_whitespace shrink context before it is counted:
+tabular rows become one header line plus one pipe-separated line per row,
+columns that hold the same value in every row (or repeat another column)
+are stated once, and long headers are abbreviated with a legend.
+"""
+import importlib.util
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+TIKTOKEN_AVAILABLE = importlib.util.find_spec("tiktoken") is not None
+
+
+class ApproximateTokenizer:
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        return (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return text[:max(0, max_tokens) * 4]
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str = "cl100k_base"):
+        import tiktoken
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return self._encoding.decode(self._encoding.encode(text, disallowed_special=())[:max(0, max_tokens)])
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(spec: str = "approx"):
+    """Tokenizer for "approx" or "tiktoken[:<encoding>]"; falls back to approx without tiktoken."""
+    kind, _, encoding = spec.partition(":")
+    if kind == "tiktoken":
+        if TIKTOKEN_AVAILABLE:
+            return TiktokenTokenizer(encoding or "cl100k_base")
+        logger.info("tiktoken is not installed; counting prompt tokens approximately")
+    elif kind != "approx":
+        raise ValueError(f"Unknown tokenizer '{spec}', expected 'approx' or 'tiktoken:<encoding>'")
+    return ApproximateTokenizer()
+
+
+def truncate_lines(text: str, max_tokens: int, tokenizer=None) -> str:
+    """
+    Leading lines of text that fit max_tokens, followed by a note of how many
+    lines were cut. A first line too long on its own is cut mid-line.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    if tokenizer.count(text) <= max_tokens:
+        return text
+    lines = text.split("\n")
+    kept: List[str] = []
+    used = 0
+    note_cost = tokenizer.count(f"[... {len(lines)} more lines truncated]") + 1
+    for line in lines:
+        cost = tokenizer.count(line) + 1
+        if used + cost + note_cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return tokenizer.truncate(lines[0], max_tokens - note_cost) + f"\n[... truncated, {len(lines) - 1} more lines]"
+    return "\n".join(kept + [f"[... {len(lines) - len(kept)} more lines truncated]"])
+
+
+class PromptBuilder:
+    def __init__(self, budget: int, tokenizer=None, separator: str = "\n\n", min_section_tokens: int = 16):
+        self.budget = budget
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.separator = separator
+        # A truncated section shorter than this is dropped instead.
+        self.min_section_tokens = min_section_tokens
+        self._sections: List[Dict[str, Any]] = []
+        self.report: List[Dict[str, Any]] = []
+
+    def add(self, name: str, text: str, priority: int = 1, required: bool = False, header: str = "") -> "PromptBuilder":
+        """
+        Add a section; lower priority values are filled first. The header is
+        kept with the text and never truncated. Empty text adds nothing.
+        """
+        text = text.rstrip("\n")
+        if text:
+            self._sections.append({
+                "name": name, "text": text, "priority": priority, "required": required, "header": header,
+            })
+        return self
+
+    def build(self) -> str:
+        count = self.tokenizer.count
+        separator_cost = count(self.separator)
+        remaining = self.budget
+        parts: Dict[int, str] = {}
+        self.report = []
+        # Required sections first, then by priority; ties keep insertion order.
+        order = sorted(range(len(self._sections)),
+                       key=lambda i: (not self._sections[i]["required"], self._sections[i]["priority"], i))
+        for i in order:
+            section = self._sections[i]
+            full = section["header"] + section["text"]
+            cost = count(full) + (separator_cost if parts else 0)
+            entry = {"name": section["name"], "tokens": cost, "truncated": False, "dropped": False}
+            if section["required"] or cost <= remaining:
+                if cost > remaining:
+                    logger.warning(f"Required prompt section '{section['name']}' exceeds the token budget")
+                parts[i] = full
+                remaining -= cost
+            else:
+                room = remaining - count(section["header"]) - (separator_cost if parts else 0)
+                if room >= self.min_section_tokens:
+                    parts[i] = section["header"] + truncate_lines(section["text"], room, self.tokenizer)
+                    entry["tokens"] = remaining
+                    entry["truncated"] = True
+                    remaining = 0
+                else:
+                    entry["tokens"] = 0
+                    entry["dropped"] = True
+            self.report.append(entry)
+        return self.separator.join(parts[i] for i in sorted(parts))
+
+
+def compact_whitespace(text: str) -> str:
+    """Strip indentation and trailing spaces from every line and drop blank-line runs."""
+    lines = [line.strip() for line in text.strip().split("\n")]
+    return "\n".join(line for i, line in enumerate(lines) if line or (i and lines[i - 1]))
+
+
+_WORD_BOUNDARY = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def abbreviate_headers(headers: Sequence[str], max_length: int = 10) -> Dict[str, str]:
+    """Short, unique aliases for headers longer than max_length (initials of their words, or a prefix)."""
+    aliases: Dict[str, str] = {}
+    taken = {header for header in headers if len(header) <= max_length}
+    for header in headers:
+        if len(header) <= max_length:
+            continue
+        words = _WORD_BOUNDARY.findall(header)
+        # Initials, keeping short acronyms and numbers whole: TransactionID -> TID.
+        alias = "".join(
+            word if word.isdigit() or (word.isupper() and len(word) <= 3) else word[0].upper() for word in words
+        ) if len(words) > 1 else header[:4]
+        base, suffix = alias, 2
+        while alias in taken:
+            alias = f"{base}{suffix}"
+            suffix += 1
+        taken.add(alias)
+        aliases[header] = alias
+    return aliases
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if value != value:
+            return ""
+        return str(int(value)) if value.is_integer() else str(value)
+    return " ".join(str(value).replace("|", "/").split())
+
+
+def compact_table(headers: Sequence[str], rows: Sequence[Mapping[str, Any]], abbreviate_over: int = 10) -> str:
+    """
+    Rows as a pipe-separated table. With more than one row, constant columns
+    become one "Same in all rows" line and columns repeating an earlier one
+    are named once; long headers get aliases explained in a legend line.
+    """
+    columns = {header: [_cell(row.get(header)) for row in rows] for header in headers}
+    constant: List[str] = []
+    duplicates: List[str] = []
+    shown: List[str] = []
+    for header in headers:
+        values = columns[header]
+        if len(rows) > 1 and len(set(values)) == 1:
+            constant.append(f"{header}={values[0] or '(empty)'}")
+            continue
+        same_as = next((other for other in shown if columns[other] == values), None) if len(rows) > 1 else None
+        if same_as is not None:
+            duplicates.append(f"{header}={same_as}")
+            continue
+        shown.append(header)
+
+    aliases = abbreviate_headers(shown, abbreviate_over)
+    lines = []
+    if constant:
+        lines.append("Same in all rows: " + "; ".join(constant))
+    if duplicates:
+        lines.append("Same values as another column: " + "; ".join(duplicates))
+    if aliases:
+        lines.append("Columns: " + ", ".join(f"{alias}={header}" for header, alias in aliases.items()))
+    if shown:
+        lines.append("|".join(aliases.get(header, header) for header in shown))
+        lines.extend("|".join(columns[header][i] for header in shown) for i in range(len(rows)))
+    return "\n".join(lines)
@@ -0,0 +1,175 @@
+"""
+Post-retrieval selection between query_similar_chunks and the prompt.
+
+Deduplicated text entries are first expanded into one chunk per purchase row.
+Near-identical rows (same item, vendor and facility in different months) are
+collapsed into one aggregated chunk, and maximal marginal relevance picks a
+relevant but non-redundant subset of what is left. Relevance can be the
+retrieval rank (rank_relevance), so MMR keeps the hybrid fused order and
+uses vectors only to measure redundancy.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.supply_data_parser import MONTHS, purchase_text
+
+DUPLICATE_KEY_FIELDS = ("item_desc", "vendor", "facility_id")
+
+
+def _key_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return int(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+
+def _period(metadata: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    year, month = _number(metadata.get("year")), _number(metadata.get("month"))
+    if year is None or month is None:
+        return None
+    return int(year), int(month)
+
+
+def _format_period(period: Tuple[int, int]) -> str:
+    year, month = period
+    return f"{MONTHS.get(month, f'Month-{month}')[:3]} {year}"
+
+
+def aggregate_text(members: List[Dict[str, Any]]) -> str:
+    """One context line summarising several purchases of the same item/vendor/facility."""
+    metadata = members[0].get("metadata", {})
+    count = len(members)
+    quantities = [_number(m.get("metadata", {}).get("quantity")) for m in members]
+    spends = [_number(m.get("metadata", {}).get("total_spend")) for m in members]
+    periods = sorted(p for p in (_period(m.get("metadata", {})) for m in members) if p)
+
+    text = f"{count} purchases of {metadata.get('item_desc', 'N/A')} from {metadata.get('vendor', 'N/A')}"
+    where = []
+    if metadata.get("facility_type"):
+        where.append(f"{metadata['facility_type']} facility {metadata.get('facility_id', '')}".strip())
+    if metadata.get("region"):
+        where.append(f"{metadata['region']} region")
+    if where:
+        text += f" ({', '.join(where)})"
+    if periods:
+        first, last = _format_period(periods[0]), _format_period(periods[-1])
+        text += f", {first}" if first == last else f", {first} to {last}"
+    if all(q is not None for q in quantities):
+        text += f", {sum(quantities):g} units"
+    if all(s is not None for s in spends):
+        text += f", total ${sum(spends):,.2f}"
+    return text + "."
+
+
+def expand_rows(chunks: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Replace each chunk that carries "rows" by one chunk per row, described by
+    that row's own purchase text. Rows share the entry's similarity and vector.
+    """
+    expanded = []
+    for chunk in chunks:
+        rows = chunk.get("rows")
+        if not rows or chunk.get("metadata", {}).get("tier") == "summary":
+            expanded.append(chunk)
+            continue
+        for metadata in rows:
+            row_chunk = {key: value for key, value in chunk.items() if key not in ("rows", "row_count")}
+            row_chunk["metadata"] = metadata
+            try:
+                row_chunk["text"] = purchase_text(metadata)
+            except (KeyError, TypeError, ValueError):
+                # Not a purchase row (e.g. a hand-written document); keep the entry text.
+                pass
+            expanded.append(row_chunk)
+    return expanded
+
+
+def collapse_near_duplicates(
+    chunks: Sequence[Dict[str, Any]],
+    key_fields: Sequence[str] = DUPLICATE_KEY_FIELDS,
+) -> List[Dict[str, Any]]:
+    """
+    Merge chunks whose metadata agrees on key_fields. Each merged chunk keeps
+    the best member's similarity (and vector, if present), lists its members,
+    and gets an aggregated text line. Order follows the best member's rank.
+    """
+    groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+    order: List[Tuple] = []
+    for position, chunk in enumerate(chunks):
+        metadata = chunk.get("metadata") or {}
+        key = tuple(_key_value(metadata.get(field)) for field in key_fields)
+        if all(value is None for value in key) or metadata.get("tier") == "summary":
+            key = ("__unique__", position)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(chunk)
+
+    collapsed = []
+    for key in order:
+        members = groups[key]
+        best = max(members, key=lambda chunk: chunk.get("similarity", 0.0))
+        merged = dict(best)
+        merged["members"] = members
+        if len(members) > 1:
+            merged["text"] = aggregate_text(members)
+        collapsed.append(merged)
+    return collapsed
+
+
+def rank_relevance(ranks: Sequence[int], k: int = 60) -> np.ndarray:
+    """Reciprocal-rank score 1 / (k + rank) of 0-based retrieval ranks, scaled so rank 0 scores 1."""
+    return (k + 1) / (k + 1 + np.asarray(ranks, dtype=np.float32))
+
+
+def mmr_select(
+    query_vector: Sequence[float],
+    candidates: Sequence[Dict[str, Any]],
+    k: int,
+    lambda_: float = 0.7,
+    relevance: Optional[Sequence[float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Maximal marginal relevance: repeatedly pick the candidate maximising
+    lambda * relevance(c) - (1 - lambda) * max sim(c, already selected).
+    relevance defaults to sim(query, c). Candidates need a "vector"; ones
+    without fall back to their rank order.
+    """
+    if k <= 0 or not candidates:
+        return []
+    with_vectors = [c for c in candidates if c.get("vector") is not None]
+    if len(with_vectors) != len(candidates):
+        return list(candidates[:k])
+
+    vectors = np.asarray([c["vector"] for c in candidates], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    if relevance is None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    selected: List[int] = []
+    while len(selected) < min(k, len(candidates)):
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[pick])
+    return [candidates[i] for i in selected]
+
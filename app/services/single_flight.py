@@ -0,0 +1,88 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+While a call for a key is running, further calls with the same key do not
+start their own: they wait for the running one and receive its result, or
+its exception. Once it finishes the key is released, so the next call goes
+upstream again (caching finished results is llm_cache's job, not this one's).
+
+run() coalesces blocking calls across threads; arun() coalesces coroutines
+on the running event loop. The shared call runs as its own task, so a caller
+that is cancelled (e.g. a disconnected client) does not cancel it for the
+others.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def arun(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None and task.get_loop() is loop:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(fn())
+                self._tasks[key] = task
+                self.leaders += 1
+                task.add_done_callback(lambda finished: self._release(key, finished))
+        return await asyncio.shield(task)
+
+    def _release(self, key: Hashable, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception retrieved: nobody may be left awaiting it.
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "upstream_calls": self.leaders,
+                "coalesced_calls": self.coalesced,
+                "coalesced_rate": self.coalesced / calls if calls else 0.0,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
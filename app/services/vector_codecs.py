@@ -0,0 +1,188 @@
+"""
+Compressed vector codecs for VectorIndex.
+
+- ScalarInt8Codec: one byte per dimension (4x smaller than float32).
+- ProductQuantizer: the vector is split into m sub-vectors, each replaced by
+  the id of its nearest of 256 sub-centroids, i.e. m bytes per vector
+  (e.g. 384 dims with m=48 is 32x smaller).
+
+Both score queries with asymmetric distance computation: the query stays in
+float32 and only the stored vectors are quantized. For PQ that is a per-query
+(m, 256) lookup table of sub-centroid dot products, summed over each row's codes.
+"""
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Plain (Euclidean) k-means; returns float32 centroids."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    n_clusters = max(1, min(n_clusters, n))
+    centroids = vectors[rng.choice(n, n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        distances = (
+            (vectors ** 2).sum(axis=1, keepdims=True)
+            - 2 * vectors @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        assignment = np.argmin(distances, axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if (~filled).any():
+            centroids[~filled] = vectors[rng.choice(n, int((~filled).sum()), replace=False)]
+    return centroids
+
+
+class ScalarInt8Codec:
+    kind = "int8"
+
+    def __init__(self):
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return dim
+
+    def train(self, vectors: np.ndarray):
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def scores(self, query: np.ndarray, codes: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+        # q . (offset + scale * code) = q . offset + (q * scale) . code
+        weights = query * self.scale
+        bias = float(query @ self.offset)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], block_rows):
+            block = codes[start:start + block_rows]
+            out[start:start + block.shape[0]] = block.astype(np.float32) @ weights + bias
+        return out
+
+
+class ProductQuantizer:
+    kind = "pq"
+
+    def __init__(self, m: int = 16, ksub: int = 256, iterations: int = 20, seed: int = 0):
+        if ksub > 256:
+            raise ValueError("ksub must fit in one byte (<= 256)")
+        self.m = m
+        self.ksub = ksub
+        self.iterations = iterations
+        self.seed = seed
+        self.dsub: Optional[int] = None
+        self.codebooks: Optional[np.ndarray] = None  # (m, ksub, dsub)
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return self.m
+
+    def train(self, vectors: np.ndarray):
+        dim = vectors.shape[1]
+        if dim % self.m:
+            raise ValueError(f"Vector dimension {dim} is not divisible by m={self.m}")
+        self.dsub = dim // self.m
+        self.codebooks = np.stack([
+            kmeans(vectors[:, j * self.dsub:(j + 1) * self.dsub], self.ksub, self.iterations, self.seed + j)
+            for j in range(self.m)
+        ])
+        if self.codebooks.shape[1] < self.ksub:
+            # Fewer training points than centroids: pad so code ids stay valid.
+            pad = np.repeat(self.codebooks[:, -1:], self.ksub - self.codebooks.shape[1], axis=1)
+            self.codebooks = np.concatenate([self.codebooks, pad], axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((vectors.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = vectors[:, j * self.dsub:(j + 1) * self.dsub]
+            book = self.codebooks[j]
+            distances = (book ** 2).sum(axis=1) - 2 * sub @ book.T
+            codes[:, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.m, self.dsub))
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        columns = np.arange(self.m)
+        for start in range(0, codes.shape[0], block_rows):
+            block = codes[start:start + block_rows]
+            out[start:start + block.shape[0]] = table[columns, block].sum(axis=1)
+        return out
+
+
+CODECS = {"int8": ScalarInt8Codec, "pq": ProductQuantizer}
+
+
+def create_codec(kind: str, **params):
+    if kind not in CODECS:
+        raise ValueError(f"Unknown vector codec '{kind}', expected one of {sorted(CODECS)}")
+    return CODECS[kind](**params)
+
+
+def codec_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    configs: Sequence[Dict],
+    top_k: int = 10,
+    rerank_k: int = 100,
+    train_size: int = 50000,
+    total_rows: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Resident memory and recall@k of each codec config ({"kind": "pq", "m": 48},
+    {"kind": "int8"}, ...) against exact float32 search over normalized vectors,
+    with and without exact re-ranking of a rerank_k shortlist. Memory figures
+    are extrapolated to total_rows (defaults to the sample size).
+    """
+    n, dim = vectors.shape
+    total_rows = total_rows or n
+    exact = [set(np.argsort(-(vectors @ q))[:top_k].tolist()) for q in queries]
+    rng = np.random.default_rng(0)
+    training = vectors[rng.choice(n, min(n, train_size), replace=False)]
+
+    report = []
+    for config in configs:
+        params = dict(config)
+        codec = create_codec(params.pop("kind"), **params)
+        start = time.perf_counter()
+        codec.train(training)
+        codes = codec.encode(vectors)
+        build_seconds = time.perf_counter() - start
+
+        adc_hits = rerank_hits = 0
+        for query, expected in zip(queries, exact):
+            approx = codec.scores(query, codes)
+            adc_top = np.argsort(-approx)[:top_k]
+            adc_hits += len(expected.intersection(adc_top.tolist()))
+            shortlist = np.argpartition(-approx, min(rerank_k, n) - 1)[:rerank_k]
+            reranked = shortlist[np.argsort(-(vectors[shortlist] @ query))[:top_k]]
+            rerank_hits += len(expected.intersection(reranked.tolist()))
+
+        expected_total = max(1, sum(len(e) for e in exact))
+        code_bytes = codec.bytes_per_vector(dim) * total_rows
+        report.append({
+            "codec": config,
+            "float32_mb": dim * 4 * total_rows / 2 ** 20,
+            "codes_mb": code_bytes / 2 ** 20,
+            "compression": (dim * 4) / codec.bytes_per_vector(dim),
+            f"recall@{top_k}": adc_hits / expected_total,
+            f"recall@{top_k}_rerank{rerank_k}": rerank_hits / expected_total,
+            "build_seconds": build_seconds,
+        })
+    return report
@@ -0,0 +1,802 @@
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.metadata_filter import FILTER_DEFAULTS, MetadataFilterIndex, metadata_matches, normalize_filter_value
+from app.services.bm25_index import BM25Index, reciprocal_rank_fusion
+
+# Tier code of entries replaced by upsert_many; no tier filter matches it.
+TOMBSTONE = -1
+
+# Metadata fields indexed for lexical (BM25) matching alongside the chunk text.
+LEXICAL_FIELDS = ("item_desc", "vendor", "manufacturer", "manufacturer_catalog_num", "region", "facility_type")
+
+
+def lexical_text(text: Optional[str], metadata: Optional[Dict[str, Any]]) -> str:
+    metadata = metadata or {}
+    values = [str(metadata[field]) for field in LEXICAL_FIELDS if metadata.get(field) is not None]
+    return " ".join([text or ""] + values)
+
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize rows as float32. Zero vectors stay zero so they score 0.0,
+    matching cosine_similarity in vector_search_service.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+class VectorIndex:
+    """
+    Resident vector index: a contiguous float32 matrix of pre-normalized
+    vectors plus parallel id and metadata arrays.
+
+    Cosine similarity reduces to one matrix-vector product over the matrix,
+    and top-k selection uses argpartition instead of a full sort.
+
+    Each vector row is an entry (one unique embedded text) with a posting list
+    of purchase rows. Legacy documents are an entry with a single row, their
+    own metadata; deduplicated text entries get their rows via add_rows().
+    Metadata filters are evaluated on the purchase rows, so an entry matches
+    when any of its rows does, and vectors are scored once per entry. The
+    tier (row or summary) is kept per entry as well: a filter on the tier
+    alone is a precomputed mask, so it does not bypass the ANN engine.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024):
+        self.dim = dim
+        # Optional read-only base matrix (e.g. an np.memmap over a snapshot)
+        # followed by a growable in-memory matrix for documents added later.
+        self._base: Optional[np.ndarray] = None
+        self._vectors = np.zeros((initial_capacity, dim or 0), dtype=np.float32)
+        self._delta_size = 0
+        self._size = 0
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.texts: List[str] = []
+        self._positions: Dict[str, int] = {}
+        # Purchase rows: metadata, owning entry, and per-entry posting lists.
+        self.row_metadata: List[Dict[str, Any]] = []
+        self._row_entry = np.zeros(1024, dtype=np.int64)
+        self._entry_rows: List[array] = []
+        self._row_count = 0
+        # Tier code of every entry (see _tier_codes), for tier-only filters;
+        # TOMBSTONE marks entries replaced by upsert_many, _dead counts them.
+        self._entry_tier = np.zeros(1024, dtype=np.int16)
+        self._tier_codes: Dict[Any, int] = {}
+        self._dead = 0
+        # Bumped by every change to entries, rows or scoring, so callers can key caches on it.
+        self.version = 0
+        # Optional approximate engine from app.services.ann_index. Tombstoned
+        # entries stay in it (masked); once they exceed ann_rebuild_fraction of
+        # its rows it is rebuilt over the live entries.
+        self.ann = None
+        self.ann_rebuild_fraction = 0.25
+        self._ann_dead = 0
+        self.filters = MetadataFilterIndex()
+        # BM25 index over text + metadata, built on first hybrid query.
+        self._lexical: Optional[BM25Index] = None
+        self.rrf_k = 60
+        # Optional compressed codes (app.services.vector_codecs). When set,
+        # scoring uses asymmetric distance over the codes; full vectors are kept
+        # only if _exact_available, and then re-rank a rerank_k shortlist.
+        self.codec = None
+        self._codes: Optional[np.ndarray] = None
+        self._exact_available = True
+        self.rerank_k = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def row_count(self) -> int:
+        return self._row_count
+
+    def position(self, doc_id: str) -> Optional[int]:
+        return self._positions.get(doc_id)
+
+    @property
+    def base_size(self) -> int:
+        return 0 if self._base is None else self._base.shape[0]
+
+    def get_vectors(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return normalized float32 vectors for the given rows (all rows by default).
+        Without full vectors the rows are decoded from their compressed codes.
+        """
+        if not self._exact_available:
+            codes = self._codes[:self._size] if rows is None else self._codes[np.asarray(rows, dtype=np.int64)]
+            return self.codec.decode(codes)
+        base_size = self.base_size
+        delta = self._vectors[:self._delta_size]
+        if rows is None:
+            if self._base is None:
+                return delta
+            return np.vstack([np.asarray(self._base, dtype=np.float32), delta])
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        in_base = rows < base_size
+        if in_base.any():
+            out[in_base] = self._base[rows[in_base]]
+        if (~in_base).any():
+            out[~in_base] = delta[rows[~in_base] - base_size]
+        return out
+
+    @property
+    def lexical(self) -> BM25Index:
+        if self._lexical is None:
+            with self._lock:
+                if self._lexical is None:
+                    lexical = BM25Index()
+                    lexical.add(0, (lexical_text(text, meta) for text, meta in zip(self.texts, self.metadata)))
+                    lexical.remove(np.flatnonzero(self._entry_tier[:len(lexical)] == TOMBSTONE))
+                    self._lexical = lexical
+        return self._lexical
+
+    def score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity between a normalized query and the given rows (approximate when compressed)."""
+        if self.codec is not None:
+            return self.codec.scores(query, self._codes[np.asarray(rows, dtype=np.int64)])
+        return self.get_vectors(rows) @ query
+
+    def compress(
+        self,
+        kind: str,
+        keep_vectors: bool = False,
+        rerank_k: int = 100,
+        train_size: int = 50000,
+        block_rows: int = 65536,
+        **params,
+    ):
+        """
+        Encode every row with a codec from app.services.vector_codecs and score
+        through it from now on. In-memory float vectors are released unless
+        keep_vectors; a memory-mapped base is kept (it is not resident) and
+        used to re-rank the top rerank_k candidates exactly.
+        """
+        from app.services.vector_codecs import create_codec
+
+        codec = create_codec(kind, **params)
+        with self._lock:
+            if not self._size:
+                return None
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(self._size, min(self._size, train_size), replace=False))
+            codec.train(self.get_vectors(sample))
+            codes = np.empty((max(self._size, 16), codec.bytes_per_vector(self.dim)), dtype=np.uint8)
+            for start in range(0, self._size, block_rows):
+                rows = np.arange(start, min(start + block_rows, self._size))
+                codes[start:start + rows.shape[0]] = codec.encode(self.get_vectors(rows))
+
+            self._codes = codes
+            self.codec = codec
+            self._exact_available = keep_vectors or isinstance(self._base, np.memmap)
+            if not self._exact_available:
+                self._base = None
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+                self._delta_size = 0
+            self.rerank_k = rerank_k if self._exact_available else 0
+            self.version += 1
+        return codec
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by the vector data, split into resident memory and memory-mapped files."""
+        mapped = self._base.nbytes if isinstance(self._base, np.memmap) else 0
+        resident_vectors = self._vectors[:self._delta_size].nbytes
+        if self._base is not None and not mapped:
+            resident_vectors += self._base.nbytes
+        codes = self._codes[:self._size].nbytes if self._codes is not None else 0
+        return {
+            "rows": self._size,
+            "resident_vector_bytes": resident_vectors,
+            "code_bytes": codes,
+            "mapped_bytes": mapped,
+            "resident_bytes": resident_vectors + codes,
+        }
+
+    def _exact_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        if self._exact_available:
+            return self.get_vectors(rows) @ query
+        return self.score_rows(query, rows)
+
+    def _rerank(self, query: np.ndarray, hits: List[Tuple[int, float]], top_k: int) -> List[Tuple[int, float]]:
+        if not hits:
+            return hits
+        rows = np.array([row for row, _ in hits], dtype=np.int64)
+        return self._top_k(self._exact_scores(query, rows), top_k, rows)
+
+    def attach_ann(self, ann):
+        ann.attach(self.score_rows, self.get_vectors)
+        self.ann = ann
+        self._ann_dead = self._dead
+
+    def build_ann(self, kind: str, **params):
+        """Build and attach an ANN engine over the current rows; no-op on an empty index."""
+        from app.services.ann_index import create_ann_index
+
+        ann = create_ann_index(kind, **params)
+        with self._lock:
+            if not self._size:
+                return None
+            self._build_ann_locked(ann)
+        return ann
+
+    def _build_ann_locked(self, ann):
+        """Build ann over the live entries and swap it in; searches keep using the old engine until then."""
+        ann.attach(self.score_rows, self.get_vectors)
+        live = self.live_mask()
+        if live is None:
+            ann.build(self.get_vectors())
+        else:
+            rows = np.flatnonzero(live)
+            ann.build(self.get_vectors(rows), rows)
+        self.ann = ann
+        self._ann_dead = 0
+
+    def _reserve(self, extra: int):
+        needed = self._delta_size + extra
+        capacity = self._vectors.shape[0]
+        if needed <= capacity and self._vectors.shape[1] == self.dim:
+            return
+        new_capacity = max(needed, capacity * 2, 16)
+        grown = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        if self._delta_size:
+            grown[:self._delta_size] = self._vectors[:self._delta_size]
+        self._vectors = grown
+
+    def add(self, doc_id: str, vector: Iterable[float], metadata: Dict[str, Any], text: Optional[str] = None):
+        self.add_many([doc_id], [vector], [metadata], [text])
+
+    def _add_rows_locked(self, entries: List[int], metadata: List[Dict[str, Any]]):
+        start = self._row_count
+        needed = start + len(entries)
+        if needed > self._row_entry.shape[0]:
+            # Grow into a new array; searches holding the old one keep a valid view.
+            grown = np.zeros(max(needed, self._row_entry.shape[0] * 2), dtype=np.int64)
+            grown[:start] = self._row_entry[:start]
+            self._row_entry = grown
+        self._row_entry[start:needed] = entries
+        self.row_metadata.extend(metadata)
+        for row, entry in enumerate(entries, start=start):
+            self._entry_rows[entry].append(row)
+        self.filters.add(start, metadata)
+        self._row_count = needed
+        self.version += 1
+
+    def _tier_code(self, metadata: Optional[Dict[str, Any]]) -> int:
+        tier = normalize_filter_value((metadata or {}).get("tier", FILTER_DEFAULTS["tier"]))
+        return self._tier_codes.setdefault(tier, len(self._tier_codes))
+
+    def _set_tiers_locked(self, start: int, metadata: List[Dict[str, Any]]):
+        end = start + len(metadata)
+        if end > self._entry_tier.shape[0]:
+            # Grow into a new array; searches holding the old one keep a valid view.
+            grown = np.zeros(max(end, self._entry_tier.shape[0] * 2), dtype=np.int16)
+            grown[:start] = self._entry_tier[:start]
+            self._entry_tier = grown
+        self._entry_tier[start:end] = [self._tier_code(meta) for meta in metadata]
+
+    def tier_mask(self, tier: Any, size: Optional[int] = None) -> np.ndarray:
+        """Boolean mask over the first size entries of those in the given tier."""
+        size = self._size if size is None else size
+        code = self._tier_codes.get(normalize_filter_value(tier))
+        if code is None:
+            return np.zeros(size, dtype=bool)
+        return self._entry_tier[:size] == code
+
+    def live_mask(self, size: Optional[int] = None) -> Optional[np.ndarray]:
+        """Boolean mask over the first size entries of those not replaced by upsert_many; None if all are live."""
+        size = self._size if size is None else size
+        if not self._dead:
+            return None
+        return self._entry_tier[:size] != TOMBSTONE
+
+    def _split_tier(self, filters: Optional[Dict[str, Any]], size: int) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+        """
+        A single-value tier condition as an entry mask, and the remaining
+        filters. Without one the mask only excludes tombstoned entries.
+        """
+        filters = filters or {}
+        tier = filters.get("tier")
+        if tier is None or isinstance(tier, (dict, list, tuple, set)):
+            return self.live_mask(size), filters
+        return self.tier_mask(tier, size), {field: value for field, value in filters.items() if field != "tier"}
+
+    def add_rows(self, doc_ids: List[str], metadata: List[Dict[str, Any]]):
+        """Attach purchase rows to existing entries (doc_ids[i] owns metadata[i])."""
+        if len(doc_ids) != len(metadata):
+            raise ValueError("Expected one entry id per row")
+        with self._lock:
+            missing = [doc_id for doc_id in doc_ids if doc_id not in self._positions]
+            if missing:
+                raise KeyError(f"Unknown entry ids: {missing[:5]}")
+            self._add_rows_locked([self._positions[doc_id] for doc_id in doc_ids], metadata)
+
+    def add_many(
+        self,
+        doc_ids: List[str],
+        vectors: Iterable[Iterable[float]],
+        metadata: List[Dict[str, Any]],
+        texts: Optional[List[Optional[str]]] = None,
+        rows: Optional[List[List[Dict[str, Any]]]] = None,
+    ):
+        """
+        Add entries. rows gives each entry's purchase rows; by default every
+        entry is its own single row. Ids already in the index are not added
+        again, only their rows are appended.
+        """
+        if not doc_ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(doc_ids):
+            raise ValueError("Expected one vector per document id")
+        if texts is None:
+            texts = [None] * len(doc_ids)
+        if rows is None:
+            rows = [[meta] for meta in metadata]
+
+        with self._lock:
+            seen = set()
+            keep = []
+            existing_entries, existing_rows = [], []
+            for i, doc_id in enumerate(doc_ids):
+                position = self._positions.get(doc_id)
+                if position is None and doc_id not in seen:
+                    seen.add(doc_id)
+                    keep.append(i)
+                    continue
+                # Duplicate ids within the batch resolve after the new entries are placed.
+                existing_entries.append(doc_id)
+                existing_rows.append(rows[i])
+            if len(keep) != len(doc_ids):
+                doc_ids = [doc_ids[i] for i in keep]
+                matrix = matrix[keep]
+                metadata = [metadata[i] for i in keep]
+                texts = [texts[i] for i in keep]
+                rows = [rows[i] for i in keep]
+
+            if doc_ids:
+                self._add_entries_locked(doc_ids, matrix, metadata, texts, rows)
+            if existing_entries:
+                entries = [self._positions[doc_id] for doc_id, entry_rows in zip(existing_entries, existing_rows)
+                           for _ in entry_rows]
+                self._add_rows_locked(entries, [meta for entry_rows in existing_rows for meta in entry_rows])
+
+    def upsert_many(
+        self,
+        doc_ids: List[str],
+        vectors: Iterable[Iterable[float]],
+        metadata: List[Dict[str, Any]],
+        texts: Optional[List[Optional[str]]] = None,
+        rows: Optional[List[List[Dict[str, Any]]]] = None,
+    ):
+        """
+        Like add_many, but an id already in the index has its vector, text,
+        metadata and purchase rows replaced: the id moves to a new entry and
+        its old entry is tombstoned, excluded from every search. The last
+        occurrence of an id repeated within the batch wins.
+        """
+        if not doc_ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(doc_ids):
+            raise ValueError("Expected one vector per document id")
+        if texts is None:
+            texts = [None] * len(doc_ids)
+        if rows is None:
+            rows = [[meta] for meta in metadata]
+
+        latest = list({doc_id: i for i, doc_id in enumerate(doc_ids)}.values())
+        with self._lock:
+            new = [i for i in latest if doc_ids[i] not in self._positions]
+            replaced = [i for i in latest if doc_ids[i] in self._positions]
+            for keep, write in ((new, self._add_entries_locked), (replaced, self._replace_entries_locked)):
+                if keep:
+                    write([doc_ids[i] for i in keep], matrix[keep], [metadata[i] for i in keep],
+                          [texts[i] for i in keep], [rows[i] for i in keep])
+
+    def _replace_entries_locked(
+        self,
+        doc_ids: List[str],
+        matrix: np.ndarray,
+        metadata: List[Dict[str, Any]],
+        texts: List[Optional[str]],
+        rows: List[List[Dict[str, Any]]],
+    ):
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension {matrix.shape[1]} does not match index dimension {self.dim}")
+
+        # The old entries are tombstoned rather than overwritten, so a
+        # memory-mapped base stays read-only and shared; the replacements are
+        # appended like new entries (delta matrix, codes, BM25, ANN).
+        previous = [self._positions[doc_id] for doc_id in doc_ids]
+        for position in previous:
+            # The old rows stay in the row arrays but no longer belong to any entry.
+            self._row_entry[np.asarray(self._entry_rows[position], dtype=np.int64)] = -1
+            self._entry_rows[position] = array("q")
+            self._entry_tier[position] = TOMBSTONE
+        self._dead += len(doc_ids)
+        self._ann_dead += len(doc_ids)
+        if self._lexical is not None:
+            # Only the replaced rows' postings change: no rebuild of the BM25 index.
+            self._lexical.remove(previous)
+        self._add_entries_locked(doc_ids, matrix, metadata, texts, rows)
+        if self.ann is not None and self._ann_dead > self.ann_rebuild_fraction * self._size:
+            # Tombstoned rows are walked but never returned: past this share
+            # they cost more latency than a rebuild over the live entries.
+            self._build_ann_locked(self.ann.spawn())
+
+    def _add_entries_locked(
+        self,
+        doc_ids: List[str],
+        matrix: np.ndarray,
+        metadata: List[Dict[str, Any]],
+        texts: List[Optional[str]],
+        rows: List[List[Dict[str, Any]]],
+    ):
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension {matrix.shape[1]} does not match index dimension {self.dim}")
+
+        normalized = normalize_vectors(matrix)
+        added_vectors = 0
+        if self._exact_available:
+            self._reserve(len(doc_ids))
+            self._vectors[self._delta_size:self._delta_size + len(doc_ids)] = normalized
+            added_vectors = len(doc_ids)
+        if self.codec is not None:
+            if self._size + len(doc_ids) > self._codes.shape[0]:
+                grown = np.empty((max(self._size + len(doc_ids), self._codes.shape[0] * 2), self._codes.shape[1]),
+                                 dtype=np.uint8)
+                grown[:self._size] = self._codes[:self._size]
+                self._codes = grown
+            self._codes[self._size:self._size + len(doc_ids)] = self.codec.encode(normalized)
+        self.ids.extend(doc_ids)
+        self.metadata.extend(metadata)
+        self.texts.extend(
+            text if text is not None else (meta or {}).get("item_desc", "")
+            for text, meta in zip(texts, metadata)
+        )
+        for doc_id, position in zip(doc_ids, range(self._size, self._size + len(doc_ids))):
+            self._positions[doc_id] = position
+        self._set_tiers_locked(self._size, metadata)
+        self._entry_rows.extend(array("q") for _ in doc_ids)
+        self._add_rows_locked(
+            [entry for entry, entry_rows in enumerate(rows, start=self._size) for _ in entry_rows],
+            [meta for entry_rows in rows for meta in entry_rows],
+        )
+        if self._lexical is not None:
+            self._lexical.add(self._size, (
+                lexical_text(text, meta)
+                for text, meta in zip(self.texts[self._size:], self.metadata[self._size:])
+            ))
+        # Publish the new entries last so concurrent searches never see an
+        # entry whose metadata and rows have not been appended yet.
+        self._delta_size += added_vectors
+        self._size += len(doc_ids)
+        if self.ann is not None:
+            self.ann.add(np.arange(self._size - len(doc_ids), self._size), normalized)
+
+    def search(
+        self,
+        query_vector: Iterable[float],
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+        query_text: Optional[str] = None,
+        **ann_params,
+    ) -> List[Tuple[int, float]]:
+        """
+        Return (row, similarity) pairs for the top_k most similar vectors.
+
+        filters restricts scoring to rows whose metadata matches (see
+        app.services.metadata_filter); the matching subset is scored exactly.
+        Otherwise (no filter, or only a tier, applied as a mask) the attached
+        ANN engine is used unless exact=True;
+        ann_params (nprobe, ef_search) override its defaults for this call.
+
+        With query_text, vector and BM25 rankings are fused with reciprocal
+        rank fusion; rows come back in fused order with their cosine similarity.
+        """
+        size = self._size
+        if size == 0 or top_k <= 0:
+            return []
+
+        query = normalize_vectors(np.asarray(query_vector, dtype=np.float32))[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {self.dim}")
+
+        if query_text:
+            depth = self._fusion_depth(top_k)
+            vector_hits = self.search(query, depth, filters=filters, exact=exact, **ann_params)
+            return self._fuse(query, query_text, vector_hits, top_k, filters, size)
+
+        if self.codec is not None and self.rerank_k:
+            shortlist = self._search_vectors(query, max(top_k, self.rerank_k), size, filters, exact, ann_params)
+            return self._rerank(query, shortlist, top_k)
+        return self._search_vectors(query, top_k, size, filters, exact, ann_params)
+
+    def _search_vectors(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        size: int,
+        filters: Optional[Dict[str, Any]],
+        exact: bool,
+        ann_params: Dict[str, Any],
+    ) -> List[Tuple[int, float]]:
+        mask, selective = self._split_tier(filters, size)
+        if selective:
+            rows = self.filtered_entries(filters, size)
+            if rows.shape[0] == 0:
+                return []
+            return self._top_k(self.score_rows(query, rows), top_k, rows)
+        if self.ann is not None and not exact:
+            return self.ann.search(query, top_k, mask=mask, **ann_params)
+        if mask is None:
+            return self._top_k(self._scores(query, size), top_k)
+        rows = np.flatnonzero(mask)
+        return self._top_k(self._scores(query, size)[rows], top_k, rows)
+
+    def filtered_entries(self, filters: Dict[str, Any], size: Optional[int] = None) -> np.ndarray:
+        """Sorted entries (below size) with at least one purchase row matching filters."""
+        size = self._size if size is None else size
+        mask, filters = self._split_tier(filters, size)
+        if not filters:
+            return np.flatnonzero(mask)
+        row_count, row_entry = self._row_count, self._row_entry
+        entries = np.unique(row_entry[self.filters.rows(filters, row_count)])
+        # Rows replaced by upsert_many belong to no entry (-1).
+        entries = entries[(entries >= 0) & (entries < size)]
+        return entries if mask is None else entries[mask[entries]]
+
+    @staticmethod
+    def _fusion_depth(top_k: int) -> int:
+        return max(top_k * 4, 50)
+
+    def _fuse(
+        self,
+        query: np.ndarray,
+        query_text: str,
+        vector_hits: List[Tuple[int, float]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        size: int,
+    ) -> List[Tuple[int, float]]:
+        mask, selective = self._split_tier(filters, size)
+        if selective:
+            mask = np.zeros(size, dtype=bool)
+            mask[self.filtered_entries(filters, size)] = True
+        lexical_hits = self.lexical.search(query_text, self._fusion_depth(top_k), mask)
+        fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k=self.rrf_k)[:top_k]
+        similarities = dict(vector_hits)
+        missing = np.array([row for row, _ in fused if row not in similarities], dtype=np.int64)
+        if missing.shape[0]:
+            similarities.update(zip(missing.tolist(), self._exact_scores(query, missing).tolist()))
+        return [(row, float(similarities[row])) for row, _ in fused]
+
+    def _scores(self, query: np.ndarray, size: int, block_rows: int = 65536) -> np.ndarray:
+        """Similarities of every row to query (d,) -> (size,), or to queries (b, d) -> (size, b)."""
+        if self.codec is not None:
+            codes = self._codes[:size]
+            if query.ndim == 1:
+                return self.codec.scores(query, codes)
+            return np.stack([self.codec.scores(q, codes) for q in query], axis=1)
+        if self._base is None:
+            return self._vectors[:size] @ query.T
+        base = self._base
+        if base.dtype == np.float32:
+            base_scores = base @ query.T
+        else:
+            # float16 snapshots are upcast block by block to keep BLAS on float32.
+            base_scores = np.empty((base.shape[0],) + query.shape[:-1], dtype=np.float32)
+            for start in range(0, base.shape[0], block_rows):
+                block = np.asarray(base[start:start + block_rows], dtype=np.float32)
+                base_scores[start:start + block.shape[0]] = block @ query.T
+        delta_size = size - base.shape[0]
+        if delta_size <= 0:
+            return base_scores[:size]
+        return np.concatenate([base_scores, self._vectors[:delta_size] @ query.T])
+
+    def search_batch(
+        self,
+        query_vectors: Iterable[Iterable[float]],
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+        query_texts: Optional[List[str]] = None,
+        max_block_bytes: int = 256 * 1024 * 1024,
+        **ann_params,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        search() for many queries at once: one matrix-matrix product per block
+        of queries plus a row-wise argpartition. Blocks are sized so the score
+        matrix stays under max_block_bytes. With an ANN engine (and no filter but the tier)
+        each query goes through the engine instead. query_texts enables the
+        same BM25 fusion as search(), one text per query vector.
+        """
+        queries = normalize_vectors(np.asarray(query_vectors, dtype=np.float32))
+        if query_texts is not None:
+            if len(query_texts) != queries.shape[0]:
+                raise ValueError("Expected one query text per query vector")
+            size = self._size
+            vector_hits = self.search_batch(queries, self._fusion_depth(top_k), filters=filters, exact=exact,
+                                            max_block_bytes=max_block_bytes, **ann_params)
+            return [
+                self._fuse(query, text, hits, top_k, filters, size) if text else hits[:top_k]
+                for query, text, hits in zip(queries, query_texts, vector_hits)
+            ]
+
+        size = self._size
+        if size == 0 or top_k <= 0 or queries.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {self.dim}")
+
+        if self.codec is not None:
+            # Compressed scoring is per query (lookup tables), so there is no matrix product to batch.
+            return [self.search(query, top_k, filters=filters, exact=exact, **ann_params) for query in queries]
+
+        rows, candidates = None, None
+        mask, selective = self._split_tier(filters, size)
+        if selective:
+            rows = self.filtered_entries(filters, size)
+            candidates = self.get_vectors(rows)
+        elif self.ann is not None and not exact:
+            return [self.ann.search(query, top_k, mask=mask, **ann_params) for query in queries]
+        elif mask is not None:
+            # Tier only: score every entry in one product and keep the tier's columns.
+            rows = np.flatnonzero(mask)
+        if rows is not None and rows.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        n = size if candidates is None else rows.shape[0]
+        block = max(1, max_block_bytes // (4 * n))
+        results = []
+        for start in range(0, queries.shape[0], block):
+            chunk = queries[start:start + block]
+            if candidates is not None:
+                scores = chunk @ candidates.T
+            else:
+                scores = self._scores(chunk, size).T
+                if rows is not None:
+                    scores = scores[:, rows]
+            results.extend(self._top_k_batch(scores, top_k, rows))
+        return results
+
+    @staticmethod
+    def _top_k_batch(scores: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        top = np.take_along_axis(candidates, order, axis=1)
+        top_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        if rows is not None:
+            top = rows[top]
+        return [
+            [(int(row), float(score)) for row, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(top.tolist(), top_scores.tolist())
+        ]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        k = min(top_k, scores.shape[0])
+        if k == 0:
+            return []
+        if k < scores.shape[0]:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(scores.shape[0])
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        if rows is None:
+            return [(int(i), float(scores[i])) for i in order]
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def result(
+        self,
+        row: int,
+        similarity: float,
+        include_vector: bool = False,
+        filters: Optional[Dict[str, Any]] = None,
+        max_rows: int = 50,
+    ) -> Dict[str, Any]:
+        """
+        Chunk dict for an entry: its text, similarity and purchase rows (only
+        those matching filters, at most max_rows; row_count has the total).
+        metadata is the first such row, or the entry's own metadata if none.
+        """
+        with self._lock:
+            rows = [self.row_metadata[r] for r in self._entry_rows[row]]
+        if filters:
+            rows = [meta for meta in rows if metadata_matches(meta, filters)]
+        result = {
+            "id": self.ids[row],
+            "text": self.texts[row],
+            "metadata": rows[0] if rows else self.metadata[row],
+            "similarity": similarity,
+            "rows": rows[:max_rows],
+            "row_count": len(rows),
+        }
+        if include_vector:
+            result["vector"] = self.get_vectors(np.array([row]))[0]
+        return result
+
+    @classmethod
+    def from_arrays(
+        cls,
+        doc_ids: List[str],
+        vectors: np.ndarray,
+        metadata: List[Dict[str, Any]],
+        texts: Optional[List[Optional[str]]] = None,
+        rows: Optional[List[Tuple[int, Dict[str, Any]]]] = None,
+    ) -> "VectorIndex":
+        """
+        Wrap an existing matrix of already-normalized vectors without copying it.
+        Documents added afterwards go to a separate in-memory matrix, so a
+        memory-mapped base stays shared with other processes. rows lists
+        (entry, metadata) purchase rows; by default each entry is its own row.
+        """
+        if vectors.ndim != 2 or vectors.shape[0] != len(doc_ids):
+            raise ValueError("Expected one vector per document id")
+        index = cls(dim=vectors.shape[1], initial_capacity=16)
+        index._base = vectors
+        index._size = vectors.shape[0]
+        index.ids = list(doc_ids)
+        index.metadata = list(metadata)
+        if texts is None:
+            texts = [None] * len(doc_ids)
+        index.texts = [
+            text if text is not None else (meta or {}).get("item_desc", "")
+            for text, meta in zip(texts, index.metadata)
+        ]
+        index._positions = {doc_id: position for position, doc_id in enumerate(index.ids)}
+        index._entry_rows = [array("q") for _ in index.ids]
+        index._set_tiers_locked(0, index.metadata)
+        if rows is None:
+            rows = list(enumerate(index.metadata))
+        index._add_rows_locked([entry for entry, _ in rows], [meta for _, meta in rows])
+        return index
+
+    @classmethod
+    def from_collection(cls, collection, batch_size: int = 1000) -> "VectorIndex":
+        """
+        Build an index with a single pass over a Mongo/Cosmos collection.
+        Documents with a vector are entries; deduplicated text entries
+        (kind "text") get their rows from kind "row" documents, which are
+        attached once every entry is loaded. Rows whose text is missing are skipped.
+        """
+        index = cls()
+        ids, vectors, metadata, texts, rows = [], [], [], [], []
+        row_ids, row_metadata = [], []
+        projection = {"vector": 1, "metadata": 1, "text": 1, "kind": 1, "text_id": 1}
+        for doc in collection.find({}, projection, batch_size=batch_size):
+            if doc.get("kind") == "row":
+                row_ids.append(str(doc["text_id"]))
+                row_metadata.append(doc.get("metadata", {}))
+                continue
+            ids.append(str(doc["_id"]))
+            vectors.append(doc["vector"])
+            metadata.append(doc.get("metadata", {}))
+            texts.append(doc.get("text"))
+            rows.append([] if doc.get("kind") == "text" else [metadata[-1]])
+            if len(ids) >= batch_size:
+                index.add_many(ids, vectors, metadata, texts, rows)
+                ids, vectors, metadata, texts, rows = [], [], [], [], []
+        index.add_many(ids, vectors, metadata, texts, rows)
+
+        known = [i for i, text_id in enumerate(row_ids) if index.position(text_id) is not None]
+        index.add_rows([row_ids[i] for i in known], [row_metadata[i] for i in known])
+        return index
@@ -1,32 +1,347 @@
 import os
-from typing import List, Dict
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
+import hashlib
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import PyMongoError, BulkWriteError
 import numpy as np
 from dotenv import load_dotenv
+from app.services.vector_index import VectorIndex
+from app.services.vector_snapshot import load_snapshot, resolve_snapshot, ann_path
+from app.services.ann_index import load_ann_index
 
 load_dotenv()
 
 COSMOS_URI = os.getenv("COSMOS_URI")
 COSMOS_DB_NAME = os.getenv("COSMOS_DB_NAME", "medmine")
 COSMOS_COLLECTION_NAME = os.getenv("COSMOS_COLLECTION_NAME", "embeddings")
+# Snapshot root written by app/script/export_vector_snapshot.py; when it has a
+# CURRENT version, workers memory-map it instead of scanning the collection.
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR")
+# With Cosmos DB, get_vector_index re-reads CURRENT at most this often
+# (seconds; 0 disables it) and reloads the index when a newer version was
+# exported, so workers pick up new snapshots without a restart.
+VECTOR_SNAPSHOT_POLL_SECONDS = float(os.getenv("VECTOR_SNAPSHOT_POLL_SECONDS", "60"))
 
-client = MongoClient(COSMOS_URI)
-db = client[COSMOS_DB_NAME]
-collection = db[COSMOS_COLLECTION_NAME]
+# Search engine: "exact" (full matrix-vector product), "ivf" or "hnsw".
+VECTOR_ANN = os.getenv("VECTOR_ANN", "exact").lower()
+ANN_PARAMS = {
+    "ivf": {
+        "nlist": int(os.getenv("VECTOR_IVF_NLIST", "0")),  # 0 = 4 * sqrt(n)
+        "nprobe": int(os.getenv("VECTOR_IVF_NPROBE", "8")),
+    },
+    "hnsw": {
+        "m": int(os.getenv("VECTOR_HNSW_M", "16")),
+        "ef_construction": int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "100")),
+        "ef_search": int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64")),
+    },
+}
+# Query-time knobs that may be changed without rebuilding a persisted engine.
+ANN_RUNTIME_PARAMS = {"ivf": ("nprobe",), "hnsw": ("ef_search",)}
 
-def store_embedding(doc_id: str, embedding: List[float], metadata: Dict):
+# Hybrid retrieval: fuse BM25 matches on text/metadata with vector results
+# (reciprocal rank fusion) whenever the caller passes the query text.
+VECTOR_HYBRID = os.getenv("VECTOR_HYBRID", "true").lower() in ("1", "true", "yes")
+VECTOR_RRF_K = int(os.getenv("VECTOR_RRF_K", "60"))
+
+# Compressed vector storage: "none", "int8" (4x smaller) or "pq" (product
+# quantization, VECTOR_PQ_M bytes per vector). Searches score the codes and,
+# while full vectors are still reachable (memory-mapped snapshot or
+# VECTOR_CODEC_KEEP_VECTORS), re-rank the best VECTOR_RERANK_K exactly.
+# Use app/script/codec_report.py to pick VECTOR_PQ_M for a recall target.
+VECTOR_CODEC = os.getenv("VECTOR_CODEC", "none").lower()
+CODEC_PARAMS = {
+    "int8": {},
+    "pq": {"m": int(os.getenv("VECTOR_PQ_M", "16"))},
+}
+VECTOR_RERANK_K = int(os.getenv("VECTOR_RERANK_K", "100"))
+VECTOR_CODEC_KEEP_VECTORS = os.getenv("VECTOR_CODEC_KEEP_VECTORS", "false").lower() in ("1", "true", "yes")
+
+# Without COSMOS_URI the store lives in this process only: writes go straight
+# into the resident index (seeded from VECTOR_SNAPSHOT_DIR when it has one)
+# and are lost on exit. Meant for offline runs, demos and load tests.
+if COSMOS_URI:
+    client = MongoClient(COSMOS_URI)
+    db = client[COSMOS_DB_NAME]
+    collection = db[COSMOS_COLLECTION_NAME]
+else:
+    client = db = collection = None
+STORE_NAME = "Cosmos DB" if collection is not None else "the in-process store"
+# Row ids already stored in-process (Cosmos DB tracks them itself).
+_local_row_ids: set = set()
+
+# Resident index shared by every request in this process; loaded on first use.
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+_index_generation = 0
+# Snapshot version the resident index was loaded from, and when CURRENT was last read.
+_index_snapshot: Optional[str] = None
+_snapshot_checked = 0.0
+_snapshot_lock = threading.Lock()
+
+def _attach_ann(index: VectorIndex, snapshot_path: Optional[str] = None):
+    if VECTOR_ANN == "exact":
+        return
+    if VECTOR_ANN not in ANN_PARAMS:
+        print(f" Unknown VECTOR_ANN '{VECTOR_ANN}'; using exact search.")
+        return
+
+    saved = ann_path(snapshot_path, VECTOR_ANN) if snapshot_path else None
+    if saved and os.path.isdir(saved):
+        ann = load_ann_index(saved)
+        for knob in ANN_RUNTIME_PARAMS[VECTOR_ANN]:
+            setattr(ann, knob, ANN_PARAMS[VECTOR_ANN][knob])
+        index.attach_ann(ann)
+        print(f" Loaded {VECTOR_ANN} engine from {saved}.")
+    elif index.build_ann(VECTOR_ANN, **ANN_PARAMS[VECTOR_ANN]) is not None:
+        print(f" Built {VECTOR_ANN} engine over {len(index)} documents.")
+
+def _compress(index: VectorIndex):
+    if VECTOR_CODEC == "none":
+        return
+    if VECTOR_CODEC not in CODEC_PARAMS:
+        print(f" Unknown VECTOR_CODEC '{VECTOR_CODEC}'; keeping float32 vectors.")
+        return
+    if index.compress(
+        VECTOR_CODEC,
+        keep_vectors=VECTOR_CODEC_KEEP_VECTORS,
+        rerank_k=VECTOR_RERANK_K,
+        **CODEC_PARAMS[VECTOR_CODEC],
+    ) is not None:
+        usage = index.memory_usage()
+        print(f" Compressed {usage['rows']} vectors with {VECTOR_CODEC}: "
+              f"{usage['resident_bytes'] / 2 ** 20:.1f} MB resident.")
+
+def _load_vector_index() -> Tuple[VectorIndex, Optional[str]]:
+    index, snapshot_path = None, None
+    if VECTOR_SNAPSHOT_DIR:
+        snapshot_path = resolve_snapshot(VECTOR_SNAPSHOT_DIR)
+        if snapshot_path:
+            index = load_snapshot(snapshot_path)
+            print(f" Memory-mapped vector snapshot {snapshot_path} with {len(index)} documents.")
+        else:
+            print(f" No snapshot found in {VECTOR_SNAPSHOT_DIR}; scanning Cosmos DB instead.")
+    if index is None and collection is None:
+        index = VectorIndex()
+        print(" COSMOS_URI is not set; using an in-process vector store.")
+    elif index is None:
+        index = VectorIndex.from_collection(collection)
+        print(f" Loaded vector index with {len(index)} documents.")
+    index.rrf_k = VECTOR_RRF_K
+    _attach_ann(index, snapshot_path)
+    _compress(index)
+    return index, snapshot_path
+
+def get_vector_index() -> VectorIndex:
+    global _index, _index_generation, _index_snapshot, _snapshot_checked
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index, _index_snapshot = _load_vector_index()
+                _index_generation += 1
+                _snapshot_checked = time.monotonic()
+    elif _snapshot_due():
+        current = resolve_snapshot(VECTOR_SNAPSHOT_DIR)
+        if current is not None and current != _index_snapshot:
+            print(f" Vector snapshot {current} replaced {_index_snapshot}; reloading the index.")
+            reload_vector_index()
+    return _index
+
+def _snapshot_due() -> bool:
+    """Whether this call should re-read CURRENT; at most one caller per poll interval gets True."""
+    global _snapshot_checked
+    if not VECTOR_SNAPSHOT_DIR or collection is None or VECTOR_SNAPSHOT_POLL_SECONDS <= 0:
+        return False
+    now = time.monotonic()
+    with _snapshot_lock:
+        if now - _snapshot_checked < VECTOR_SNAPSHOT_POLL_SECONDS:
+            return False
+        _snapshot_checked = now
+    return True
+
+def reload_vector_index() -> VectorIndex:
+    global _index, _index_generation, _index_snapshot
+    if collection is None and _index is not None:
+        # In-process store: the resident index is the only copy of the data.
+        return _index
+    # Searches keep using the old index until the new one is swapped in.
+    index, snapshot_path = _load_vector_index()
+    with _index_lock:
+        _index, _index_snapshot = index, snapshot_path
+        _index_generation += 1
+    return _index
+
+def index_version() -> str:
+    """Changes whenever the resident index is reloaded or modified (cache key component)."""
+    index = get_vector_index()
+    return f"{_index_generation}.{index.version}"
+
+def _written_index() -> Optional[VectorIndex]:
+    """Index to update after a write: the loaded one, or in-process the store itself."""
+    return get_vector_index() if collection is None else _index
+
+def persistent_store() -> bool:
+    """Whether writes outlive the process (Cosmos DB), so an interrupted ingestion can resume."""
+    return collection is not None
+
+def store_embedding(doc_id: str, embedding: List[float], metadata: Dict, text: Optional[str] = None):
     try:
         document = {
             "_id": doc_id,
             "vector": embedding,
             "metadata": metadata
         }
-        collection.insert_one(document)
-        print(f" Inserted document {doc_id} into Cosmos DB.")
+        if text is not None:
+            document["text"] = text
+        if collection is not None:
+            collection.insert_one(document)
+        index = _written_index()
+        if index is not None:
+            index.add(doc_id, embedding, metadata, text)
+        print(f" Inserted document {doc_id} into {STORE_NAME}.")
     except PyMongoError as e:
         print(f"Error inserting document: {e}")
 
+def content_hash(text: str) -> str:
+    """Id of a deduplicated text entry: SHA-256 of the embedded text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def row_document_id(metadata: Dict, source: str, line: int) -> str:
+    """
+    Deterministic id of a purchase row: "row:<TransactionID>", so the same
+    transaction from a replayed batch or an overlapping extract is upserted
+    rather than duplicated. Rows without one fall back to "row:<source>:<line>";
+    pass the file's full path as source so files sharing a name stay apart.
+    """
+    transaction_id = metadata.get("transaction_id")
+    if transaction_id is None or transaction_id != transaction_id:  # missing or NaN
+        return f"row:{source}:{line}"
+    if isinstance(transaction_id, (float, np.floating)) and float(transaction_id).is_integer():
+        transaction_id = int(transaction_id)
+    return f"row:{transaction_id}"
+
+def existing_text_ids(text_ids: List[str], batch_size: int = 1000) -> set:
+    """The subset of text_ids that already have a stored vector."""
+    if _index is not None or collection is None:
+        index = get_vector_index()
+        return {text_id for text_id in text_ids if index.position(text_id) is not None}
+    found = set()
+    try:
+        for start in range(0, len(text_ids), batch_size):
+            batch = text_ids[start:start + batch_size]
+            found.update(str(doc["_id"]) for doc in collection.find({"_id": {"$in": batch}}, {"_id": 1}))
+    except PyMongoError as e:
+        print(f" Error checking stored texts: {e}")
+    return found
+
+def store_text_embeddings(text_ids: List[str], embeddings: List[List[float]], texts: List[str], metadata: List[Dict]):
+    """
+    Store one vector per unique text ({"kind": "text"}); purchase rows are
+    stored separately with store_rows and point at it through text_id.
+    Texts are keyed by content hash, so storing one again is a no-op.
+    Write errors are re-raised so ingestion does not checkpoint past them.
+    """
+    if not text_ids:
+        return
+    documents = [
+        {"_id": text_id, "kind": "text", "vector": embedding, "text": text, "metadata": meta}
+        for text_id, embedding, text, meta in zip(text_ids, embeddings, texts, metadata)
+    ]
+    try:
+        if collection is not None:
+            collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Another ingestion stored some of the same texts first; those vectors are identical.
+        duplicates = [error for error in e.details.get("writeErrors", []) if error.get("code") == 11000]
+        if len(duplicates) != len(e.details.get("writeErrors", [])):
+            print(f"Error inserting text embeddings: {e}")
+            raise
+    except PyMongoError as e:
+        print(f"Error inserting text embeddings: {e}")
+        raise
+    index = _written_index()
+    if index is not None:
+        index.add_many(text_ids, embeddings, metadata, texts, rows=[[] for _ in text_ids])
+    print(f" Inserted {len(text_ids)} text embeddings into {STORE_NAME}.")
+
+def store_rows(row_ids: List[str], text_ids: List[str], metadata: List[Dict]):
+    """
+    Upsert purchase rows ({"kind": "row"}) under their deterministic ids
+    (see row_document_id), each pointing at its text entry. Replaying rows
+    is idempotent; a running index only gains the rows that were new.
+    Write errors are re-raised.
+    """
+    if not row_ids:
+        return
+    if collection is None:
+        inserted = []
+        for i, row_id in enumerate(row_ids):
+            if row_id not in _local_row_ids:
+                _local_row_ids.add(row_id)
+                inserted.append(i)
+    else:
+        operations = [
+            ReplaceOne({"_id": row_id}, {"kind": "row", "text_id": text_id, "metadata": meta}, upsert=True)
+            for row_id, text_id, meta in zip(row_ids, text_ids, metadata)
+        ]
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            print(f"Error upserting rows: {e}")
+            raise
+        inserted = sorted(result.upserted_ids)
+    index = _written_index()
+    if index is not None and inserted:
+        index.add_rows([text_ids[i] for i in inserted], [metadata[i] for i in inserted])
+    print(f" Upserted {len(row_ids)} rows into {STORE_NAME} ({len(inserted)} new).")
+
+def stored_texts(doc_ids: List[str], batch_size: int = 1000) -> Dict[str, str]:
+    """Current text of each stored document among doc_ids."""
+    found = {}
+    if collection is None:
+        index = get_vector_index()
+        for doc_id in doc_ids:
+            position = index.position(doc_id)
+            if position is not None:
+                found[doc_id] = index.texts[position]
+        return found
+    try:
+        for start in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[start:start + batch_size]
+            for doc in collection.find({"_id": {"$in": batch}}, {"text": 1}):
+                found[str(doc["_id"])] = doc.get("text")
+    except PyMongoError as e:
+        print(f" Error reading stored texts: {e}")
+    return found
+
+def store_summaries(doc_ids: List[str], embeddings: List[List[float]], texts: List[str], metadata: List[Dict]):
+    """
+    Upsert summary-tier chunks ({"kind": "summary"}) under their deterministic
+    ids. A running index adds new summaries and replaces the vector, text and
+    metadata of ones it already holds. Write errors are re-raised.
+    """
+    if not doc_ids:
+        return
+    if collection is not None:
+        operations = [
+            ReplaceOne(
+                {"_id": doc_id},
+                {"kind": "summary", "vector": embedding, "text": text, "metadata": meta},
+                upsert=True,
+            )
+            for doc_id, embedding, text, meta in zip(doc_ids, embeddings, texts, metadata)
+        ]
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            print(f"Error upserting summaries: {e}")
+            raise
+    index = _written_index()
+    if index is not None:
+        index.upsert_many(doc_ids, embeddings, metadata, texts)
+    print(f" Upserted {len(doc_ids)} summary chunks into {STORE_NAME}.")
+
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     v1 = np.array(vec1)
     v2 = np.array(vec2)
@@ -36,21 +351,63 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
         return 0.0
     return float(np.dot(v1, v2) / (norm1 * norm2))
 
-def query_similar_chunks(query_vector: List[float], top_k: int = 5) -> List[Dict]:
+def query_similar_chunks(
+    query_vector: List[float],
+    top_k: int = 5,
+    filters: Optional[Dict] = None,
+    query_text: Optional[str] = None,
+    include_vectors: bool = False,
+) -> List[Dict]:
+    """
+    Top-k chunks by cosine similarity. filters is a metadata filter expression
+    such as {"region": "Pacific", "year": 2023}; only matching rows are scored.
+    Passing query_text fuses BM25 token matches into the ranking (VECTOR_HYBRID).
+    include_vectors adds each chunk's normalized vector (for MMR re-ranking).
+
+    Each unique text is scored and returned once; its purchase rows (those
+    matching filters) are listed under "rows", with the total in "row_count".
+    """
     try:
-        results = []
-        for doc in collection.find({}):
-            stored_vector = doc["vector"]
-            similarity = cosine_similarity(query_vector, stored_vector)
-            results.append({
-                "text": doc.get("metadata", {}).get("item_desc", ""),
-                "metadata": doc["metadata"],
-                "similarity": similarity
-            })
-
-        results = sorted(results, key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+        index = get_vector_index()
+        query_text = query_text if VECTOR_HYBRID else None
+        return [
+            index.result(row, similarity, include_vector=include_vectors, filters=filters)
+            for row, similarity in index.search(query_vector, top_k, filters=filters, query_text=query_text)
+        ]
 
     except PyMongoError as e:
         print(f" Error querying Cosmos DB: {e}")
         return []
+
+def get_chunks(
+    hits: List[Tuple[str, float]],
+    filters: Optional[Dict] = None,
+    include_vectors: bool = False,
+) -> List[Dict]:
+    """Rebuild query_similar_chunks results from (chunk id, similarity) pairs, e.g. cached ones."""
+    index = get_vector_index()
+    chunks = []
+    for doc_id, similarity in hits:
+        row = index.position(doc_id)
+        if row is not None:
+            chunks.append(index.result(row, similarity, include_vector=include_vectors, filters=filters))
+    return chunks
+
+def query_similar_chunks_batch(
+    query_vectors: List[List[float]],
+    top_k: int = 5,
+    filters: Optional[Dict] = None,
+    query_texts: Optional[List[str]] = None,
+) -> List[List[Dict]]:
+    """query_similar_chunks for N query vectors in one matrix-matrix pass; returns N top-k lists."""
+    try:
+        index = get_vector_index()
+        query_texts = query_texts if VECTOR_HYBRID else None
+        return [
+            [index.result(row, similarity, filters=filters) for row, similarity in hits]
+            for hits in index.search_batch(query_vectors, top_k, filters=filters, query_texts=query_texts)
+        ]
+
+    except PyMongoError as e:
+        print(f" Error querying Cosmos DB: {e}")
+        return [[] for _ in query_vectors]
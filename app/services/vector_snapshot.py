@@ -0,0 +1,199 @@
+"""
+On-disk snapshots of the embedding store.
+
+A snapshot root holds one directory per version plus a CURRENT pointer:
+
+    <root>/CURRENT                   name of the active version directory
+    <root>/<version>/manifest.json   format version, dtype, dim, count, row_bytes
+    <root>/<version>/vectors.bin     raw row-major normalized vectors (float32 or float16)
+    <root>/<version>/ids.tsv         "<doc id>\\t<byte offset into vectors.bin>" per entry
+    <root>/<version>/metadata.jsonl  one compact JSON metadata object per entry
+    <root>/<version>/texts.jsonl     one JSON string (chunk text or null) per entry; optional
+    <root>/<version>/rows.jsonl      one "[entry, metadata]" JSON pair per purchase row (format 2)
+    <root>/<version>/ann-<engine>/   optional persisted IVF/HNSW engine for this version
+
+An entry is one stored vector: a legacy per-row document or a deduplicated
+text shared by many purchase rows (see VectorIndex). Format 1 snapshots have
+no rows.jsonl and every entry is its own row.
+
+Workers open vectors.bin with np.memmap, so startup does not read the vectors
+and the OS page cache keeps a single physical copy for every process.
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from app.services.vector_index import VectorIndex, normalize_vectors
+
+SNAPSHOT_FORMAT_VERSION = 2
+READABLE_FORMAT_VERSIONS = (1, 2)
+SUPPORTED_DTYPES = {"float32": np.float32, "float16": np.float16}
+CURRENT_POINTER = "CURRENT"
+
+
+def export_snapshot(collection, root: str, dtype: str = "float32", batch_size: int = 1000) -> str:
+    """
+    Stream every document of the collection into a new snapshot version under
+    root and point CURRENT at it. Returns the version directory.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported snapshot dtype: {dtype}")
+    np_dtype = SUPPORTED_DTYPES[dtype]
+
+    os.makedirs(root, exist_ok=True)
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    tmp_dir = os.path.join(root, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    dim = None
+    count = 0
+    row_count = 0
+    try:
+        with open(os.path.join(tmp_dir, "vectors.bin"), "wb") as vectors_file, \
+                open(os.path.join(tmp_dir, "ids.tsv"), "w", encoding="utf-8") as ids_file, \
+                open(os.path.join(tmp_dir, "metadata.jsonl"), "w", encoding="utf-8") as metadata_file, \
+                open(os.path.join(tmp_dir, "texts.jsonl"), "w", encoding="utf-8") as texts_file, \
+                open(os.path.join(tmp_dir, "rows.jsonl"), "w", encoding="utf-8") as rows_file:
+
+            def write_row(entry, meta):
+                nonlocal row_count
+                rows_file.write(json.dumps([entry, meta], separators=(",", ":"), default=str) + "\n")
+                row_count += 1
+
+            positions = {}
+            pending_rows = []
+
+            def flush(ids, vectors, metadata, texts, own_rows):
+                nonlocal dim, count
+                if not ids:
+                    return
+                matrix = normalize_vectors(np.asarray(vectors, dtype=np.float32))
+                if dim is None:
+                    dim = matrix.shape[1]
+                elif matrix.shape[1] != dim:
+                    raise ValueError(f"Vector dimension {matrix.shape[1]} does not match snapshot dimension {dim}")
+                row_bytes = dim * np.dtype(np_dtype).itemsize
+                vectors_file.write(matrix.astype(np_dtype).tobytes())
+                entries = zip(ids, metadata, texts, own_rows)
+                for offset, (doc_id, meta, text, own_row) in enumerate(entries, start=count):
+                    ids_file.write(f"{doc_id}\t{offset * row_bytes}\n")
+                    metadata_file.write(json.dumps(meta, separators=(",", ":"), default=str) + "\n")
+                    texts_file.write(json.dumps(text) + "\n")
+                    positions[doc_id] = offset
+                    if own_row:
+                        write_row(offset, meta)
+                count += len(ids)
+
+            ids, vectors, metadata, texts, own_rows = [], [], [], [], []
+            projection = {"vector": 1, "metadata": 1, "text": 1, "kind": 1, "text_id": 1}
+            for doc in collection.find({}, projection, batch_size=batch_size):
+                if doc.get("kind") == "row":
+                    pending_rows.append((str(doc["text_id"]), doc.get("metadata", {})))
+                    continue
+                ids.append(str(doc["_id"]))
+                vectors.append(doc["vector"])
+                metadata.append(doc.get("metadata", {}))
+                texts.append(doc.get("text"))
+                own_rows.append(doc.get("kind") != "text")
+                if len(ids) >= batch_size:
+                    flush(ids, vectors, metadata, texts, own_rows)
+                    ids, vectors, metadata, texts, own_rows = [], [], [], [], []
+            flush(ids, vectors, metadata, texts, own_rows)
+            # Row documents may precede their text in scan order, so they are written last.
+            for text_id, meta in pending_rows:
+                if text_id in positions:
+                    write_row(positions[text_id], meta)
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version": version,
+            "created_at": datetime.utcnow().isoformat(),
+            "dtype": dtype,
+            "dim": dim or 0,
+            "count": count,
+            "row_count": row_count,
+            "row_bytes": (dim or 0) * np.dtype(np_dtype).itemsize,
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        version_dir = os.path.join(root, version)
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # Swap the pointer atomically so readers never see a half-written version.
+    pointer_tmp = os.path.join(root, f".{CURRENT_POINTER}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_POINTER))
+    return version_dir
+
+
+def resolve_snapshot(root: str) -> Optional[str]:
+    """Return the version directory CURRENT points to, or None if there is none."""
+    pointer = os.path.join(root, CURRENT_POINTER)
+    if not os.path.isfile(pointer):
+        return None
+    with open(pointer, encoding="utf-8") as f:
+        version = f.read().strip()
+    version_dir = os.path.join(root, version)
+    return version_dir if os.path.isdir(version_dir) else None
+
+
+def ann_path(version_dir: str, kind: str) -> str:
+    return os.path.join(version_dir, f"ann-{kind}")
+
+
+def load_snapshot(path: str, mmap: bool = True) -> VectorIndex:
+    """
+    Open a snapshot as a VectorIndex. path may be a snapshot root (CURRENT is
+    followed) or a version directory.
+    """
+    if not os.path.isfile(os.path.join(path, "manifest.json")):
+        resolved = resolve_snapshot(path)
+        if resolved is None:
+            raise FileNotFoundError(f"No vector snapshot found at {path}")
+        path = resolved
+
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") not in READABLE_FORMAT_VERSIONS:
+        raise ValueError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+
+    count, dim = manifest["count"], manifest["dim"]
+    np_dtype = SUPPORTED_DTYPES[manifest["dtype"]]
+    if count == 0:
+        return VectorIndex()
+
+    vectors_path = os.path.join(path, "vectors.bin")
+    if mmap:
+        vectors = np.memmap(vectors_path, dtype=np_dtype, mode="r", shape=(count, dim))
+    else:
+        vectors = np.fromfile(vectors_path, dtype=np_dtype).reshape(count, dim)
+
+    with open(os.path.join(path, "ids.tsv"), encoding="utf-8") as f:
+        ids = [line.rstrip("\n").split("\t", 1)[0] for line in f]
+    with open(os.path.join(path, "metadata.jsonl"), encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f]
+    texts = None
+    texts_path = os.path.join(path, "texts.jsonl")
+    if os.path.isfile(texts_path):
+        with open(texts_path, encoding="utf-8") as f:
+            texts = [json.loads(line) for line in f]
+    rows = None
+    rows_path = os.path.join(path, "rows.jsonl")
+    if manifest["format_version"] >= 2:
+        with open(rows_path, encoding="utf-8") as f:
+            rows = [tuple(json.loads(line)) for line in f]
+    if len(ids) != count or len(metadata) != count or (texts is not None and len(texts) != count):
+        raise ValueError(f"Snapshot at {path} is inconsistent with its manifest")
+    if rows is not None and len(rows) != manifest.get("row_count", len(rows)):
+        raise ValueError(f"Snapshot at {path} is inconsistent with its manifest")
+
+    return VectorIndex.from_arrays(ids, vectors, metadata, texts, rows)
@@ -0,0 +1,198 @@
+"""
+In-process caches shared by the retrieval and generation services.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a question: casefolded, single-spaced, without trailing punctuation."""
+    return " ".join(text.casefold().split()).rstrip("?!. ")
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable short digest of JSON-serialisable parts, e.g. a prompt context and its filters."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class TTLLRUCache:
+    """
+    Thread-safe mapping with least-recently-used eviction beyond max_entries
+    and per-entry expiry after ttl_seconds (None disables expiry). Keeps
+    hit/miss/eviction counters for stats().
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The cached value, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SemanticCache:
+    """
+    Answers keyed by question embedding. lookup() returns the answer stored
+    for the most similar earlier question when cosine similarity reaches
+    threshold and its fingerprint (context/filters) and version (data
+    version) are identical. Vectors live in one preallocated matrix of
+    max_entries rows; the least recently used row is overwritten when full,
+    and entries expire after ttl_seconds (None disables expiry).
+    """
+
+    def __init__(self, dim: Optional[int] = None, max_entries: int = 1024, threshold: float = 0.92,
+                 ttl_seconds: Optional[float] = 3600.0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._vectors: Optional[np.ndarray] = None if dim is None else np.zeros((max_entries, dim), dtype=np.float32)
+        self._live = np.zeros(max_entries, dtype=bool)
+        self._entries: List[Optional[tuple]] = [None] * max_entries  # (fingerprint, version, value, expires_at)
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.similarity_sum = 0.0
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, vector: Sequence[float], fingerprint: str, version: str = "") -> Optional[Any]:
+        query = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0] or not self._live.any():
+                self.misses += 1
+                return None
+            candidates = np.flatnonzero(self._live)
+            scores = self._vectors[candidates] @ query
+            now = time.monotonic()
+            for position in np.argsort(-scores):
+                if scores[position] < self.threshold:
+                    break
+                slot = int(candidates[position])
+                entry_fingerprint, entry_version, value, expires_at = self._entries[slot]
+                if expires_at is not None and expires_at <= now:
+                    self._drop_locked(slot)
+                    continue
+                if entry_fingerprint == fingerprint and entry_version == version:
+                    self._lru.move_to_end(slot)
+                    self.hits += 1
+                    self.similarity_sum += float(scores[position])
+                    return value
+            self.misses += 1
+            return None
+
+    def store(self, vector: Sequence[float], fingerprint: str, value: Any, version: str = ""):
+        vector = self._normalize(vector)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                # First vector (or a new embedding model) fixes the dimension.
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._live[:] = False
+                self._entries = [None] * self.max_entries
+                self._lru.clear()
+            free = np.flatnonzero(~self._live)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot, _ = self._lru.popitem(last=False)
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._live[slot] = True
+            self._entries[slot] = (fingerprint, version, value, expires_at)
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def _drop_locked(self, slot: int):
+        self._live[slot] = False
+        self._entries[slot] = None
+        self._lru.pop(slot, None)
+
+    def clear(self):
+        with self._lock:
+            self._live[:] = False
+            self._entries = [None] * self.max_entries
+            self._lru.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": int(self._live.sum()),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "mean_hit_similarity": self.similarity_sum / self.hits if self.hits else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,5 +1,10 @@
+import heapq
+import itertools
+import os
+import sqlite3
+import tempfile
 import pandas as pd
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Union
 
 MONTHS = {
     1: "January", 2: "February", 3: "March", 4: "April",
@@ -7,39 +12,312 @@ MONTHS = {
     9: "September", 10: "October", 11: "November", 12: "December"
 }
 
-def csv_to_purchase_chunks(df: pd.DataFrame) -> List[Dict]:
-    chunks = []
+# CSV column -> metadata field of a purchase row.
+COLUMN_FIELDS = {
+    "TransactionID": "transaction_id",
+    "FacilityID": "facility_id",
+    "FacilityType": "facility_type",
+    "Region": "region",
+    "Month": "month",
+    "Year": "year",
+    "Vendor": "vendor",
+    "VendorID": "vendor_id",
+    "Manufacturer": "manufacturer",
+    "ManufacturercatalogNum": "manufacturer_catalog_num",
+    "ItemDesc": "item_desc",
+    "Quantity": "quantity",
+    "PricePaid": "price_paid",
+    "TotalSpend": "total_spend",
+}
+
+# Fields fixed by a row's embedding_text, stored once on the shared text entry.
+ENTRY_FIELDS = ("item_desc", "vendor", "manufacturer")
+
+# Summary tier: group name -> (key columns, column broken down into the top contributors).
+# Each group is summarised per month and per year; keys covering a single purchase are skipped.
+SUMMARY_GROUPS = {
+    "total": ((), "Vendor"),
+    "region": (("Region",), "Vendor"),
+    "vendor_total": (("Vendor",), "Region"),
+    "facility_type": (("FacilityType",), "Vendor"),
+    "vendor": (("Vendor", "Region"), "ItemDesc"),
+    "facility": (("FacilityID", "FacilityType", "Region"), "Vendor"),
+    "item": (("ItemDesc", "Vendor", "Region"), "FacilityType"),
+}
+SUMMARY_PERIODS = {"month": ("Year", "Month"), "year": ("Year",)}
+SUMMARY_TOP_N = 3
+# Finest grain any summary needs; SummaryRollup keeps a file's rows rolled up to it.
+SUMMARY_COLUMNS = ("ItemDesc", "Vendor", "Region", "FacilityID", "FacilityType", "Year", "Month")
+BREAKDOWN_LABELS = {"FacilityType": "facility types", "ItemDesc": "items", "Region": "regions", "Vendor": "vendors"}
+# SummaryRollup stores a missing key value as this: SQLite never merges NULL keys on conflict.
+ROLLUP_MISSING = ""
+
+def _has_value(value) -> bool:
+    """Whether a cell holds something: not None, NaN or blank."""
+    return pd.notna(value) and str(value).strip() != ""
+
+def _rollup_key(value):
+    # pandas reads an integer column with gaps as float: keep 2023, not 2023.0, in summary ids.
+    if pd.isna(value):
+        return ROLLUP_MISSING
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+def purchase_text(metadata: Dict) -> str:
+    """One-sentence description of a purchase row, rendered from its metadata."""
+    month = MONTHS.get(int(metadata['month']), f"Month-{metadata['month']}")
+    year = int(metadata['year'])
+    return (
+        f"In {month} {year}, a {metadata['facility_type']} facility in the {metadata['region']} region "
+        f"purchased {metadata['quantity']} unit(s) of {metadata['item_desc']} from {metadata['vendor']} "
+        f"for ${metadata['total_spend']:.2f}."
+    )
+
+def embedding_text(metadata: Dict) -> str:
+    """
+    The part of a row that is embedded: what was bought and from whom. Rows
+    sharing it share one stored vector; dates, facilities and amounts stay in
+    the row metadata where filters and aggregation use them.
+    """
+    text = f"{metadata['item_desc']} from {metadata['vendor']}"
+    manufacturer = metadata.get('manufacturer')
+    if _has_value(manufacturer) and manufacturer != metadata['vendor']:
+        text += f", manufactured by {manufacturer}"
+    return text
+
+def entry_metadata(metadata: Dict) -> Dict:
+    """Row metadata fields that are the same for every row sharing an embedding_text."""
+    return {field: metadata.get(field) for field in ENTRY_FIELDS}
+
+def _column(df: pd.DataFrame, column: str) -> list:
+    """Column values as Python objects; a missing column reads as None, like row.get(column)."""
+    return df[column].tolist() if column in df.columns else [None] * len(df)
+
+def purchase_texts(df: pd.DataFrame) -> List[str]:
+    """
+    purchase_text for every row of a purchase DataFrame. Month names and
+    years are resolved once per distinct value, then each row is formatted
+    in one pass over the column lists.
+    """
+    months = _column(df, "Month")
+    years = _column(df, "Year")
+    month_names = {month: MONTHS.get(int(month), f"Month-{month}") for month in set(months)}
+    year_numbers = {year: int(year) for year in set(years)}
+    return [
+        f"In {month_names[month]} {year_numbers[year]}, a {facility_type} facility in the {region} region "
+        f"purchased {quantity} unit(s) of {item_desc} from {vendor} for ${total_spend:.2f}."
+        for month, year, facility_type, region, quantity, item_desc, vendor, total_spend in zip(
+            months, years, _column(df, "FacilityType"), _column(df, "Region"), _column(df, "Quantity"),
+            _column(df, "ItemDesc"), _column(df, "Vendor"), _column(df, "TotalSpend"),
+        )
+    ]
+
+def embedding_texts(df: pd.DataFrame) -> List[str]:
+    """embedding_text for every row of a purchase DataFrame."""
+    return [
+        f"{item_desc} from {vendor}, manufactured by {manufacturer}"
+        if _has_value(manufacturer) and manufacturer != vendor else f"{item_desc} from {vendor}"
+        for item_desc, vendor, manufacturer in zip(
+            _column(df, "ItemDesc"), _column(df, "Vendor"), _column(df, "Manufacturer")
+        )
+    ]
 
-    for _, row in df.iterrows():
-        
-        month = MONTHS.get(int(row['Month']), f"Month-{row['Month']}")
-        year = int(row['Year'])
+def _iter_chunks(texts: List[str], embedded: List[str], columns: Dict[str, list]) -> Iterator[Dict]:
+    fields = list(columns)
+    for text, embedding, values in zip(texts, embedded, zip(*columns.values())):
+        yield {"text": text, "embedding_text": embedding, "metadata": dict(zip(fields, values))}
 
-        text = (
-            f"In {month} {year}, a {row['FacilityType']} facility in the {row['Region']} region "
-            f"purchased {row['Quantity']} unit(s) of {row['ItemDesc']} from {row['Vendor']} "
-            f"for ${row['TotalSpend']:.2f}."
+def csv_to_purchase_chunks(df: pd.DataFrame, lazy: bool = False) -> Union[List[Dict], Iterator[Dict]]:
+    """
+    One chunk per purchase row: {"text", "embedding_text", "metadata"}.
+    Columns are pulled out once as Python lists and texts and metadata
+    dicts are zipped from them, instead of building a pandas Series per
+    row. With lazy=True the chunk dicts are yielded one at a time rather
+    than materialised as a list.
+    """
+    columns = {field: _column(df, column) for column, field in COLUMN_FIELDS.items()}
+    chunks = _iter_chunks(purchase_texts(df), embedding_texts(df), columns)
+    return chunks if lazy else list(chunks)
+
+def _summary_label(group: str, key: Dict) -> str:
+    if group == "total":
+        return "all facilities"
+    if group == "region":
+        return f"the {key['Region']} region"
+    if group == "vendor_total":
+        return f"vendor {key['Vendor']} across all regions"
+    if group == "facility_type":
+        return f"{key['FacilityType']} facilities across all regions"
+    if group == "item":
+        return f"{key['ItemDesc']} from {key['Vendor']} in the {key['Region']} region"
+    if group == "vendor":
+        return f"vendor {key['Vendor']} in the {key['Region']} region"
+    return f"{key['FacilityType']} facility {key['FacilityID']} in the {key['Region']} region"
+
+def summary_filters(filters: Dict) -> Optional[Dict]:
+    """
+    Summary-tier search filters for an aggregate question: its extracted
+    filters narrowed to the coarsest SUMMARY_GROUPS key that covers them,
+    per month when a month is named, else per year. None when no group is
+    keyed on every filtered field (e.g. manufacturer).
+    """
+    fields = set(filters) - {"year", "month", "tier", "summary_group", "period"}
+    covering = [
+        (len(key_columns), group) for group, (key_columns, _) in SUMMARY_GROUPS.items()
+        if fields <= {COLUMN_FIELDS[column] for column in key_columns}
+    ]
+    if not covering:
+        return None
+    return {
+        **filters,
+        "tier": "summary",
+        "summary_group": min(covering)[1],
+        "period": "month" if "month" in filters else "year",
+    }
+
+def _display(value) -> str:
+    return "unknown" if value is None or value == ROLLUP_MISSING else str(value)
+
+class SummaryRollup:
+    """
+    Running SUMMARY_COLUMNS totals of a streamed file, spilled to a temporary
+    SQLite file instead of held in memory: on purchase data that key is
+    close to unique per row. add() upserts one batch (rolled up in pandas
+    first); totals() groups the rollup for one summary group with SQL. Memory
+    depends on the batch size, not on the file, and a batch costs about the
+    same however many were added before it.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        handle, self.path = tempfile.mkstemp(prefix="summary-rollup-", suffix=".sqlite3", dir=directory)
+        os.close(handle)
+        self.rows = 0
+        self._conn = sqlite3.connect(self.path)
+        # Scratch data: nothing to recover after a crash.
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        key = ", ".join(SUMMARY_COLUMNS)
+        self._conn.execute(
+            f"CREATE TABLE rollup ({key}, Purchases INTEGER, Quantity REAL, TotalSpend REAL, PRIMARY KEY ({key}))"
+        )
+
+    def add(self, df: pd.DataFrame):
+        """Roll one batch into the totals; missing columns and values are kept as missing keys, not dropped."""
+        df = df.reindex(columns=[*SUMMARY_COLUMNS, "Quantity", "TotalSpend"])
+        batch = df.groupby(list(SUMMARY_COLUMNS), sort=False, dropna=False).agg(
+            Purchases=("TotalSpend", "size"), Quantity=("Quantity", "sum"), TotalSpend=("TotalSpend", "sum")
+        ).reset_index()
+        columns = list(SUMMARY_COLUMNS) + ["Purchases", "Quantity", "TotalSpend"]
+        values = zip(*(
+            [_rollup_key(value) for value in batch[column].astype(object).tolist()]
+            if column in SUMMARY_COLUMNS else batch[column].tolist()
+            for column in columns
+        ))
+        self._conn.executemany(
+            f"INSERT INTO rollup VALUES ({', '.join('?' * len(columns))}) ON CONFLICT DO UPDATE SET"
+            " Purchases = Purchases + excluded.Purchases, Quantity = Quantity + excluded.Quantity,"
+            " TotalSpend = TotalSpend + excluded.TotalSpend",
+            values,
         )
+        self._conn.commit()
+        self.rows += len(df)
+
+    def totals(self, by: List[str], breakdown: str) -> Iterator[tuple]:
+        """
+        (key values..., purchases, quantity, total_spend, facilities, leaders)
+        per key of by covering more than one purchase; leaders names its top
+        SUMMARY_TOP_N breakdown values by spend, as "name ($spend), ...".
+        Missing key values come back as None and are named "unknown".
+        """
+        width = len(by)
+        keys = "".join(f"{column}, " for column in by)
+        grouping = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+        # Both queries return keys in the same order, so they are merged in one pass.
+        parts = self._conn.execute(
+            f"SELECT {keys}{breakdown}, SUM(Purchases), SUM(Quantity), SUM(TotalSpend) FROM rollup"
+            f" GROUP BY {keys}{breakdown} ORDER BY {keys}{breakdown}"
+        )
+        facilities = self._conn.execute(
+            f"SELECT COUNT(DISTINCT NULLIF(FacilityID, '{ROLLUP_MISSING}')) FROM rollup {grouping}"
+        )
+        for (key, rows), (facility_count,) in zip(itertools.groupby(parts, key=lambda row: row[:width]), facilities):
+            rows = list(rows)
+            purchases = sum(row[width + 1] for row in rows)
+            # A key covering one purchase only repeats that row.
+            if purchases <= 1:
+                continue
+            leaders = heapq.nlargest(SUMMARY_TOP_N, rows, key=lambda row: row[width + 3])
+            yield (
+                *(None if value == ROLLUP_MISSING else value for value in key),
+                purchases,
+                sum(row[width + 2] for row in rows),
+                sum(row[width + 3] for row in rows),
+                facility_count,
+                ", ".join(f"{_display(row[width])} (${row[width + 3]:,.2f})" for row in leaders),
+            )
+
+    def close(self):
+        self._conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _iter_summary_chunks(rollup: SummaryRollup, source: str) -> Iterator[Dict]:
+    for group, (key_columns, breakdown) in SUMMARY_GROUPS.items():
+        label = BREAKDOWN_LABELS[breakdown]
+        for period, period_columns in SUMMARY_PERIODS.items():
+            by = list(key_columns) + list(period_columns)
+            for *values, purchases, quantity, spend, facilities, leaders in rollup.totals(by, breakdown):
+                key = dict(zip(by, values))
+                if any(key[column] is None for column in period_columns):
+                    # Undated rows belong to no period.
+                    continue
+                when = str(int(key["Year"]))
+                if period == "month":
+                    month = int(key["Month"])
+                    when = f"{MONTHS.get(month, f'Month-{month}')} {when}"
+                subject = _summary_label(group, {column: _display(value) for column, value in key.items()})
+                text = (
+                    f"Summary for {subject}, {when}: {int(purchases)} purchases"
+                    + (f" across {int(facilities)} facilities" if facilities else "")
+                    + f", {quantity:g} units, total spend ${spend:,.2f}. Top {label} by spend: {leaders}."
+                )
+
+                metadata = {COLUMN_FIELDS[column]: value for column, value in key.items()}
+                metadata.update({
+                    "tier": "summary",
+                    "summary_group": group,
+                    "period": period,
+                    "purchases": int(purchases),
+                    "quantity": quantity,
+                    "total_spend": round(float(spend), 2),
+                    "source": source,
+                })
+                chunk_id = f"summary:{source}:{group}:{period}:" + "|".join(str(value) for value in values)
+                yield {"id": chunk_id, "text": text, "metadata": metadata}
+
+def _iter_frame_summary_chunks(df: pd.DataFrame, source: str) -> Iterator[Dict]:
+    rollup = SummaryRollup()
+    try:
+        rollup.add(df)
+        yield from _iter_summary_chunks(rollup, source)
+    finally:
+        rollup.close()
 
-        metadata = {
-            "transaction_id": row.get("TransactionID"),
-            "facility_id": row.get("FacilityID"),
-            "facility_type": row.get("FacilityType"),
-            "region": row.get("Region"),
-            "month": row.get("Month"),
-            "year": row.get("Year"),
-            "vendor": row.get("Vendor"),
-            "vendor_id": row.get("VendorID"),
-            "manufacturer": row.get("Manufacturer"),
-            "item_desc": row.get("ItemDesc"),
-            "quantity": row.get("Quantity"),
-            "price_paid": row.get("PricePaid"),
-            "total_spend": row.get("TotalSpend"),
-        }
-
-        chunks.append({
-            "text": text,
-            "metadata": metadata
-        })
-
-    return chunks
+def csv_to_summary_chunks(
+    df: Union[pd.DataFrame, SummaryRollup], source: str, lazy: bool = False
+) -> Union[List[Dict], Iterator[Dict]]:
+    """
+    Pre-aggregated summary chunks (metadata tier "summary") for aggregate
+    questions: totals overall and per region, vendor, facility type,
+    vendor and region, facility and item, each per month and per year,
+    with the top contributors. Ids are deterministic
+    ("summary:<source>:<group>:<period>:<key>") so re-ingesting a file
+    replaces its summaries; summaries describe the rows of that source only.
+    df may be raw purchase rows or the SummaryRollup of a streamed file. With
+    lazy=True the chunks are yielded one at a time rather than materialised
+    as a list.
+    """
+    if isinstance(df, SummaryRollup):
+        chunks = _iter_summary_chunks(df, source)
+    else:
+        chunks = _iter_frame_summary_chunks(df, source)
+    return chunks if lazy else list(chunks)
@@ -0,0 +1,44 @@
+"""
+Synthetic purchase data with the columns of the cleaned purchase CSV, for
+benchmarks and offline load tests.
+"""
+import numpy as np
+import pandas as pd
+
+REGIONS = ["South Atlantic", "New England", "West North Central", "Pacific", "Mountain", "Middle Atlantic"]
+FACILITY_TYPES = ["Hospital", "Clinic", "Surgery Center", "Unknown"]
+VENDORS = ["Bayer Corp Div Bayer AG", "Medline Industries Inc", "Cardinal Health", "McKesson", "Owens & Minor"]
+ITEM_COUNT = 2000
+FACILITY_COUNT = 500
+
+
+def generate_purchase_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Synthetic purchase rows with the columns of the cleaned purchase CSV."""
+    rng = np.random.default_rng(seed)
+    # Each facility keeps one type and region, as in the real extracts.
+    facility_types = np.array(FACILITY_TYPES)[rng.integers(0, len(FACILITY_TYPES), FACILITY_COUNT)]
+    facility_regions = np.array(REGIONS)[rng.integers(0, len(REGIONS), FACILITY_COUNT)]
+    facility = rng.integers(0, FACILITY_COUNT, rows)
+    vendor = rng.integers(0, len(VENDORS), rows)
+    manufacturer = np.where(rng.random(rows) < 0.7, vendor, rng.integers(0, len(VENDORS), rows))
+    quantity = rng.integers(1, 20, rows)
+    price = np.round(rng.uniform(5, 1500, rows), 2)
+    return pd.DataFrame({
+        "TransactionID": np.arange(2_000_000_000, 2_000_000_000 + rows),
+        "FacilityID": 10000 + facility,
+        "FacilityType": facility_types[facility],
+        "Region": facility_regions[facility],
+        "BedSize": "1-50",
+        "Month": rng.integers(1, 13, rows),
+        "Year": rng.integers(2021, 2025, rows),
+        "LoadDate": "1/25/2023",
+        "Vendor": np.array(VENDORS)[vendor],
+        "VendorID": 100000 + vendor,
+        "Manufacturer": np.array(VENDORS)[manufacturer],
+        "ManufacturerID": 100000 + manufacturer,
+        "ManufacturercatalogNum": np.char.add("CAT", rng.integers(0, 5000, rows).astype(str)),
+        "ItemDesc": np.char.add("ITEM ", rng.integers(0, ITEM_COUNT, rows).astype(str)),
+        "Quantity": quantity,
+        "PricePaid": price,
+        "TotalSpend": np.round(price * quantity, 2),
+    })
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import AdmissionController, AdmissionRejected, Priority
+
+
+async def hold(controller, priority, started, release, admitted, name):
+    async with controller.aslot(priority):
+        admitted.append(name)
+        started.set()
+        await release.wait()
+
+
+async def queue_behind_holder(controller, priorities):
+    """Fill the only slot, queue one waiter per priority, then release; returns the admission order."""
+    admitted = []
+    started, release = asyncio.Event(), asyncio.Event()
+    holder = asyncio.ensure_future(hold(controller, Priority.INTERACTIVE, started, release, admitted, "holder"))
+    await started.wait()
+
+    done = asyncio.Event()
+    done.set()
+    waiters = []
+    for priority in priorities:
+        waiters.append(asyncio.ensure_future(hold(controller, priority, asyncio.Event(), done, admitted, priority.name)))
+        await asyncio.sleep(0)
+    assert controller.stats()["queue_depth"] == len(priorities)
+
+    release.set()
+    await asyncio.gather(holder, *waiters)
+    return admitted[1:]
+
+
+def test_admits_immediately_below_limit():
+    controller = AdmissionController(max_in_flight=2)
+
+    with controller.slot():
+        with controller.slot():
+            assert controller.stats()["in_flight"] == 2
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["admitted"] == 2
+
+
+def test_queued_waiters_are_admitted_by_priority_then_arrival():
+    controller = AdmissionController(max_in_flight=1, max_queue=8)
+
+    order = asyncio.run(queue_behind_holder(
+        controller, [Priority.BACKGROUND, Priority.BATCH, Priority.INTERACTIVE, Priority.BATCH]
+    ))
+
+    assert order == ["INTERACTIVE", "BATCH", "BATCH", "BACKGROUND"]
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_full_queue_rejects_equal_priority_with_429():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.ensure_future(hold(controller, Priority.BATCH, started, release, [], "holder"))
+        await started.wait()
+        waiter = asyncio.ensure_future(hold(controller, Priority.BATCH, asyncio.Event(), release, [], "waiter"))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.aslot(Priority.BATCH):
+                    pass
+        finally:
+            release.set()
+            await asyncio.gather(holder, waiter)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert controller.stats()["rejected_queue_full"] == 1
+
+
+def test_full_queue_sheds_lower_priority_waiter_with_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+
+    async def scenario():
+        admitted = []
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.ensure_future(hold(controller, Priority.INTERACTIVE, started, release, admitted, "holder"))
+        await started.wait()
+        background = asyncio.ensure_future(
+            hold(controller, Priority.BACKGROUND, asyncio.Event(), release, admitted, "background")
+        )
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(
+            hold(controller, Priority.INTERACTIVE, asyncio.Event(), release, admitted, "interactive")
+        )
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as shed:
+            await background
+        release.set()
+        await asyncio.gather(holder, interactive)
+        return shed.value, admitted
+
+    shed, admitted = asyncio.run(scenario())
+
+    assert shed.status_code == 503
+    assert admitted == ["holder", "interactive"]
+    assert controller.stats()["shed"] == 1
+
+
+def test_waiter_times_out_with_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=4)
+
+    with controller.slot():
+        with pytest.raises(AdmissionRejected) as expired:
+            with controller.slot(Priority.BATCH, queue_timeout=0.05):
+                pass
+
+    assert expired.value.status_code == 503
+    stats = controller.stats()
+    assert stats["expired"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
@@ -0,0 +1,83 @@
+import pytest
+
+from app.services import llama_service, vector_search_service
+from app.services.admission import AdmissionController, AdmissionRejected
+from app.services.ai_service import GENERATION_ERROR
+from app.services.chat_service import ChatService
+from app.services.embedding_service import embed_bulk_text
+from app.services.llm_router import FakeBackend, LLMRouter
+from app.services.vector_index import VectorIndex
+
+TEXTS = [
+    "Nitrile gloves purchased from McKesson by a Pacific hospital",
+    "Surgical masks purchased from Cencora by a Mountain clinic",
+    "Gauze pads purchased from Medline by an Atlantic hospital",
+]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = VectorIndex()
+    metadata = [{"region": region, "item": text} for region, text in zip(("Pacific", "Mountain", "Atlantic"), TEXTS)]
+    index.add_many([f"doc{i}" for i in range(len(TEXTS))], embed_bulk_text(TEXTS), metadata, texts=TEXTS)
+    monkeypatch.setattr(vector_search_service, "_index", index)
+    monkeypatch.setattr(llama_service, "response_cache", None)
+    monkeypatch.setattr(llama_service, "single_flight", None)
+    monkeypatch.setattr(llama_service, "admission", None)
+    return index
+
+
+def use_backends(monkeypatch, *backends):
+    router = LLMRouter(backends, hedging=False)
+    monkeypatch.setattr(llama_service, "llm_router", router)
+    return router
+
+
+def test_answers_with_retrieved_context(index, monkeypatch):
+    use_backends(monkeypatch, FakeBackend("primary", answer="{name} saw: {prompt}"))
+
+    result = ChatService(top_k=2).process_query("Which gloves did we buy?", use_cache=False)
+
+    assert result["answer"].startswith("primary saw:")
+    assert "Nitrile gloves" in result["answer"]
+    assert result["sources"]
+
+
+def test_fails_over_when_primary_backend_fails(index, monkeypatch):
+    router = use_backends(monkeypatch, FakeBackend("primary", failure_rate=1.0), FakeBackend("secondary", answer="ok"))
+
+    result = ChatService().process_query("gloves", use_cache=False)
+
+    assert result["answer"] == "ok"
+    assert router.stats()["failovers"] == 1
+
+
+def test_generation_error_when_every_backend_fails(index, monkeypatch):
+    use_backends(monkeypatch, FakeBackend("primary", failure_rate=1.0), FakeBackend("secondary", failure_rate=1.0))
+
+    assert ChatService().process_query("gloves", use_cache=False)["answer"] == GENERATION_ERROR.strip()
+
+
+def test_overload_is_raised_not_answered(index, monkeypatch):
+    use_backends(monkeypatch, FakeBackend("primary"))
+    monkeypatch.setattr(llama_service, "admission", AdmissionController(max_in_flight=0, max_queue=0))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        ChatService().process_query("gloves", use_cache=False)
+    assert rejected.value.status_code == 429
+
+
+def test_diversify_keeps_fused_order_as_relevance():
+    query = [1.0, 0.0, 0.0]
+
+    def chunk(item, vector):
+        return {"text": item, "similarity": vector[0], "vector": vector, "metadata": {"item_desc": item}}
+
+    # Ranked first by hybrid fusion (e.g. an exact BM25 match) despite a low cosine similarity.
+    lexical = chunk("Nitrile gloves", [0.1, 1.0, 0.0])
+    close = chunk("Latex gloves", [1.0, 0.0, 0.05])
+    closer = chunk("Vinyl gloves", [1.0, 0.0, -0.05])
+
+    picked = ChatService(top_k=2).diversify(query, [lexical, close, closer])
+
+    assert [c["text"] for c in picked] == ["Nitrile gloves", "Latex gloves"]
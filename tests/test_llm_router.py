@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.llm_router import FakeBackend, LLMRouter, NoHealthyBackend
+
+
+class RejectingBackend(FakeBackend):
+    """Answers every request with a client error, which is the request's fault, not the backend's."""
+
+    def complete(self, prompt, max_tokens, temperature, timeout=None):
+        self.calls = getattr(self, "calls", 0) + 1
+        raise HTTPException(status_code=400, detail="bad request")
+
+
+class StreamingBackend(FakeBackend):
+    """Streams fixed tokens, raising after fail_after of them (None: never)."""
+
+    def __init__(self, name, tokens=("a", "b", "c"), fail_after=None):
+        super().__init__(name)
+        self.tokens = tokens
+        self.fail_after = fail_after
+
+    async def astream(self, prompt, max_tokens, temperature, timeout=None):
+        for i, token in enumerate(self.tokens):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise RuntimeError(f"{self.name} failed")
+            yield token
+
+
+def make_router(*backends, **params):
+    params.setdefault("hedging", False)
+    return LLMRouter(backends, **params)
+
+
+def breaker(router, index=0):
+    return router.backends[index].breaker
+
+
+def test_answers_from_primary_when_healthy():
+    router = make_router(FakeBackend("primary"), FakeBackend("secondary"))
+
+    answer, backend = router.route("hi")
+
+    assert answer == "primary: hi"
+    assert backend.name == "primary"
+    assert router.stats()["failovers"] == 0
+
+
+def test_fails_over_to_next_backend():
+    router = make_router(FakeBackend("primary", failure_rate=1.0), FakeBackend("secondary"))
+
+    assert router.complete("hi") == "secondary: hi"
+    assert asyncio.run(router.acomplete("hi")) == "secondary: hi"
+    assert router.stats()["failovers"] == 2
+    assert router.stats()["backends"][0]["failures"] == 2
+
+
+def test_raises_last_error_when_every_backend_fails():
+    router = make_router(FakeBackend("primary", failure_rate=1.0), FakeBackend("secondary", failure_rate=1.0))
+
+    with pytest.raises(RuntimeError, match="secondary failed"):
+        router.complete("hi")
+
+
+def test_breaker_opens_after_threshold_and_skips_backend():
+    primary = FakeBackend("primary", failure_rate=1.0)
+    router = make_router(primary, FakeBackend("secondary"), failure_threshold=2, reset_seconds=60)
+
+    router.complete("one")
+    assert breaker(router).state == "closed"
+    router.complete("two")
+    assert breaker(router).state == "open"
+
+    primary.failure_rate = 0.0
+    assert router.complete("three") == "secondary: three"
+    assert router.stats()["backends"][0]["calls"] == 2
+
+
+def test_breaker_half_open_trial_success_closes_it():
+    primary = FakeBackend("primary", failure_rate=1.0)
+    router = make_router(primary, FakeBackend("secondary"), failure_threshold=1, reset_seconds=0.05)
+
+    router.complete("one")
+    assert breaker(router).state == "open"
+
+    primary.failure_rate = 0.0
+    time.sleep(0.06)
+    assert router.complete("two") == "primary: two"
+    assert breaker(router).state == "closed"
+
+
+def test_breaker_half_open_trial_failure_reopens_it():
+    router = make_router(
+        FakeBackend("primary", failure_rate=1.0), FakeBackend("secondary"), failure_threshold=3, reset_seconds=0.05
+    )
+
+    for _ in range(3):
+        router.complete("q")
+    assert breaker(router).state == "open"
+
+    time.sleep(0.06)
+    assert router.complete("q") == "secondary: q"
+    assert breaker(router).state == "open"
+    assert breaker(router).times_opened == 2
+
+
+def test_no_healthy_backend_when_every_breaker_is_open():
+    router = make_router(FakeBackend("only", failure_rate=1.0), failure_threshold=1, reset_seconds=60)
+
+    with pytest.raises(RuntimeError):
+        router.complete("q")
+    with pytest.raises(NoHealthyBackend):
+        router.complete("q")
+    assert router.stats()["unavailable"] == 1
+
+
+def test_client_error_neither_trips_breaker_nor_fails_over():
+    rejecting = RejectingBackend("primary")
+    secondary = FakeBackend("secondary")
+    router = make_router(rejecting, secondary, failure_threshold=1)
+
+    with pytest.raises(HTTPException) as error:
+        router.complete("q")
+
+    assert error.value.status_code == 400
+    assert breaker(router).state == "closed"
+    assert router.stats()["backends"][1]["calls"] == 0
+
+
+def test_hedge_goes_to_next_backend_when_primary_is_slow():
+    router = make_router(
+        FakeBackend("primary", latency=0.5),
+        FakeBackend("secondary"),
+        hedging=True,
+        hedge_delay_seconds=0.05,
+        hedge_min_delay_seconds=0.01,
+    )
+
+    started = time.perf_counter()
+    answer, backend = asyncio.run(router.aroute("q"))
+
+    assert answer == "secondary: q"
+    assert backend.name == "secondary"
+    assert time.perf_counter() - started < 0.4
+    stats = router.stats()
+    assert stats["hedged"] == 1
+    assert stats["secondary_wins"] == 1
+
+
+def test_blocking_hedge_returns_fastest_answer():
+    router = make_router(
+        FakeBackend("primary", latency=0.5),
+        FakeBackend("secondary"),
+        hedging=True,
+        hedge_delay_seconds=0.05,
+        hedge_min_delay_seconds=0.01,
+    )
+
+    started = time.perf_counter()
+
+    assert router.complete("q") == "secondary: q"
+    assert time.perf_counter() - started < 0.4
+    assert router.stats()["hedged"] == 1
+
+
+def test_no_hedge_before_delay_or_when_disabled():
+    fast = make_router(FakeBackend("primary", latency=0.02), FakeBackend("secondary"),
+                       hedging=True, hedge_delay_seconds=1.0)
+    disabled = make_router(FakeBackend("primary", latency=0.1), FakeBackend("secondary"), hedge_delay_seconds=0.01)
+
+    assert asyncio.run(fast.acomplete("q")) == "primary: q"
+    assert asyncio.run(disabled.acomplete("q")) == "primary: q"
+    assert fast.stats()["hedged"] == disabled.stats()["hedged"] == 0
+
+
+async def collect(router, prompt="q"):
+    backend, tokens = await router.aopen_stream(prompt)
+    try:
+        return backend.name, [token async for token in tokens]
+    finally:
+        await tokens.aclose()
+
+
+def test_stream_fails_over_before_first_token():
+    router = make_router(StreamingBackend("primary", fail_after=0), StreamingBackend("secondary"))
+
+    assert asyncio.run(collect(router)) == ("secondary", ["a", "b", "c"])
+    assert router.stats()["failovers"] == 1
+    assert router.stats()["backends"][0]["failures"] == 1
+
+
+def test_stream_error_after_first_token_is_raised_and_recorded():
+    router = make_router(StreamingBackend("primary", fail_after=1), StreamingBackend("secondary"),
+                         failure_threshold=1)
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        asyncio.run(collect(router))
+
+    assert breaker(router).state == "open"
+    assert router.stats()["backends"][1]["calls"] == 0
+
+
+def test_stream_falls_back_to_whole_answer_without_astream():
+    router = make_router(FakeBackend("plain"))
+
+    assert asyncio.run(collect(router)) == ("plain", ["plain: q"])
+    assert router.stats()["backends"][0]["calls"] == 1
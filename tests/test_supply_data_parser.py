@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from app.utils.supply_data_parser import SummaryRollup, csv_to_summary_chunks, embedding_text, embedding_texts
+
+
+def purchases(**overrides):
+    rows = {
+        "TransactionID": [1, 2, 3],
+        "FacilityID": [10, 11, 10],
+        "FacilityType": ["Hospital", "Hospital", "Clinic"],
+        "Region": ["Pacific", "Pacific", "Pacific"],
+        "Month": [1, 1, 1],
+        "Year": [2023, 2023, 2023],
+        "Vendor": ["Acme", "Acme", "Acme"],
+        "Manufacturer": ["Acme", "Globex", "Globex"],
+        "ItemDesc": ["Gloves", "Gloves", "Gloves"],
+        "Quantity": [1, 2, 3],
+        "TotalSpend": [10.0, 20.0, 30.0],
+    }
+    rows.update(overrides)
+    return pd.DataFrame(rows)
+
+
+def test_missing_manufacturer_is_not_embedded():
+    df = purchases(Manufacturer=[np.nan, "  ", "Globex"])
+
+    assert embedding_texts(df) == ["Gloves from Acme", "Gloves from Acme", "Gloves from Acme, manufactured by Globex"]
+    assert embedding_text({"item_desc": "Gloves", "vendor": "Acme", "manufacturer": float("nan")}) == "Gloves from Acme"
+
+
+def test_summaries_keep_rows_with_missing_keys():
+    chunks = {chunk["id"]: chunk for chunk in csv_to_summary_chunks(purchases(Region=[np.nan, np.nan, "Pacific"]), "f")}
+
+    assert chunks["summary:f:total:year:2023"]["metadata"]["purchases"] == 3
+    unknown = chunks["summary:f:region:year:None|2023"]
+    assert unknown["metadata"]["purchases"] == 2
+    assert "the unknown region" in unknown["text"]
+
+
+def test_summaries_without_optional_columns():
+    chunks = csv_to_summary_chunks(purchases().drop(columns=["FacilityID"]), "f")
+
+    total = next(chunk for chunk in chunks if chunk["id"] == "summary:f:total:year:2023")
+    assert total["metadata"]["total_spend"] == 60.0
+    assert "across" not in total["text"]
+
+
+def test_rollup_merges_missing_keys_across_batches():
+    rollup = SummaryRollup()
+    try:
+        for _ in range(2):
+            rollup.add(purchases(Region=[np.nan, np.nan, np.nan]))
+        stored = rollup._conn.execute("SELECT COUNT(*) FROM rollup").fetchone()[0]
+        (region, year, count, quantity, spend, facilities, leaders), = rollup.totals(["Region", "Year"], "Vendor")
+    finally:
+        rollup.close()
+
+    assert stored == 3
+    assert (region, year, count, quantity, spend, facilities) == (None, 2023, 6, 12, 120.0, 2)
+    assert leaders == "Acme ($120.00)"
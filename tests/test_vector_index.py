@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from app.services.vector_index import VectorIndex
+
+DIM = 16
+REGIONS = ("Pacific", "Mountain", "Atlantic")
+
+
+def make_index(count=300, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, DIM)).astype(np.float32)
+    metadata = [{"region": REGIONS[i % 3], "year": 2020 + i % 4} for i in range(count)]
+    index = VectorIndex()
+    index.add_many([f"doc{i}" for i in range(count)], vectors, metadata, texts=[f"text {i}" for i in range(count)])
+    return index, vectors, metadata
+
+
+def brute_force(vectors, query, top_k, keep=None):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = unit @ (query / np.linalg.norm(query))
+    rows = np.arange(len(vectors)) if keep is None else np.flatnonzero(keep)
+    order = rows[np.argsort(-scores[rows], kind="stable")][:top_k]
+    return [(int(row), float(scores[row])) for row in order]
+
+
+def assert_same_hits(actual, expected):
+    assert [row for row, _ in actual] == [row for row, _ in expected]
+    np.testing.assert_allclose([score for _, score in actual], [score for _, score in expected], rtol=1e-5)
+
+
+def test_exact_search_matches_brute_force():
+    index, vectors, _ = make_index()
+    query = np.random.default_rng(1).normal(size=DIM).astype(np.float32)
+
+    assert_same_hits(index.search(query, 10, exact=True), brute_force(vectors, query, 10))
+
+
+def test_filtered_search_matches_brute_force_over_matching_rows():
+    index, vectors, metadata = make_index()
+    query = np.random.default_rng(2).normal(size=DIM).astype(np.float32)
+    filters = {"region": "Pacific", "year": {"gte": 2022}}
+    keep = np.array([meta["region"] == "Pacific" and meta["year"] >= 2022 for meta in metadata])
+
+    hits = index.search(query, 10, filters=filters)
+
+    assert_same_hits(hits, brute_force(vectors, query, 10, keep))
+    assert all(keep[row] for row, _ in hits)
+
+
+def test_batch_search_matches_single_queries():
+    index, _, _ = make_index()
+    queries = np.random.default_rng(3).normal(size=(7, DIM)).astype(np.float32)
+
+    for filters in (None, {"region": ["Mountain", "Atlantic"]}):
+        batch = index.search_batch(queries, 5, filters=filters, exact=True, max_block_bytes=4 * 300 * 2)
+        for query, hits in zip(queries, batch):
+            assert_same_hits(hits, index.search(query, 5, filters=filters, exact=True))
+
+
+@pytest.mark.parametrize("kind", ["ivf", "hnsw"])
+def test_ann_search_finds_exact_neighbours_of_indexed_vectors(kind):
+    index, vectors, _ = make_index()
+    index.build_ann(kind)
+
+    for row in (0, 57, 299):
+        assert index.search(vectors[row], 1)[0][0] == row
+
+
+def test_upsert_replaces_existing_ids_and_appends_new_ones():
+    index, vectors, _ = make_index(count=50)
+    replacement = -vectors[3]
+
+    index.upsert_many(
+        ["doc3", "new"],
+        [replacement, vectors[10] + 0.01],
+        [{"region": "Atlantic", "year": 2030}, {"region": "Pacific", "year": 2021}],
+        texts=["replaced text", "new text"],
+    )
+
+    assert len(index) == 52
+    position = index.position("doc3")
+    assert index.ids[position] == "doc3"
+    assert index.texts[position] == "replaced text"
+    result = index.result(*index.search(replacement, 1, exact=True)[0])
+    assert result["id"] == "doc3"
+    assert result["metadata"]["year"] == 2030
+    assert index.position("new") is not None
+
+
+def test_upserted_entry_leaves_no_trace_of_old_version():
+    index, vectors, _ = make_index(count=50)
+    old_vector = vectors[3]
+
+    index.upsert_many(["doc3"], [-old_vector], [{"region": "Atlantic", "year": 2030}], texts=["fresh words"])
+
+    ids = [index.ids[row] for row, _ in index.search(old_vector, 50, exact=True)]
+    assert ids.count("doc3") == 1
+    assert ids[-1] == "doc3"
+    assert [index.ids[row] for row, _ in index.search(old_vector, 50, filters={"year": 2023})].count("doc3") == 0
+    assert [index.ids[row] for row, _ in index.search(old_vector, 50, filters={"year": 2030})] == ["doc3"]
+    assert [row for row, _ in index.lexical.search("3", 50)] == []
+    assert index.ids[index.search(-old_vector, 1, query_text="fresh words")[0][0]] == "doc3"
+
+
+def test_upsert_last_duplicate_wins():
+    index, _, _ = make_index(count=10)
+    first, last = np.random.default_rng(5).normal(size=(2, DIM)).astype(np.float32)
+
+    index.upsert_many(["doc1", "doc1"], [first, last], [{"year": 1}, {"year": 2}])
+
+    row, _ = index.search(last, 1, exact=True)[0]
+    assert index.ids[row] == "doc1"
+    assert index.result(row, 1.0)["metadata"]["year"] == 2
+    assert len(index) == 11
+
+
+@pytest.mark.parametrize("kind", ["ivf", "hnsw"])
+def test_upsert_keeps_ann_results_live_and_rebuilds_past_threshold(kind):
+    index, vectors, _ = make_index()
+    index.build_ann(kind)
+    engine = index.ann
+    rng = np.random.default_rng(4)
+
+    index.upsert_many(["doc0"], [-vectors[0]], [{"region": "Pacific"}])
+    assert index.ann is engine
+    # The old entry (row 0) is tombstoned: the engine still holds it but never returns it.
+    assert 0 not in [row for row, _ in index.search(vectors[0], 20)]
+
+    ids = [f"doc{i}" for i in range(1, 151)]
+    index.upsert_many(ids, rng.normal(size=(len(ids), DIM)).astype(np.float32), [{} for _ in ids])
+    assert index.ann is not engine
+    assert type(index.ann) is type(engine)
+    row, _ = index.search(index.get_vectors(np.array([index.position("doc42")]))[0], 1)[0]
+    assert row == index.position("doc42")